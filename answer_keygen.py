@@ -2,127 +2,101 @@
 Author:
     Jose Stovall
 
-Turns a given CSV (via cmd args) into an answer key for the CSCDC
+Turns a given CSV (via cmd args) into an answer key for the CSCDC, or builds one straight from ElasticSearch
 
 Commandline Args:
     path to csv file (str): The path (relative or absolute) to the CSV file to turn into an answer key for the CSCDC
+    --elastic [optional]: Aggregate the answer key server-side instead; no CSV is needed
+    --host [optional]: The ElasticSearch host used with --elastic, as host[:port]
+    --month, --days, --hours [optional]: The window the answer key covers, e.g. --month=2019-06 --days=25-29 --hours=7-19
 """
 
 import datetime
-import os
 import sys
 
 import pandas as pd
-from dateutil import parser
 from pip._vendor.colorama import Fore
 
+from elastic_fetching import AIR_QUALITY
+from elastic_fetching.aggregations import hourly_answer_key
+from elastic_fetching.answer_key import Window, answer_key
+from elastic_fetching.cli import parse_host
+from elastic_fetching.client import get_client
+from elastic_fetching.engine import DEFAULT_HOST
 
-def to_date_string(timestamp):
-    """
-    Args:
-        timestamp (pandas.Timestamp): A Pandas Timestamp object
-    Returns:
-        date (str): a string date of form YYYY-MM-DD in its proper timezone
-    """
-    to_datetime = timestamp.to_pydatetime()
-    to_datetime = to_datetime.replace(tzinfo=datetime.timezone.utc).astimezone(tz=None)
-    return "{}-{}-{}".format(to_datetime.year, to_datetime.month, to_datetime.day)
+DEFAULT_MONTH = "2019-06"
+DEFAULT_DAYS = "25-29"
+DEFAULT_HOURS = "7-19"
 
 
-def to_time_string(timestamp):
+def to_range(span):
     """
     Args:
-        timestamp (pandas.Timestamp): A Pandas Timestamp object
+        span (str): An inclusive range of form FIRST-LAST, e.g. 25-29, or a single number
     Returns:
-        time (str): a string time of form HH:MM:SS in its proper timezone
+        range (range): Every number in the span
     """
-    to_datetime = timestamp.to_pydatetime()
-    to_datetime = to_datetime.replace(tzinfo=datetime.timezone.utc).astimezone(tz=None)
-    return "{}:{}:{}".format(to_datetime.hour, to_datetime.minute, to_datetime.second)
+    first, _, last = span.partition("-")
+    return range(int(first), int(last or first) + 1)
 
 
-def clean(dataframe):
+def get_option(args, name, default):
     """
     Args:
-        dataframe (pandas.DataFrame): A Pandas DataFrame Object
+        args (list): The commandline args
+        name (str): The option to look for, e.g. --days
+        default (str): The value to use when the option isn't given
     Returns:
-        cleaned dataframe (pandas.DataFrame): A Pandas DataFrame object without columns not needed for the answer key
+        value (str): The value given as `name=value`, or `default`
     """
-    cols_to_keep = ["date", "time", "nicename", "pm2_5_cf_1"]
-    df = dataframe.copy()
-    # Get rid of empty cols
-    for col_name in df.columns:
-        if not col_name in cols_to_keep:
-            df.drop([col_name], inplace=True, axis=1)
-    return df
+    for arg in args:
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1 :]
+    return default
 
 
-def main(file_path):
+def main(file_path, window, host=None):
     """
     Main program loop which will parse and clean the CSV file for you, saving to a new one if accepted.
     Args:
-        file_path (str): Path (absolute or relative) to the CSV to convert
+        file_path (str): Path (absolute or relative) to the CSV to convert; with `host`, where to save instead
+        window (elastic_fetching.answer_key.Window): The days and hours the answer key should cover
+        host (dict) [optional]: Aggregate the answer key on this ElasticSearch host rather than reading a CSV
 
     """
-    try:
-        df = pd.read_csv(file_path)
-    except FileNotFoundError:
-        print(
-            Fore.RED
-            + "File could not be found. Please ensure that your path is correct and any double \\'s are removed."
-            + Fore.RESET
-        )
-        exit()
-    df["timestamp-iso"] = pd.to_datetime(df["timestamp-iso"])
-    df["date"] = df["timestamp-iso"].apply(lambda x: to_date_string(x))
-    df["time"] = df["timestamp-iso"].apply(lambda x: to_time_string(x))
-    new_df = pd.DataFrame()
-
-    # completion_map is a map of every hour of every day of every AQ sensor to see if we've gotten all the data we're supposed to
-    completion_map = {}
-    for nicename in df.nicename.unique().tolist():
-        completion_map[nicename] = {}
-        for day in range(25, 30):
-            completion_map[nicename][day] = {}
-            for hour in range(7, 20):
-                completion_map[nicename][day][hour] = False
-
-    # Start iterating and parsing out these dates to determine if the day is in range and the time is in range
-    start_day = 25
-    end_day = 29
-    for _, row in df.iterrows():
-        day = int(row.date[row.date.rindex("-") + 1 :])
-        if day >= start_day and day <= end_day:
-            hour = int(row.time[: row.time.index(":")])
-            if hour not in completion_map[row.nicename][day]:
-                continue
-            minute = int(row.time[row.time.index(":") + 1 : row.time.rindex(":")])
-            if minute == 0:
-                new_df = new_df.append(row)
-                completion_map[row.nicename][day][hour] = True
-            elif minute == 1 and not completion_map[row.nicename][day][hour]:
-                new_df = new_df.append(row)
-                completion_map[row.nicename][day][hour] = True
+    if host is not None:
+        new_df, missing = hourly_answer_key(get_client(host), AIR_QUALITY, window)
+    else:
+        try:
+            df = pd.read_csv(
+                file_path, usecols=["timestamp-iso", "nicename", "pm2_5_cf_1"]
+            )
+        except FileNotFoundError:
+            print(
+                Fore.RED
+                + "File could not be found. Please ensure that your path is correct and any double \\'s are removed."
+                + Fore.RESET
+            )
+            exit()
+        new_df, missing = answer_key(df, window)
 
     # Notify the user of any gaps in the data if there are any
-    printed = False
-    for nicename in df.nicename.unique().tolist():
-        for day in range(25, 30):
-            for hour in range(7, 20):
-                if not completion_map[nicename][day][hour]:
-                    if not printed:
-                        # Print this just once - if there are no missing values this won't print at all!
-                        print("Missing info for:")
-                        printed = True
-                    print("  • 2019-6-{}  |  {}:00".format(day, hour))
+    printed = not missing.empty
+    if printed:
+        print("Missing info for:")
+    for nicename, day, hour in missing.itertuples(index=False):
+        print(
+            "  • {}  |  {}-{}-{}  |  {}:00".format(
+                nicename, window.year, window.month, day, hour
+            )
+        )
 
     # Prompt the user to save the file (append the word 'anyways' in the event that there was missing data) - notify user of save location
     prompt = input("Save{}? Y/N:  ".format(" anyways" if printed else ""))
     if prompt.lower() == "y":
-        new_df = clean(new_df)
         name = (
             file_path
-            if "--inplace" in sys.argv
+            if "--inplace" in sys.argv and file_path is not None
             else "answer_key_{}.csv".format(datetime.datetime.now())
         )
         new_df.to_csv(name, index=False)
@@ -135,7 +109,14 @@ if __name__ == "__main__":
         path to csv file (str): The path (relative or absolute) to the CSV file to turn into an answer key for the CSCDC
     """
     args = sys.argv
-    if "--help" in args or "help" in args or len(args) < 2 or len(args) > 3:
+    positional = [arg for arg in args[1:] if not arg.startswith("--")]
+    elastic = "--elastic" in args
+    if (
+        "--help" in args
+        or "help" in args
+        or len(positional) > 1
+        or (not elastic and len(positional) != 1)
+    ):
         print(
             "Command-line Arguments ({}*{} indicates required):".format(
                 Fore.CYAN, Fore.RESET
@@ -151,6 +132,39 @@ if __name__ == "__main__":
             + "  • --inplace: Whether or not to directly modify the CSV file you pass in. This is not recommended unless you make a backup"
             + Fore.RESET
         )
+        print(
+            Fore.LIGHTBLACK_EX
+            + "  • --month=YYYY-MM: The month the answer key covers. Defaults to {}".format(
+                DEFAULT_MONTH
+            )
+            + Fore.RESET
+        )
+        print(
+            Fore.LIGHTBLACK_EX
+            + "  • --days=FIRST-LAST: The days of the month the answer key covers, inclusive. Defaults to {}".format(
+                DEFAULT_DAYS
+            )
+            + Fore.RESET
+        )
+        print(
+            Fore.LIGHTBLACK_EX
+            + "  • --hours=FIRST-LAST: The hours of each day the answer key covers, inclusive, in local time. Defaults to {}".format(
+                DEFAULT_HOURS
+            )
+            + Fore.RESET
+        )
+        print(
+            Fore.LIGHTBLACK_EX
+            + "  • --elastic: Aggregate the answer key on ElasticSearch instead of reading a CSV. A path, if given, is where it's saved with --inplace"
+            + Fore.RESET
+        )
+        print(
+            Fore.LIGHTBLACK_EX
+            + "  • --host=HOST[:PORT]: The ElasticSearch host used with --elastic. Defaults to {}".format(
+                DEFAULT_HOST["host"]
+            )
+            + Fore.RESET
+        )
         print(Fore.LIGHTBLACK_EX + "  • --help, ?: Shows this." + Fore.RESET)
         exit()
     else:
@@ -165,4 +179,14 @@ if __name__ == "__main__":
                 + "Hit CTRL+C (^C) now to abort before it's too late"
                 + Fore.RESET
             )
-        main(args[1])
+        year, month = get_option(args, "--month", DEFAULT_MONTH).split("-")
+        window = Window(
+            int(year),
+            int(month),
+            days=to_range(get_option(args, "--days", DEFAULT_DAYS)),
+            hours=to_range(get_option(args, "--hours", DEFAULT_HOURS)),
+        )
+        host = None
+        if elastic:
+            host = parse_host(get_option(args, "--host", DEFAULT_HOST["host"]))
+        main(positional[0] if positional else None, window, host)
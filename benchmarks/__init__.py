@@ -0,0 +1,9 @@
+"""
+Offline benchmarks for the fetch engines.
+
+`benchmarks.fake_es` stands in for the search/scroll/count/point-in-time APIs of the research cluster, serving
+synthetic or recorded documents, and `benchmarks.run` times the real command-line tool against it. Run them from the
+repository root:
+
+    python -m benchmarks.run --dataset vision_events --strategies hourly,sliced-scroll --workers 2,4
+"""
@@ -0,0 +1,520 @@
+"""
+A local stand-in for the parts of the ElasticSearch REST API the fetch engines use.
+
+Supported: `_search` (range queries, `_source` filtering, scrolls, slices, point-in-time + `search_after`, and the
+`date_histogram` the adaptive planner asks for), `_msearch`, `_search/scroll`, `_count` and `_pit`. Every request is
+delayed by `latency` seconds to stand in for the network and the cluster.
+
+Documents come from a corpus: `SyntheticCorpus` generates them on the fly at a fixed rate, `RecordedCorpus` replays
+a JSON-lines file of `_source` documents (or whole hits). Serve one on its own with
+
+    python -m benchmarks.fake_es vision_events --port 9201
+
+and point any fetch at it with `--host localhost:9201`.
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+LABELS = ["car", "person", "bus", "truck", "bicycle"]
+VERSION = {"number": "7.10.2", "build_flavor": "default"}
+REJECTED = (
+    429,
+    {
+        "error": {
+            "type": "es_rejected_execution_exception",
+            "reason": "rejected execution of coordinating operation",
+        },
+        "status": 429,
+    },
+)
+
+
+def vision_event(k, timestamp):
+    """
+    Args:
+        k (int): The document's position in the corpus
+        timestamp (int): Its timestamp in epoch milliseconds
+    Returns:
+        source (dict): A `cuip_vision_events` document
+    """
+    source = {
+        "camera_id": "cam{:02d}".format(k % 16),
+        "id": str(k),
+        "intersection": "mlk-{}".format(k % 8),
+        "label": LABELS[k % len(LABELS)],
+        "locations": [[k % 640, k % 480, 32, 64] for _ in range(1 + k % 3)],
+        "pole_id": "pole{}".format(k % 8),
+        "timestamp": timestamp,
+    }
+    # Hit counts are sometimes missing on the real index too
+    if k % 7:
+        source["hit_counts"] = 1 + k % 3
+    return source
+
+
+def air_quality(k, timestamp):
+    """
+    Args:
+        k (int): The document's position in the corpus
+        timestamp (int): Its timestamp in epoch milliseconds
+    Returns:
+        source (dict): An air quality document, diagnostic fields included
+    """
+    reading = (k % 97) / 3.0
+    source = {
+        "nicename": "sensor-{:02d}".format(k % 20),
+        "current_dewpoint_f": 60.0 + k % 10,
+        "current_humidity": 50.0 + k % 30,
+        "current_temp_f": 70.0 + k % 15,
+        "lat": 35.04,
+        "lon": -85.3,
+        "timestamp": timestamp,
+        "SensorId": "84:f3:eb:{:02x}".format(k % 20),
+        "Adc": 0.02,
+        "DateTime": "2019/06/01T00:00:00z",
+        "pressure": 980.5,
+        "version": "4.11",
+        "status_0": 2,
+    }
+    for field in (
+        "p_0_3_um",
+        "p_0_5_um",
+        "p_1_0_um",
+        "p_2_5_um",
+        "p_5_0_um",
+        "p_10_0_um",
+    ):
+        source[field] = source[field + "_b"] = reading * 10
+    for field in ("pm1_0", "pm2_5", "pm10_0"):
+        for kind in ("atm", "cf_1"):
+            source["{}_{}".format(field, kind)] = reading
+            source["{}_{}_b".format(field, kind)] = reading + 0.5
+    return source
+
+
+GENERATORS = {"vision_events": vision_event, "air_quality": air_quality}
+
+
+class SyntheticCorpus:
+    """
+    An endless corpus with one document every `60000 / docs_per_minute` milliseconds since the epoch
+    Args:
+        dataset (str): One of `GENERATORS`
+        docs_per_minute (float) [optional]: How densely documents are packed
+        padding (int) [optional]: Characters of filler added to every document, to vary their size
+    """
+
+    def __init__(self, dataset, docs_per_minute=100, padding=0):
+        self.generate = GENERATORS[dataset]
+        self.interval = 60000.0 / docs_per_minute
+        self.padding = "x" * padding
+
+    def find(self, gte, lt):
+        # The positions of the first document at or after `gte` and of the first at or after `lt`
+        first = max(int(-(-gte // self.interval)), 0)
+        last = max(int(-(-lt // self.interval)), 0)
+        return first, last
+
+    def timestamp(self, k):
+        return int(k * self.interval)
+
+    def doc(self, k):
+        source = self.generate(k, self.timestamp(k))
+        if self.padding:
+            source["padding"] = self.padding
+        return source
+
+
+class RecordedCorpus:
+    """
+    Replays recorded documents
+    Args:
+        path (str): A JSON-lines file of `_source` documents, or of hits holding them
+        timestamp_field (str) [optional]: The field documents are ordered by
+    """
+
+    def __init__(self, path, timestamp_field="timestamp"):
+        docs = []
+        with open(path) as recording:
+            for line in recording:
+                if line.strip():
+                    doc = json.loads(line)
+                    docs.append(doc.get("_source", doc))
+        docs.sort(key=lambda doc: doc[timestamp_field])
+        self.docs = docs
+        self.timestamps = [doc[timestamp_field] for doc in docs]
+
+    def find(self, gte, lt):
+        return (
+            bisect.bisect_left(self.timestamps, gte),
+            bisect.bisect_left(self.timestamps, lt),
+        )
+
+    def timestamp(self, k):
+        return self.timestamps[k]
+
+    def doc(self, k):
+        return self.docs[k]
+
+
+def _range(query):
+    # Only the range queries the fetch engines send (alone, or several in a bool filter) are understood
+    if "bool" in query:
+        bounds = [_range(clause) for clause in query["bool"]["filter"]]
+        return max(gte for gte, _ in bounds), min(lt for _, lt in bounds)
+    bounds = next(iter(query["range"].values()))
+    return int(bounds.get("gte", 0)), int(bounds.get("lt", 2**62))
+
+
+def _project(source, source_filter):
+    if not source_filter:
+        return source
+    includes = source_filter.get("includes")
+    excludes = set(source_filter.get("excludes", ()))
+    return {
+        field: value
+        for field, value in source.items()
+        if (includes is None or field in includes) and field not in excludes
+    }
+
+
+class Cursor:
+    """
+    Where a scroll or a point-in-time slice has got to
+    Args:
+        corpus (object): The corpus being searched
+        body (dict): The search body
+    """
+
+    def __init__(self, corpus, body):
+        self.corpus = corpus
+        self.first, self.last = corpus.find(*_range(body["query"]))
+        self.source = body.get("_source")
+        self.slice = body.get("slice")
+
+    def page(self, position, size):
+        """
+        Args:
+            position (int): The corpus position to start from
+            size (int): The most documents to return
+        Returns:
+            positions (list): The corpus positions of the page's documents
+            position (int): Where the next page starts
+        """
+        positions = []
+        position = max(position, self.first)
+        while position < self.last and len(positions) < size:
+            if not self.slice or position % self.slice["max"] == self.slice["id"]:
+                positions.append(position)
+            position += 1
+        return positions, position
+
+    def total(self):
+        """
+        Returns:
+            docs (int): How many documents the search matches
+        """
+        if not self.slice:
+            return self.last - self.first
+        return len(
+            range(
+                self.first + (self.slice["id"] - self.first) % self.slice["max"],
+                self.last,
+                self.slice["max"],
+            )
+        )
+
+    def hits(self, positions, sort=False):
+        hits = []
+        for position in positions:
+            hit = {
+                "_id": str(position),
+                "_source": _project(self.corpus.doc(position), self.source),
+            }
+            if sort:
+                hit["sort"] = [self.corpus.timestamp(position), position]
+            hits.append(hit)
+        return hits
+
+
+class FakeElasticsearch:
+    """
+    Args:
+        corpus (object): A `SyntheticCorpus` or `RecordedCorpus`
+        latency (float) [optional]: Seconds every request is delayed by
+        error_rate (float) [optional]: The share of searches and scrolls that fail, half of them rejected with a 429
+            and half (of the scrolls) losing their scroll context
+    """
+
+    def __init__(self, corpus, latency=0.0, error_rate=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.scrolls = {}
+        self.pits = set()
+        self.lock = threading.Lock()
+
+    def handle(self, method, path, params, body):
+        """
+        Returns:
+            status (int): The HTTP status
+            response (dict): The JSON response
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        parts = [part for part in path.split("/") if part]
+        if not parts:
+            return 200, {"version": VERSION, "tagline": "You Know, for Search"}
+        failing = method != "DELETE" and random.random() < self.error_rate
+        if parts[-2:] == ["_search", "scroll"]:
+            if method == "DELETE":
+                with self.lock:
+                    self.scrolls.pop(body.get("scroll_id"), None)
+                return 200, {"succeeded": True, "num_freed": 1}
+            if failing and random.random() < 0.5:
+                with self.lock:
+                    self.scrolls.pop(body["scroll_id"], None)
+            elif failing:
+                return REJECTED
+            return self.scroll(body["scroll_id"])
+        if parts[-1] == "_pit":
+            if method == "DELETE":
+                self.pits.discard(body.get("id"))
+                return 200, {"succeeded": True, "num_freed": 1}
+            pit_id = uuid.uuid4().hex
+            self.pits.add(pit_id)
+            return 200, {"id": pit_id}
+        if parts[-1] == "_count":
+            first, last = self.corpus.find(*_range(body["query"]))
+            return 200, {"count": last - first}
+        if parts[-1] == "_search":
+            return REJECTED if failing else self.search(params, body)
+        if parts[-1] == "_msearch":
+            return REJECTED if failing else self.msearch(params, body)
+        return 404, {"error": "{} {} is not faked".format(method, path)}
+
+    def search(self, params, body):
+        size = int(params.get("size", body.get("size", 10)))
+        if "aggs" in body:
+            return 200, self.histogram(body)
+        cursor = Cursor(self.corpus, body)
+        if "pit" in body:
+            after = body.get("search_after")
+            position = after[1] + 1 if after else 0
+            positions, _ = cursor.page(position, size)
+            return (
+                200,
+                {
+                    "pit_id": body["pit"]["id"],
+                    "hits": {"hits": cursor.hits(positions, sort=True)},
+                },
+            )
+        positions, position = cursor.page(0, size)
+        response = {
+            "hits": {
+                "total": {"value": cursor.total(), "relation": "eq"},
+                "hits": cursor.hits(positions, sort="sort" in body),
+            }
+        }
+        if "scroll" in params:
+            scroll_id = uuid.uuid4().hex
+            with self.lock:
+                self.scrolls[scroll_id] = (cursor, position, size)
+            response["_scroll_id"] = scroll_id
+        return 200, response
+
+    def msearch(self, params, body):
+        responses = []
+        # Headers and bodies alternate
+        for search in body[1::2]:
+            _, response = self.search({}, search)
+            responses.append(response)
+        return 200, {"responses": responses}
+
+    def scroll(self, scroll_id):
+        with self.lock:
+            state = self.scrolls.get(scroll_id)
+        if state is None:
+            reason = "No search context found for id [{}]".format(scroll_id)
+            return (
+                404,
+                {
+                    "error": {
+                        "root_cause": [
+                            {
+                                "type": "search_context_missing_exception",
+                                "reason": reason,
+                            }
+                        ],
+                        "type": "search_phase_execution_exception",
+                        "reason": "all shards failed",
+                    },
+                    "status": 404,
+                },
+            )
+        cursor, position, size = state
+        positions, position = cursor.page(position, size)
+        with self.lock:
+            self.scrolls[scroll_id] = (cursor, position, size)
+        return 200, {"_scroll_id": scroll_id, "hits": {"hits": cursor.hits(positions)}}
+
+    def histogram(self, body):
+        name, aggregation = next(iter(body["aggs"].items()))
+        width = int(aggregation["date_histogram"]["fixed_interval"].rstrip("s")) * 1000
+        gte, lt = _range(body["query"])
+        buckets = []
+        for key in range(gte - gte % width, lt, width):
+            first, last = self.corpus.find(max(key, gte), min(key + width, lt))
+            if last > first:
+                buckets.append({"key": key, "doc_count": last - first})
+        return {"aggregations": {name: {"buckets": buckets}}}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients killed mid-request, e.g. by `benchmarks.resume`, are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length)
+            if len(raw) < length:
+                # The client was killed before it sent the whole request
+                self.close_connection = True
+                return
+            if self.headers.get("Content-Encoding") == "gzip":
+                raw = gzip.decompress(raw)
+            if url.path.endswith("/_msearch"):
+                body = [
+                    json.loads(line)
+                    for line in raw.decode("utf-8").splitlines()
+                    if line
+                ]
+            else:
+                body = json.loads(raw.decode("utf-8")) if raw else {}
+            status, response = fake.handle(self.command, url.path, params, body)
+            payload = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                # ElasticSearch's own default `http.compression_level`
+                payload = gzip.compress(payload, compresslevel=3)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_DELETE = do_HEAD = do_PUT = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_corpus(dataset, docs_per_minute=100, padding=0, replay=None):
+    """
+    Args:
+        dataset (str): One of `GENERATORS`
+        docs_per_minute (float) [optional]: How densely synthetic documents are packed
+        padding (int) [optional]: Characters of filler added to every synthetic document
+        replay (str) [optional]: A JSON-lines recording to replay instead of generating documents
+    Returns:
+        corpus (object): The corpus to serve
+    """
+    if replay:
+        return RecordedCorpus(replay)
+    return SyntheticCorpus(dataset, docs_per_minute=docs_per_minute, padding=padding)
+
+
+def serve(corpus, port=0, latency=0.0, ready=None, error_rate=0.0):
+    """
+    Serves `corpus` until interrupted
+    Args:
+        corpus (object): A `SyntheticCorpus` or `RecordedCorpus`
+        port (int) [optional]: The port to listen on; 0 picks a free one
+        latency (float) [optional]: Seconds every request is delayed by
+        ready (multiprocessing.connection.Connection) [optional]: Sent the port once the server is listening
+        error_rate (float) [optional]: The share of searches and scrolls that fail
+    """
+    server = _Server(
+        ("127.0.0.1", port),
+        make_handler(FakeElasticsearch(corpus, latency, error_rate)),
+    )
+    if ready is not None:
+        ready.send(server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve_process(
+    dataset, port, latency, docs_per_minute, padding, replay, ready, error_rate=0.0
+):
+    serve(
+        make_corpus(dataset, docs_per_minute, padding, replay),
+        port,
+        latency,
+        ready,
+        error_rate,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve fake CUIP documents over a fake ElasticSearch API"
+    )
+    parser.add_argument("dataset", choices=sorted(GENERATORS))
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds every request is delayed by"
+    )
+    parser.add_argument("--docs-per-minute", type=float, default=100)
+    parser.add_argument(
+        "--padding", type=int, default=0, help="characters of filler per document"
+    )
+    parser.add_argument(
+        "--replay", help="a JSON-lines file of recorded documents to serve instead"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of searches and scrolls that are rejected or lose their context",
+    )
+    args = parser.parse_args(argv)
+    print("Serving {} on 127.0.0.1:{}".format(args.dataset, args.port))
+    serve(
+        make_corpus(args.dataset, args.docs_per_minute, args.padding, args.replay),
+        args.port,
+        args.latency,
+        error_rate=args.error_rate,
+    )
+
+
+if __name__ == "__main__":
+    main()
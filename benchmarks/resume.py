@@ -0,0 +1,226 @@
+"""
+Checks that a streamed fetch killed part way through and then run again ends up with every document exactly once, and
+with a coverage index that agrees with what was written, against `benchmarks.fake_es`.
+
+For every strategy asked for, the fetch command-line tool is started with `--stream` and killed (SIGKILL, workers and
+all) once it has checkpointed a few tasks, then the same command, or the same with `--rerun-strategy`, is run to
+completion. The output's documents are then compared with what the fake server holds for the range, and the coverage
+index with both:
+
+    python -m benchmarks.resume --strategies sliced-scroll,search-after,hourly --slices 8
+    python -m benchmarks.resume --strategies hourly,adaptive --rerun-strategy sliced-scroll
+
+Exits with status 1 if any strategy comes out wrong.
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks import fake_es
+from benchmarks.run import ROOT, _list
+from elastic_fetching.coverage import Coverage, coverage_path
+from elastic_fetching.datasets import get_spec
+
+COLUMNS = [
+    ("strategy", "<14", ""),
+    ("rerun", "<14", ""),
+    ("killed_at", ">9", "d"),
+    ("expected", ">9", "d"),
+    ("rows", ">9", "d"),
+    ("duplicates", ">10", "d"),
+    ("coverage", ">9", "d"),
+    ("missing", ">7", "d"),
+    ("ok", "<3", ""),
+]
+
+
+def _checkpoints(out_dir):
+    try:
+        with open(os.path.join(out_dir, "_manifest.jsonl")) as manifest_file:
+            return sum(1 for line in manifest_file if line.strip())
+    except IOError:
+        return 0
+
+
+def fetch(argv, kill_after=None):
+    """
+    Args:
+        argv (list): `elastic_fetching` arguments
+        kill_after (int) [optional]: Kill the fetch once it has checkpointed this many tasks
+    Returns:
+        checkpoints (int): How many tasks the fetch had checkpointed when it was killed, or None if it finished
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "elastic_fetching"] + argv,
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    out_dir = argv[argv.index("--out") + 1]
+    while process.poll() is None:
+        if kill_after is not None and _checkpoints(out_dir) >= kill_after:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            return _checkpoints(out_dir)
+        time.sleep(0.01)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, argv)
+    return None
+
+
+def check(spec, out_dir, start, end, expected):
+    """
+    Returns:
+        result (dict): The `rows` written, how many of them are `duplicates`, the documents the `coverage` index
+            holds and how many `missing` windows it reports
+    """
+    frame = pd.read_csv(os.path.join(out_dir, "all.csv"), low_memory=False)
+    coverage = Coverage(coverage_path(out_dir, spec))
+    result = {
+        "expected": expected,
+        "rows": len(frame),
+        "duplicates": int(frame.duplicated(spec.unique_key).sum()),
+        "coverage": int(coverage.counts.sum()),
+        "missing": len(coverage.missing(start, end)),
+    }
+    result["ok"] = (
+        "yes"
+        if result["rows"] == result["coverage"] == expected
+        and not result["duplicates"]
+        and not result["missing"]
+        else "no"
+    )
+    return result
+
+
+def print_row(row):
+    print(
+        "  ".join(
+            ("{:" + width + spec + "}").format(row[column])
+            for column, width, spec in COLUMNS
+        )
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Check that interrupted streamed fetches resume without losing or repeating documents"
+    )
+    parser.add_argument(
+        "--dataset", choices=sorted(fake_es.GENERATORS), default="vision_events"
+    )
+    parser.add_argument("--start", default="2019-06-01")
+    parser.add_argument(
+        "--hours", type=float, default=24, help="how much time to fetch, from --start"
+    )
+    parser.add_argument("--docs-per-minute", type=float, default=20)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="seconds the fake server delays every request by, so there is time to kill the fetch",
+    )
+    parser.add_argument(
+        "--strategies",
+        type=_list(str),
+        default=["sliced-scroll", "search-after", "hourly"],
+    )
+    parser.add_argument(
+        "--rerun-strategy",
+        help="the strategy to run the fetch again with; defaults to the one it was killed running",
+    )
+    parser.add_argument("--slices", type=int, default=8)
+    parser.add_argument(
+        "--kill-after",
+        type=int,
+        default=3,
+        help="checkpointed tasks after which the first run is killed",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spec = get_spec(args.dataset)
+    start = datetime.datetime.strptime(args.start, "%Y-%m-%d")
+    end = start + datetime.timedelta(hours=args.hours)
+    corpus = fake_es.make_corpus(args.dataset, args.docs_per_minute)
+    first, last = corpus.find(
+        int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+    )
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=fake_es.serve_process,
+        args=(
+            args.dataset,
+            0,
+            args.latency,
+            args.docs_per_minute,
+            0,
+            None,
+            sender,
+        ),
+        daemon=True,
+    )
+    server.start()
+    host = "127.0.0.1:{}".format(receiver.recv())
+
+    print(
+        "  ".join(("{:" + width + "}").format(column) for column, width, _ in COLUMNS)
+    )
+    failed = False
+    try:
+        for strategy in args.strategies:
+            out_dir = tempfile.mkdtemp(prefix="elastic-resume-")
+            try:
+                rerun = args.rerun_strategy or strategy
+                fetch_args = [
+                    args.dataset,
+                    "--start",
+                    start.isoformat(),
+                    "--end",
+                    end.isoformat(),
+                    "--out",
+                    out_dir,
+                    "--host",
+                    host,
+                    "--stream",
+                    "--slices",
+                    str(args.slices),
+                    "--workers",
+                    "4",
+                ]
+                killed_at = fetch(
+                    fetch_args + ["--strategy", strategy], kill_after=args.kill_after
+                )
+                fetch(fetch_args + ["--strategy", rerun])
+                row = dict(
+                    check(spec, out_dir, start, end, last - first),
+                    strategy=strategy,
+                    rerun=rerun,
+                    killed_at=killed_at or 0,
+                )
+            finally:
+                shutil.rmtree(out_dir, ignore_errors=True)
+            print_row(row)
+            failed = failed or row["ok"] != "yes"
+    finally:
+        server.terminate()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Times the fetch command-line tool against `benchmarks.fake_es`, for every combination of fetch strategy, engine,
+worker count and output format asked for.
+
+Each combination runs in a fresh interpreter, so its peak RSS (that of its largest process, workers included) isn't
+inflated by the ones before it. Results are printed as a table and can be appended to a JSON-lines file to compare
+runs over time:
+
+    python -m benchmarks.run --dataset air_quality --hours 24 --latency 0.005 --formats csv,parquet --json bench.jsonl
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_es
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS = [
+    ("strategy", "<14", ""),
+    ("engine", "<8", ""),
+    ("workers", ">7", "d"),
+    ("format", "<8", ""),
+    ("stream", "<6", ""),
+    ("docs", ">9", "d"),
+    ("wall_s", ">8", ".2f"),
+    ("docs_per_s", ">10", ".0f"),
+    ("peak_rss_mb", ">11", ".1f"),
+]
+
+
+def _list(cast):
+    return lambda value: [cast(item) for item in value.split(",")]
+
+
+def cli_args(config, out_dir):
+    """
+    Args:
+        config (dict): One benchmark combination
+        out_dir (str): Where the fetch writes its output
+    Returns:
+        argv (list): The `elastic_fetching.cli` arguments that run it; async runs use `workers` as their concurrency
+    """
+    argv = [
+        config["dataset"],
+        "--start",
+        config["start"],
+        "--end",
+        config["end"],
+        "--out",
+        out_dir,
+        "--host",
+        config["host"],
+        "--strategy",
+        config["strategy"],
+        "--slices",
+        str(config["workers"]),
+        "--engine",
+        config["engine"],
+        "--format",
+        config["format"],
+    ]
+    if config["engine"] == "async":
+        argv += ["--concurrency", str(config["workers"])]
+    else:
+        argv += ["--workers", str(config["workers"])]
+    if config["stream"]:
+        argv.append("--stream")
+    return argv
+
+
+def run_one(config, result_path):
+    """
+    Runs a single combination in this process and writes its wall time and peak RSS to `result_path`
+    """
+    from elastic_fetching import cli
+
+    out_dir = tempfile.mkdtemp(prefix="elastic-bench-")
+    try:
+        started = time.time()
+        cli.main(cli_args(config, out_dir))
+        wall = time.time() - started
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    # ru_maxrss is in kilobytes on Linux
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    with open(result_path, "w") as result_file:
+        json.dump({"wall_s": wall, "peak_rss_mb": peak / 1024.0}, result_file)
+
+
+def run_isolated(config, verbose=False):
+    """
+    Args:
+        config (dict): One benchmark combination
+        verbose (bool) [optional]: Whether to show the fetch's own output
+    Returns:
+        result (dict): `wall_s` and `peak_rss_mb`
+    """
+    handle, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(handle)
+    try:
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--one",
+                json.dumps(config),
+                "--result",
+                result_path,
+            ],
+            cwd=ROOT,
+            stdout=None if verbose else subprocess.DEVNULL,
+        )
+        with open(result_path) as result_file:
+            return json.load(result_file)
+    finally:
+        os.remove(result_path)
+
+
+def print_header():
+    print(
+        "  ".join(("{:" + width + "}").format(column) for column, width, _ in COLUMNS)
+    )
+
+
+def print_row(row):
+    row = dict(row, stream="yes" if row["stream"] else "no")
+    print(
+        "  ".join(
+            ("{:" + width + spec + "}").format(row[column])
+            for column, width, spec in COLUMNS
+        )
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fetch engines against a local fake ElasticSearch"
+    )
+    parser.add_argument(
+        "--dataset", choices=sorted(fake_es.GENERATORS), default="vision_events"
+    )
+    parser.add_argument("--start", default="2019-06-01")
+    parser.add_argument(
+        "--hours", type=float, default=6, help="how much time to fetch, from --start"
+    )
+    parser.add_argument(
+        "--docs-per-minute",
+        type=float,
+        default=100,
+        help="how densely synthetic documents are packed",
+    )
+    parser.add_argument(
+        "--padding", type=int, default=0, help="characters of filler per document"
+    )
+    parser.add_argument(
+        "--replay", help="a JSON-lines file of recorded documents to serve instead"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds the fake server delays every request by",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of searches and scrolls the fake server fails, to exercise retries",
+    )
+    parser.add_argument(
+        "--strategies", type=_list(str), default=["hourly", "sliced-scroll"]
+    )
+    parser.add_argument("--engines", type=_list(str), default=["process"])
+    parser.add_argument(
+        "--workers",
+        type=_list(int),
+        default=[4],
+        help="worker counts (slices for sliced strategies, concurrency for async)",
+    )
+    parser.add_argument("--formats", type=_list(str), default=["csv"])
+    parser.add_argument(
+        "--stream", action="store_true", help="run every fetch with --stream"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs of every combination"
+    )
+    parser.add_argument("--json", help="append every result to this JSON-lines file")
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the fetches' own output"
+    )
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.one:
+        run_one(json.loads(args.one), args.result)
+        return
+
+    start = datetime.datetime.strptime(args.start, "%Y-%m-%d")
+    end = start + datetime.timedelta(hours=args.hours)
+    corpus = fake_es.make_corpus(
+        args.dataset, args.docs_per_minute, args.padding, args.replay
+    )
+    first, last = corpus.find(
+        int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+    )
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=fake_es.serve_process,
+        args=(
+            args.dataset,
+            0,
+            args.latency,
+            args.docs_per_minute,
+            args.padding,
+            args.replay,
+            sender,
+            args.error_rate,
+        ),
+        daemon=True,
+    )
+    server.start()
+    host = "127.0.0.1:{}".format(receiver.recv())
+
+    print_header()
+    try:
+        for strategy, engine, workers, output_format in itertools.product(
+            args.strategies, args.engines, args.workers, args.formats
+        ):
+            config = {
+                "dataset": args.dataset,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "host": host,
+                "strategy": strategy,
+                "engine": engine,
+                "workers": workers,
+                "format": output_format,
+                "stream": args.stream,
+            }
+            for _ in range(args.repeat):
+                result = run_isolated(config, verbose=args.verbose)
+                row = dict(config, docs=last - first, **result)
+                row["docs_per_s"] = row["docs"] / row["wall_s"]
+                print_row(row)
+                if args.json:
+                    with open(args.json, "a") as json_file:
+                        json_file.write(json.dumps(row) + "\n")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
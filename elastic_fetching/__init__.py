@@ -0,0 +1,12 @@
+"""
+Shared helpers for pulling bulk data out of the CUIP ElasticSearch cluster.
+
+Every index we fetch is described by a `DatasetSpec` (see `elastic_fetching.datasets`) and executed by
+`elastic_fetching.engine`.
+"""
+
+from elastic_fetching.columnar import ColumnarBatch
+from elastic_fetching.datasets import AIR_QUALITY, SPECS, VISION_EVENTS, get_spec
+from elastic_fetching.engine import fetch, fetch_task, stream, stream_task
+from elastic_fetching.notify import notify
+from elastic_fetching.spec import DatasetSpec
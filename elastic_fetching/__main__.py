@@ -0,0 +1,4 @@
+from elastic_fetching.cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Server-side hourly rollups, for when only one value per sensor per hour is needed.
+
+Rather than pulling every raw document to the client, a `composite` aggregation over the partition key and a one
+hour `date_histogram` returns a single bucket per sensor per hour, paged through with `after_key`. Each bucket
+carries either the earliest document of the hour (`top_hits`), which is all an answer key needs, or min/avg/max
+metrics for summaries.
+"""
+
+import pandas as pd
+
+from elastic_fetching import answer_key, retry
+from elastic_fetching.windows import to_epoch_millis
+
+COMPOSITE_SIZE = 1000
+INTERVAL = "1h"
+
+
+def window_query(spec, window):
+    """
+    Args:
+        spec (DatasetSpec): The dataset being aggregated
+        window (elastic_fetching.answer_key.Window): The days and hours to cover
+    Returns:
+        query (dict): An ElasticSearch query matching the hours of every day of the window
+    """
+    return {
+        "bool": {
+            "should": [
+                {
+                    "range": {
+                        spec.timestamp_field: {
+                            "gte": to_epoch_millis(start),
+                            "lt": to_epoch_millis(end),
+                            "format": "epoch_millis",
+                        }
+                    }
+                }
+                for start, end in window.ranges()
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+def key_field(spec):
+    """
+    Args:
+        spec (DatasetSpec): The dataset being aggregated
+    Returns:
+        field (str): The keyword field holding the partition key, which `terms` sources need
+    """
+    return "{}.keyword".format(spec.partition_key)
+
+
+def composite_buckets(es, spec, query, aggs, size=COMPOSITE_SIZE, field=None):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The dataset being aggregated
+        query (dict): The query selecting documents to aggregate
+        aggs (dict): Sub-aggregations computed for every bucket
+        size (int) [optional]: Buckets per request
+        field (str) [optional]: The field to group by; defaults to `key_field(spec)`
+    Returns:
+        buckets (generator): Every `(partition key, hour)` bucket, in order
+    """
+    sources = [
+        {"key": {"terms": {"field": field or key_field(spec)}}},
+        {
+            "hour": {
+                "date_histogram": {
+                    "field": spec.timestamp_field,
+                    "fixed_interval": INTERVAL,
+                }
+            }
+        },
+    ]
+    after = None
+    while True:
+        composite = {"size": size, "sources": sources}
+        if after is not None:
+            composite["after"] = after
+        # Each page carries on from `after`, so a failed one is simply asked for again
+        results = retry.call(
+            es.search,
+            index=spec.index,
+            body={
+                "size": 0,
+                "query": query,
+                "aggs": {"hourly": {"composite": composite, "aggs": aggs}},
+            },
+            filter_path=[
+                "aggregations.hourly.after_key",
+                "aggregations.hourly.buckets",
+            ],
+        )
+        hourly = results.get("aggregations", {}).get("hourly", {})
+        buckets = hourly.get("buckets", [])
+        for bucket in buckets:
+            yield bucket
+        after = hourly.get("after_key")
+        if not buckets or after is None:
+            return
+
+
+def earliest_readings(es, spec, window, value="pm2_5_cf_1", field=None):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The dataset being aggregated
+        window (elastic_fetching.answer_key.Window): The days and hours to cover
+        value (str) [optional]: The field to read
+        field (str) [optional]: The field to group by; defaults to `key_field(spec)`
+    Returns:
+        readings (pandas.DataFrame): The earliest document of every sensor and hour, with `timestamp-iso`, the
+            partition key and `value` columns
+    """
+    earliest = {
+        "top_hits": {
+            "size": 1,
+            "sort": [{spec.timestamp_field: "asc"}],
+            "_source": {"includes": [spec.timestamp_field, value]},
+        }
+    }
+    keys, timestamps, values = [], [], []
+    for bucket in composite_buckets(
+        es, spec, window_query(spec, window), {"earliest": earliest}, field=field
+    ):
+        source = bucket["earliest"]["hits"]["hits"][0]["_source"]
+        keys.append(bucket["key"]["key"])
+        timestamps.append(source[spec.timestamp_field])
+        values.append(source.get(value))
+    return pd.DataFrame(
+        {
+            "timestamp-iso": pd.to_datetime(
+                pd.Series(timestamps, dtype="int64"), unit="ms"
+            ),
+            spec.partition_key: keys,
+            value: pd.Series(values, dtype="float64"),
+        }
+    )
+
+
+def hourly_answer_key(es, spec, window, field=None):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The air quality dataset
+        window (elastic_fetching.answer_key.Window): The days and hours the answer key covers
+        field (str) [optional]: The field to group by; defaults to `key_field(spec)`
+    Returns:
+        key (pandas.DataFrame): The same answer key `answer_key.answer_key` builds from raw documents. The earliest
+            document of an hour past minute 1 doesn't count, so that hour shows up as missing
+        missing (pandas.DataFrame): The `nicename`, `day` and `hour` of every reading the answer key lacks
+    """
+    return answer_key.answer_key(
+        earliest_readings(es, spec, window, field=field), window
+    )
+
+
+def hourly_stats(es, spec, window, value="pm2_5_cf_1", field=None):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The dataset being aggregated
+        window (elastic_fetching.answer_key.Window): The days and hours to cover
+        value (str) [optional]: The field to summarize
+        field (str) [optional]: The field to group by; defaults to `key_field(spec)`
+    Returns:
+        stats (pandas.DataFrame): The partition key, `hour` (UTC), `docs` and `min`/`avg`/`max` of `value` for every
+            sensor and hour holding documents
+    """
+    metrics = {name: {name: {"field": value}} for name in ("min", "avg", "max")}
+    rows = [
+        [bucket["key"]["key"], bucket["key"]["hour"], bucket["doc_count"]]
+        + [bucket[name]["value"] for name in ("min", "avg", "max")]
+        for bucket in composite_buckets(
+            es, spec, window_query(spec, window), metrics, field=field
+        )
+    ]
+    stats = pd.DataFrame(
+        rows, columns=[spec.partition_key, "hour", "docs", "min", "avg", "max"]
+    )
+    stats["hour"] = pd.to_datetime(stats["hour"].astype("int64"), unit="ms")
+    return stats
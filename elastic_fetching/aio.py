@@ -0,0 +1,221 @@
+"""
+An asyncio version of `elastic_fetching.engine`.
+
+Fetching is almost entirely network wait, so rather than one process (and one client) per task, every task shares a
+single pooled `AsyncElasticsearch` client on one event loop, with at most `concurrency` of them in flight at once.
+Turning pages into DataFrames happens on a thread by default, or on a small process pool (`convert_workers`) if
+parsing ever becomes the bottleneck.
+"""
+
+import asyncio
+import functools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import tqdm
+
+from elastic_fetching import client, coverage, output, retry
+from elastic_fetching.engine import (
+    DEFAULT_HOST,
+    add_part,
+    concat_pages,
+    new_summary,
+    page_frame,
+    part_path,
+    write_frame,
+)
+from elastic_fetching.metrics import MeteredClient, TaskMetrics, acounted_pages
+
+DEFAULT_CONCURRENCY = 50
+
+
+async def _cached(spec, cache, host, task, convert, metrics):
+    # Returns the task's cached pages, or else the cache entry to store it in once fetched
+    if cache is None:
+        return None, None
+    with metrics.timing("cache"):
+        pages = await convert(cache.lookup, spec, task, host)
+    if pages is not None:
+        metrics.cached(pages)
+        return pages, None
+    return None, await convert(cache.entry, spec, task, host)
+
+
+async def _task_frames(spec, cache, host, es, task, convert, metrics):
+    pages, entry = await _cached(spec, cache, host, task, convert, metrics)
+    if pages is not None:
+        for frame in pages:
+            yield frame
+        return
+    page = 0
+    try:
+        es = MeteredClient(es, metrics)
+        async for docs in acounted_pages(task.apages(es, spec), metrics):
+            with metrics.timing("build"):
+                frame = await convert(page_frame, spec, docs)
+            if entry:
+                with metrics.timing("cache"):
+                    await convert(cache.write, spec, entry, page, frame)
+            page += 1
+            yield frame
+    except BaseException:
+        if entry:
+            cache.discard(entry)
+        raise
+    if entry:
+        with metrics.timing("cache"):
+            await convert(cache.commit, spec, task, host, entry)
+
+
+async def _fetch_task(spec, cache, host, es, task, convert):
+    metrics = TaskMetrics(task)
+    frames = []
+    async for frame in _task_frames(spec, cache, host, es, task, convert, metrics):
+        frames.append(frame)
+    return concat_pages(spec, frames), metrics.finish()
+
+
+async def _stream_task(spec, parts_dir, writer, cache, host, es, task, convert):
+    summary = new_summary(task)
+    metrics = TaskMetrics(task)
+    tallies = []
+    page = 0
+    async for frame in _task_frames(spec, cache, host, es, task, convert, metrics):
+        path = part_path(parts_dir, task, page, writer)
+        with metrics.timing("write"):
+            add_part(
+                summary, path, *await convert(write_frame, spec, frame, path, writer)
+            )
+        tallies.append(coverage.tally(spec, frame))
+        page += 1
+    summary["coverage"] = coverage.combine(tallies)
+    summary["metrics"] = metrics.finish()
+    return summary
+
+
+async def _gather(
+    run_task, tasks, concurrency, host, convert_workers, report, metrics, on_result=None
+):
+    # Every task shares the client, and with it the serializer; see `metrics.MeteredClient`
+    es = client.new_async_client(host, maxsize=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ProcessPoolExecutor(convert_workers) if convert_workers else None
+    convert = functools.partial(asyncio.get_event_loop().run_in_executor, executor)
+    progress = tqdm.tqdm(total=len(tasks), file=sys.stdout)
+
+    async def run(task):
+        async with semaphore:
+            result = await run_task(es, task, convert)
+        if report is not None:
+            report.add(metrics(result))
+            if report.live:
+                progress.set_postfix_str(report.summary(), refresh=False)
+        progress.update()
+        if on_result:
+            on_result(result)
+        return result
+
+    try:
+        with retry.governed(retry.Governor(concurrency)):
+            return await asyncio.gather(*[run(task) for task in tasks])
+    finally:
+        progress.close()
+        await es.close()
+        if executor:
+            executor.shutdown()
+
+
+def _run(coroutine):
+    # asyncio.run only exists from Python 3.7 on
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def fetch(
+    spec,
+    tasks,
+    concurrency=DEFAULT_CONCURRENCY,
+    host=DEFAULT_HOST,
+    convert_workers=0,
+    cache=None,
+    report=None,
+):
+    """
+    Runs every task concurrently on one event loop and stitches the results back together in memory
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        tasks (list): Tasks from `elastic_fetching.strategies`
+        concurrency (int) [optional]: The most tasks to have in flight at once
+        host (dict) [optional]: The ElasticSearch host to connect to
+        convert_workers (int) [optional]: Processes to turn pages into DataFrames on; 0 uses a thread instead
+        cache (QueryCache) [optional]: A cache to serve tasks from, or to store them in once fetched
+        report (RunReport) [optional]: Where to add up each task's metrics
+    Returns:
+        frame (pandas.DataFrame): Every document of every task, in task order
+    """
+    run_task = functools.partial(_fetch_task, spec, cache, host)
+    results = _run(
+        _gather(
+            run_task,
+            tasks,
+            concurrency,
+            host,
+            convert_workers,
+            report,
+            itemgetter(1),
+        )
+    )
+    return spec.concat([data_slice for data_slice, _ in results])
+
+
+def stream(
+    spec,
+    tasks,
+    parts_dir,
+    writer=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    host=DEFAULT_HOST,
+    convert_workers=0,
+    on_result=None,
+    cache=None,
+    report=None,
+):
+    """
+    Runs every task concurrently on one event loop, writing each page to disk as it arrives
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        tasks (list): Tasks from `elastic_fetching.strategies`
+        parts_dir (str): The directory to write part files to; merge them with `writer.finalize`
+        writer (object) [optional]: The writer from `elastic_fetching.output` to write parts with; defaults to CSV
+        concurrency (int) [optional]: The most tasks to have in flight at once
+        host (dict) [optional]: The ElasticSearch host to connect to
+        convert_workers (int) [optional]: Processes to convert and write pages on; 0 uses a thread instead
+        on_result (callable) [optional]: Called with each summary as soon as its task completes
+        cache (QueryCache) [optional]: A cache to serve tasks from, or to store them in once fetched
+        report (RunReport) [optional]: Where to add up each task's metrics
+    Returns:
+        summaries (list): One summary (see `engine.stream_task`) per task, in task order
+    """
+    if writer is None:
+        writer = output.get_writer("csv")
+    os.makedirs(parts_dir, exist_ok=True)
+    run_task = functools.partial(_stream_task, spec, parts_dir, writer, cache, host)
+    return _run(
+        _gather(
+            run_task,
+            tasks,
+            concurrency,
+            host,
+            convert_workers,
+            report,
+            itemgetter("metrics"),
+            on_result,
+        )
+    )
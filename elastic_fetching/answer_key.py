@@ -0,0 +1,164 @@
+"""
+Vectorized answer keys for the CSCDC: one `pm2_5_cf_1` reading per sensor per hour.
+
+For every sensor, day and hour of a window, the reading taken at minute 0 of the hour is kept, falling back to the
+one taken at minute 1. Hours with neither are reported as gaps.
+"""
+
+import datetime
+
+import pandas as pd
+from dateutil import tz as dateutil_tz
+
+ANSWER_KEY_COLUMNS = ["date", "time", "nicename", "pm2_5_cf_1"]
+GRID = ["nicename", "day", "hour"]
+
+
+class Window:
+    """
+    The stretch of time an answer key covers: the given hours of the given days of one month, in local time
+    Args:
+        year (int): e.g. 2019
+        month (int): e.g. 6
+        days (list): Days of the month, e.g. `range(25, 30)`
+        hours (list): Hours of the day, e.g. `range(7, 20)`
+        tz (datetime.tzinfo) [optional]: The timezone days and hours are in; defaults to the system's
+    """
+
+    def __init__(self, year, month, days, hours, tz=None):
+        self.year = year
+        self.month = month
+        self.days = list(days)
+        self.hours = list(hours)
+        self.tz = tz or dateutil_tz.tzlocal()
+
+    def ranges(self):
+        """
+        Returns:
+            ranges (list): A timezone-aware `(start, end)` tuple for every day, spanning its first to its last hour
+        """
+        ranges = []
+        for day in self.days:
+            start = datetime.datetime(
+                self.year, self.month, day, min(self.hours), tzinfo=self.tz
+            )
+            end = datetime.datetime(
+                self.year, self.month, day, max(self.hours), tzinfo=self.tz
+            )
+            ranges.append((start, end + datetime.timedelta(hours=1)))
+        return ranges
+
+    def grid(self, nicenames):
+        """
+        Args:
+            nicenames (list): Every sensor that should have readings
+        Returns:
+            grid (pandas.MultiIndex): Every `(nicename, day, hour)` an answer key should cover
+        """
+        return pd.MultiIndex.from_product(
+            [sorted(nicenames), self.days, self.hours], names=GRID
+        )
+
+
+def localize(timestamps, tz):
+    """
+    Args:
+        timestamps (pandas.Series): UTC datetimes, either naive or timezone-aware
+        tz (datetime.tzinfo): The timezone to convert them to
+    Returns:
+        timestamps (pandas.Series): The datetimes in `tz`
+    """
+    timestamps = pd.to_datetime(timestamps)
+    if timestamps.dt.tz is None:
+        timestamps = timestamps.dt.tz_localize("UTC")
+    return timestamps.dt.tz_convert(tz)
+
+
+def _format(local, readings):
+    # Dates and times are written without zero padding, e.g. 2019-6-25 and 7:0:0
+    return pd.DataFrame(
+        {
+            "date": local.dt.year.astype(str)
+            + "-"
+            + local.dt.month.astype(str)
+            + "-"
+            + local.dt.day.astype(str),
+            "time": local.dt.hour.astype(str)
+            + ":"
+            + local.dt.minute.astype(str)
+            + ":"
+            + local.dt.second.astype(str),
+            "nicename": readings["nicename"].astype(str).values,
+            "pm2_5_cf_1": readings["pm2_5_cf_1"].values,
+        },
+        index=readings.index,
+    )
+
+
+def hourly_readings(frame, window):
+    """
+    Args:
+        frame (pandas.DataFrame): Raw air quality readings with `timestamp-iso`, `nicename` and `pm2_5_cf_1` columns
+        window (Window): The stretch of time the answer key covers
+    Returns:
+        readings (pandas.DataFrame): One row per sensor per hour that had a reading at minute 0 or 1, indexed by
+            `(nicename, day, hour)` and holding the `ANSWER_KEY_COLUMNS`
+    """
+    local = localize(frame["timestamp-iso"], window.tz)
+    mask = (
+        (local.dt.year == window.year)
+        & (local.dt.month == window.month)
+        & local.dt.day.isin(window.days)
+        & local.dt.hour.isin(window.hours)
+        & (local.dt.minute <= 1)
+    )
+    local = local[mask]
+    readings = pd.DataFrame(
+        {
+            "nicename": frame["nicename"][mask].astype(str),
+            "day": local.dt.day,
+            "hour": local.dt.hour,
+            "minute": local.dt.minute,
+            "timestamp": local,
+            "pm2_5_cf_1": frame["pm2_5_cf_1"][mask],
+        }
+    )
+    # Minute 0 wins over minute 1; within a minute the earliest reading wins
+    readings = readings.sort_values(GRID + ["minute", "timestamp"], kind="mergesort")
+    readings = readings.groupby(GRID, sort=False).head(1)
+    key = _format(readings["timestamp"], readings)
+    key.index = pd.MultiIndex.from_frame(readings[GRID])
+    return key
+
+
+def missing_hours(readings, window, nicenames):
+    """
+    Args:
+        readings (pandas.DataFrame): As returned by `hourly_readings`
+        window (Window): The stretch of time the answer key covers
+        nicenames (list): Every sensor that should have readings
+    Returns:
+        missing (pandas.DataFrame): The `nicename`, `day` and `hour` of every reading the answer key lacks
+    """
+    grid = window.grid(nicenames)
+    return (
+        readings.reindex(grid)
+        .loc[lambda key: key["date"].isnull()]
+        .index.to_frame(index=False)
+    )
+
+
+def answer_key(frame, window):
+    """
+    Args:
+        frame (pandas.DataFrame): Raw air quality readings with `timestamp-iso`, `nicename` and `pm2_5_cf_1` columns
+        window (Window): The stretch of time the answer key covers
+    Returns:
+        key (pandas.DataFrame): The answer key, holding the `ANSWER_KEY_COLUMNS`
+        missing (pandas.DataFrame): The `nicename`, `day` and `hour` of every reading the answer key lacks
+    """
+    readings = hourly_readings(frame, window)
+    missing = missing_hours(
+        readings, window, frame["nicename"].dropna().astype(str).unique()
+    )
+    return readings.reset_index(drop=True), missing
@@ -0,0 +1,216 @@
+"""
+An on-disk cache of fetched tasks, so rerunning an extract over the same history never touches the cluster.
+
+Entries are keyed by the SHA-1 of everything that decides what a task returns: the host, the index pattern, the task's
+window, its search body and the fields being fetched. Each entry is a directory holding one Parquet file per page, written
+under a temporary name and renamed into place once the task completes, so an interrupted fetch never leaves a partial
+entry behind.
+
+A window that closed more than `settle` ago cannot gain documents, so its entry is served as is. Younger windows are
+revalidated with a `_count` request and refetched if the count changed. Once the cache grows past `max_bytes`, the
+least recently used entries are evicted.
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from elastic_fetching import client, retry
+from elastic_fetching.output import _to_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "elastic_fetching")
+DEFAULT_MAX_BYTES = 10 * 1024**3
+DEFAULT_SETTLE = datetime.timedelta(hours=1)
+# Written into an entry whose pages can't be stored as Parquet, so it is dropped rather than committed
+UNCACHEABLE = "_uncacheable"
+
+
+def _size(path):
+    return sum(os.path.getsize(page) for page in glob.glob(os.path.join(path, "*")))
+
+
+class QueryCache:
+    """
+    Args:
+        directory (str) [optional]: Where entries are kept
+        max_bytes (int) [optional]: How large the cache may grow before the least recently used entries are evicted
+        settle (datetime.timedelta) [optional]: How long after a window closes before it is assumed to be final
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_DIRECTORY,
+        max_bytes=DEFAULT_MAX_BYTES,
+        settle=DEFAULT_SETTLE,
+    ):
+        if pa is None:
+            raise RuntimeError("The query cache needs pyarrow: pip install pyarrow")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.settle = settle
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, spec, task, host):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+            host (dict): The ElasticSearch host the task is fetched from
+        Returns:
+            key (str): The hex SHA-1 identifying what the task returns
+        """
+        identity = {
+            # Clusters can hold different documents under the same index pattern, e.g. `benchmarks.fake_es`
+            "host": host,
+            "index": spec.index,
+            "start": task.start.isoformat(),
+            "end": task.end.isoformat(),
+            "body": task.body(spec),
+            "columns": spec.columns,
+        }
+        return hashlib.sha1(
+            json.dumps(identity, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def path(self, spec, task, host):
+        return os.path.join(self.directory, self.key(spec, task, host))
+
+    def is_settled(self, task):
+        """
+        Args:
+            task (object): A task from `elastic_fetching.strategies`
+        Returns:
+            settled (bool): Whether the task's window closed long enough ago that its documents can't change
+        """
+        return task.end <= datetime.datetime.now() - self.settle
+
+    def is_cacheable(self, spec, task):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+        Returns:
+            cacheable (bool): Whether the task's entry can be trusted, now or after revalidation. `_count` can't
+                count a single slice, so slices of windows that haven't settled are always refetched
+        """
+        return self.is_settled(task) or "slice" not in task.body(spec)
+
+    def _docs(self, path):
+        return sum(pq.ParquetFile(page).metadata.num_rows for page in self._pages(path))
+
+    def _pages(self, path):
+        return sorted(glob.glob(os.path.join(path, "*.parquet")))
+
+    def lookup(self, spec, task, host):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+            host (dict): The ElasticSearch host to revalidate against
+        Returns:
+            pages (list): The cached DataFrame of every page of the task, or None if it has to be fetched
+        """
+        path = self.path(spec, task, host)
+        if not os.path.isdir(path) or not self.is_cacheable(spec, task):
+            return None
+        if not self.is_settled(task):
+            es = client.get_client(host)
+            docs = retry.call(
+                es.count, index=spec.index, body={"query": task.body(spec)["query"]}
+            )
+            if docs["count"] != self._docs(path):
+                return None
+        try:
+            pages = [pq.read_table(page).to_pandas() for page in self._pages(path)]
+        except (OSError, pa.ArrowException):
+            # Evicted by another process while being read
+            return None
+        # Directory mtimes double as the LRU clock
+        os.utime(path)
+        return pages
+
+    def entry(self, spec, task, host):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+            host (dict): The ElasticSearch host the task is fetched from
+        Returns:
+            entry (str): A fresh temporary directory to `write` the task's pages to, or None if the task isn't
+                cacheable
+        """
+        if not self.is_cacheable(spec, task):
+            return None
+        entry = "{}.{}.tmp".format(self.path(spec, task, host), uuid.uuid4().hex)
+        os.makedirs(entry)
+        return entry
+
+    def write(self, spec, entry, page, frame):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            entry (str): As returned by `entry`
+            page (int): The page's position within the task
+            frame (pandas.DataFrame): The page's documents
+        """
+        try:
+            table = _to_table(frame, spec.nested)
+        except pa.ArrowException:
+            open(os.path.join(entry, UNCACHEABLE), "w").close()
+            return
+        pq.write_table(table, os.path.join(entry, "{:05d}.parquet".format(page)))
+
+    def commit(self, spec, task, host, entry):
+        """
+        Moves a completed entry into place, then evicts the least recently used entries until the cache fits
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+            host (dict): The ElasticSearch host the task was fetched from
+            entry (str): As returned by `entry`, with every page written
+        """
+        path = self.path(spec, task, host)
+        if os.path.exists(os.path.join(entry, UNCACHEABLE)):
+            shutil.rmtree(entry, ignore_errors=True)
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(entry, path)
+        except OSError:
+            # Another process committed the same entry first
+            shutil.rmtree(entry, ignore_errors=True)
+        self.evict()
+
+    def discard(self, entry):
+        shutil.rmtree(entry, ignore_errors=True)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache holds at most `max_bytes`
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), _size(path), path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,252 @@
+"""
+Strips the fields a dataset spec excludes (and stray index columns) from CSVs fetched before they were filtered out
+server-side, optionally converting them to Parquet along the way.
+
+Only the wanted columns are parsed, files are streamed in chunks so memory stays bounded however large they are, files
+are cleaned by a pool of processes, and every file is written to a temporary file first and renamed over the original,
+so an interrupted run never leaves a half-written CSV behind.
+
+Usage:
+    python -m elastic_fetching.clean [<glob> ...] [--dataset air_quality] [--format csv|parquet] [--workers N]
+"""
+
+import argparse
+import functools
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import tqdm
+
+from elastic_fetching.columnar import coerce
+from elastic_fetching.datasets import SPECS, get_spec
+from elastic_fetching.output import _conform, _to_table, pa, pq
+
+DEFAULT_GLOBS = ["./csv/**/*.csv"]
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def wanted_columns(path, spec):
+    """
+    Args:
+        path (str): A CSV file
+        spec (DatasetSpec): The dataset the CSV belongs to
+    Returns:
+        columns (list): The CSV's columns, in file order
+        wanted (list): The columns to keep: everything but `spec.excludes` and the unnamed index columns left by
+            writing CSVs with their index
+    """
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    excludes = set(spec.excludes or ())
+    wanted = [
+        column
+        for column in columns
+        if column not in excludes and not column.startswith("Unnamed: ")
+    ]
+    return columns, wanted
+
+
+def _temporary(path, suffix):
+    fd, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=".{}.".format(os.path.basename(path)),
+        suffix=suffix,
+    )
+    os.close(fd)
+    return temporary
+
+
+def _write_csv(chunks, path):
+    temporary = _temporary(path, ".csv.tmp")
+    rows = 0
+    try:
+        with open(temporary, "w", newline="") as csv_file:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(csv_file, header=i == 0, index=False)
+                rows += len(chunk)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return rows
+
+
+def _write_parquet(chunks, path, spec):
+    temporary = _temporary(path, ".parquet.tmp")
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            # Only cast columns the schema knows about, so every chunk converts to the same types
+            for column, dtype in spec.schema.items():
+                if column in chunk:
+                    chunk[column] = coerce(chunk[column], dtype)
+            table = _to_table(chunk, spec.nested)
+            if writer is None:
+                writer = pq.ParquetWriter(temporary, table.schema)
+            writer.write_table(_conform(table, writer.schema))
+            rows += len(chunk)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(temporary, path)
+        else:
+            os.remove(temporary)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        os.remove(temporary)
+        raise
+    return rows
+
+
+def clean_file(path, spec, output_format="csv", chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Args:
+        path (str): The CSV to clean
+        spec (DatasetSpec): The dataset the CSV belongs to
+        output_format (str) [optional]: "csv" to rewrite the CSV in place, or "parquet" to write the cleaned rows to a
+            Parquet file next to it
+        chunk_rows (int) [optional]: How many rows to read and write at a time
+    Returns:
+        path (str): The file that was written, or None if the CSV was already clean
+        rows (int): How many rows were written
+    """
+    columns, wanted = wanted_columns(path, spec)
+    if output_format == "csv" and wanted == columns:
+        return None, 0
+    if output_format == "csv":
+        # Kept as text, so the cells that are left come out exactly as they went in
+        chunks = pd.read_csv(
+            path,
+            usecols=wanted,
+            chunksize=chunk_rows,
+            dtype=str,
+            keep_default_na=False,
+        )
+        return path, _write_csv(chunks, path)
+    chunks = pd.read_csv(
+        path,
+        usecols=wanted,
+        chunksize=chunk_rows,
+        parse_dates=["timestamp-iso"] if "timestamp-iso" in wanted else False,
+    )
+    target = os.path.splitext(path)[0] + ".parquet"
+    return target, _write_parquet(chunks, target, spec)
+
+
+def clean(
+    files,
+    spec,
+    output_format="csv",
+    chunk_rows=DEFAULT_CHUNK_ROWS,
+    workers=None,
+    remove_csv=False,
+):
+    """
+    Cleans every file on a pool of processes
+    Args:
+        files (list): The CSVs to clean
+        spec (DatasetSpec): The dataset the CSVs belong to
+        output_format (str) [optional]: "csv" or "parquet", see `clean_file`
+        chunk_rows (int) [optional]: How many rows to read and write at a time
+        workers (int) [optional]: The number of processes to use; defaults to half of the system's processors
+        remove_csv (bool) [optional]: Whether to delete each CSV once it has been converted to Parquet
+    Returns:
+        written (list): `(path, rows)` of every file written
+        failed (list): `(path, error)` of every file that couldn't be cleaned; those are left as they were
+    """
+    workers = workers or max(multiprocessing.cpu_count() // 2, 1)
+    function = functools.partial(
+        clean_file, spec=spec, output_format=output_format, chunk_rows=chunk_rows
+    )
+    written = []
+    failed = []
+    with ProcessPoolExecutor(min(workers, max(len(files), 1))) as pool_executor:
+        futures = {pool_executor.submit(function, path): path for path in files}
+        for future in tqdm.tqdm(
+            as_completed(futures), total=len(futures), file=sys.stdout
+        ):
+            source = futures[future]
+            try:
+                path, rows = future.result()
+            except Exception as error:
+                failed.append((source, error))
+                continue
+            if path is None:
+                continue
+            written.append((path, rows))
+            if remove_csv and output_format == "parquet":
+                os.remove(source)
+    return written, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Drop the fields a dataset excludes from already fetched CSVs, optionally converting them to "
+        "Parquet"
+    )
+    parser.add_argument(
+        "globs",
+        nargs="*",
+        default=DEFAULT_GLOBS,
+        help="CSV files or recursive glob patterns (default: {})".format(
+            " ".join(DEFAULT_GLOBS)
+        ),
+    )
+    parser.add_argument("--dataset", choices=sorted(SPECS), default="air_quality")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument(
+        "--remove-csv",
+        action="store_true",
+        help="delete each CSV once it has been converted to Parquet",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help="rows to read and write at a time (default: {})".format(
+            DEFAULT_CHUNK_ROWS
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="processes to clean files with (default: half of the processors)",
+    )
+    args = parser.parse_args(argv)
+    if args.format == "parquet" and pa is None:
+        parser.error("--format parquet needs pyarrow: pip install pyarrow")
+
+    files = sorted(
+        {path for pattern in args.globs for path in glob.glob(pattern, recursive=True)}
+    )
+    written, failed = clean(
+        files,
+        get_spec(args.dataset),
+        output_format=args.format,
+        chunk_rows=args.chunk_rows,
+        workers=args.workers,
+        remove_csv=args.remove_csv,
+    )
+    print(
+        "Cleaned {} of {} files ({} rows), {} already clean, {} failed".format(
+            len(written),
+            len(files),
+            sum(rows for _, rows in written),
+            len(files) - len(written) - len(failed),
+            len(failed),
+        )
+    )
+    for path, error in failed:
+        print("Could not clean {}: {}".format(path, error))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
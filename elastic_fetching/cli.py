@@ -0,0 +1,369 @@
+"""
+Command-line entry point shared by every fetch script.
+
+Usage:
+    python -m elastic_fetching <dataset> [--start 2019-06-01] [--end 2019-07-01] [--out ./csv] [--stream] [--incremental] [--report PATH] [--debug]
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+
+import pandas as pd
+
+from elastic_fetching import aio, client, engine, strategies
+from elastic_fetching.cache import DEFAULT_DIRECTORY, QueryCache
+from elastic_fetching.coverage import Coverage, coverage_path, from_rows, tally
+from elastic_fetching.datasets import SPECS, get_spec
+from elastic_fetching.manifest import Manifest
+from elastic_fetching.metrics import RunReport
+from elastic_fetching.notify import notify
+from elastic_fetching.output import WRITERS, get_writer
+from elastic_fetching.windows import uncovered
+
+
+def parse_datetime(value):
+    """
+    Args:
+        value (str): Anything pandas can parse as a timestamp, e.g. "2019-06-01" or "2019-06-01T07:00"
+    Returns:
+        moment (datetime.datetime): The parsed (naive) datetime
+    """
+    return pd.Timestamp(value).to_pydatetime()
+
+
+def parse_host(value):
+    """
+    Args:
+        value (str): A host of form "hostname" or "hostname:port"
+    Returns:
+        host (dict): A host dict for the ElasticSearch client
+    """
+    host, _, port = value.partition(":")
+    return {"host": host, "port": int(port) if port else 9200}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Fetch a CUIP dataset out of ElasticSearch into CSV or Parquet files"
+    )
+    parser.add_argument("dataset", choices=sorted(SPECS))
+    parser.add_argument(
+        "--start",
+        type=parse_datetime,
+        default=parse_datetime("2019-06-01"),
+        help="start of the range to fetch (inclusive)",
+    )
+    parser.add_argument(
+        "--end",
+        type=parse_datetime,
+        default=parse_datetime("2019-07-01"),
+        help="end of the range to fetch (exclusive)",
+    )
+    parser.add_argument(
+        "--out", default="./csv", help="directory to write the output to"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(WRITERS),
+        default="csv",
+        help="csv: all.csv plus one CSV per sensor per day; parquet: a dataset "
+        "partitioned as sensor=.../date=... (default: csv)",
+    )
+    parser.add_argument(
+        "--fields",
+        type=lambda value: value.split(","),
+        help="comma-separated _source fields to fetch; nothing else leaves the cluster",
+    )
+    parser.add_argument(
+        "--exclude-fields",
+        type=lambda value: value.split(","),
+        help="comma-separated _source fields to leave out, on top of the dataset's own",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=strategies.STRATEGIES,
+        default="hourly",
+        help="how the range is split up between workers (default: hourly)",
+    )
+    parser.add_argument(
+        "--slices",
+        type=int,
+        default=8,
+        help="number of slices for the sliced-scroll and search-after strategies",
+    )
+    parser.add_argument(
+        "--target-docs",
+        type=int,
+        default=50000,
+        help="about how many documents each window of the adaptive strategy holds",
+    )
+    parser.add_argument(
+        "--batch-windows",
+        type=int,
+        help="most hourly or adaptive windows to send in one _msearch; windows holding "
+        "more than a page are scrolled through afterwards, 1 scrolls every window "
+        "(default: 1 for hourly, whose hours may be busy; {} for adaptive, which only "
+        "batches windows known to fit in a page)".format(
+            strategies.DEFAULT_BATCH_WINDOWS
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes to fetch with (default: one per slice, or half of your "
+        "processors for the hourly strategy)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("process", "async"),
+        default="process",
+        help="run tasks on a process pool, or concurrently on one asyncio event loop "
+        "sharing a single pooled client (default: process)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=aio.DEFAULT_CONCURRENCY,
+        help="with --engine async, the most tasks in flight at once",
+    )
+    parser.add_argument(
+        "--convert-workers",
+        type=int,
+        default=0,
+        help="with --engine async, processes to parse pages on (default: a thread)",
+    )
+    parser.add_argument(
+        "--host",
+        type=parse_host,
+        default=engine.DEFAULT_HOST,
+        help="ElasticSearch host as host[:port]",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=client.DEFAULT_MAXSIZE,
+        help="connections each worker keeps open to the host (default: {}; the "
+        "async engine keeps --concurrency)".format(client.DEFAULT_MAXSIZE),
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=client.DEFAULT_TIMEOUT,
+        help="seconds to wait for a response before retrying a request (default: {})".format(
+            client.DEFAULT_TIMEOUT
+        ),
+    )
+    parser.add_argument(
+        "--no-compress",
+        action="store_true",
+        help="don't ask for gzip compressed responses",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write each page to disk as it arrives and merge the parts at the end, "
+        "keeping memory bounded regardless of how much data is fetched",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="fetch from where the tasks checkpointed in OUT/_manifest.jsonl stop covering "
+        "the range from --start without a gap, up to now; implies --stream",
+    )
+    parser.add_argument(
+        "--keep-parts",
+        action="store_true",
+        help="with --stream, leave the part files in OUT/_parts after merging",
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=DEFAULT_DIRECTORY,
+        metavar="DIR",
+        help="serve tasks from a local cache, storing whatever has to be fetched "
+        "(default DIR: {})".format(DEFAULT_DIRECTORY),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=10,
+        metavar="GB",
+        help="with --cache, evict the least recently used entries beyond this size "
+        "(default: 10)",
+    )
+    parser.add_argument(
+        "--notify",
+        metavar="EMAIL",
+        help="email EMAIL when done, using the credentials in auth.json",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="append per-task metrics (request latency, JSON size, build and write time) "
+        "and the run's totals to this JSON-lines file",
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="show a live throughput and latency summary on the progress bar",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spec = get_spec(args.dataset)
+    if args.fields or args.exclude_fields:
+        spec = spec.project(includes=args.fields, excludes=args.exclude_fields)
+    os.makedirs(args.out, exist_ok=True)
+    parts_dir = os.path.join(args.out, "_parts")
+    writer = get_writer(args.format)
+
+    start, end = args.start, args.end
+    if args.incremental:
+        args.stream = True
+    if args.stream:
+        # Streamed runs checkpoint every finished task, so rerunning the same job picks up where it left off
+        manifest = Manifest(os.path.join(args.out, "_manifest.jsonl"))
+    if args.incremental:
+        start = manifest.high_watermark(spec, args.start)
+        end = datetime.datetime.now().replace(second=0, microsecond=0)
+        print("Fetching {} to {}".format(start, end))
+
+    # Before any worker starts, so every worker builds its clients the same way
+    client.configure(
+        compress=not args.no_compress, maxsize=args.pool_size, timeout=args.timeout
+    )
+    workers = args.workers or strategies.default_workers(args.strategy, args.slices)
+    # Documents per sensor per hour, for `python -m elastic_fetching.gaps` to report on
+    coverage = Coverage(coverage_path(args.out, spec))
+    report = RunReport(args.report, live=args.debug)
+    ranges = [(start, end)]
+    if args.stream:
+        # Whatever tasks recorded the checkpoints, so changing the strategy or its settings never fetches time twice
+        ranges = uncovered(start, end, manifest.covered(spec))
+        skipped = (end - start) - sum(
+            (range_end - range_start for range_start, range_end in ranges),
+            datetime.timedelta(0),
+        )
+        if skipped:
+            print(
+                "Skipping {} already checkpointed in {}".format(skipped, manifest.path)
+            )
+    with contextlib.ExitStack() as stack:
+        tasks = [
+            task
+            for range_start, range_end in ranges
+            for task in stack.enter_context(
+                strategies.planned_tasks(
+                    args.strategy,
+                    spec,
+                    range_start,
+                    range_end,
+                    slices=args.slices,
+                    target_docs=args.target_docs,
+                    host=args.host,
+                    batch_windows=args.batch_windows,
+                )
+            )
+        ]
+        if args.engine == "async":
+            options = {
+                "concurrency": args.concurrency,
+                "host": args.host,
+                "convert_workers": args.convert_workers,
+            }
+            backend = aio
+        else:
+            options = {"workers": workers, "host": args.host}
+            backend = engine
+        options["report"] = report
+        if args.cache:
+            options["cache"] = QueryCache(
+                args.cache, max_bytes=int(args.cache_size * 1024**3)
+            )
+        if args.stream:
+            pending = [task for task in tasks if not manifest.is_complete(spec, task)]
+            if len(pending) < len(tasks):
+                print(
+                    "Skipping {} tasks already checkpointed in {}".format(
+                        len(tasks) - len(pending), manifest.path
+                    )
+                )
+            # Parts of windows left unfinished that this run doesn't pick up task for task are fetched again
+            planned = set(task.key for task in tasks)
+            manifest.discard(
+                spec,
+                [
+                    entry
+                    for entry in manifest.unfinished(spec)
+                    if entry["task"] not in planned
+                ],
+            )
+            # Checkpoints written before they carried their coverage are left to the index as it is
+            refetched = set(task.key for task in pending)
+            done = [
+                (entry["start"], entry["end"], from_rows(entry["coverage"]))
+                for entry in manifest.unmerged(spec)
+                if entry["task"] not in refetched and "coverage" in entry
+            ]
+            coverage.expect(pending, done)
+
+            def on_result(summary):
+                manifest.record(spec, summary)
+                coverage.record(summary)
+
+            try:
+                backend.stream(
+                    spec,
+                    pending,
+                    parts_dir,
+                    writer=writer,
+                    on_result=on_result,
+                    **options
+                )
+            finally:
+                # Whatever was checkpointed stays counted, as reruns skip it
+                coverage.save()
+        else:
+            all_df = backend.fetch(spec, tasks, **options)
+            coverage.reset(start, end)
+            coverage.add(tally(spec, all_df))
+            coverage.mark(start, end)
+
+    if args.stream:
+        entries = manifest.unmerged(spec)
+        parts = [part["path"] for entry in entries for part in entry["parts"]]
+        writer.finalize(
+            spec,
+            parts,
+            args.out,
+            keep_parts=args.keep_parts,
+            append=manifest.has_merged(spec),
+        )
+        manifest.mark_merged(spec, entries)
+        if not args.keep_parts and not os.listdir(parts_dir):
+            os.rmdir(parts_dir)
+    else:
+        writer.write(all_df, spec, args.out, args.start, args.end)
+        coverage.save()
+    totals = report.close()
+    if args.debug:
+        print(
+            "Fetched {:,} documents ({:.1f}M chars of JSON) in {:.1f}s: {}".format(
+                totals["docs"],
+                totals["chars"] / 1e6,
+                totals["wall_s"],
+                report.summary(),
+            )
+        )
+    print("Done processing data")
+
+    if args.notify:
+        with open("auth.json") as json_file:
+            auth = json.loads(json_file.read())
+        notify(auth, args.notify, task_name="{} parsing from elastic".format(spec.name))
@@ -0,0 +1,85 @@
+"""
+ElasticSearch clients, built once per process per host and reused by every task the process runs.
+
+Building a client per task meant a new connection pool, and a new TCP connection, for every one of a month's 720
+hourly tasks. These clients keep their connections alive between tasks and ask for gzip compressed responses, which
+shrink the wide, repetitive JSON pages of the air quality index several times over on the way from the cluster.
+
+The options are set once per run with `configure`, before any worker starts; forked workers inherit them the same way
+they inherit the retry governor (see `elastic_fetching.retry`).
+"""
+
+import os
+
+from elasticsearch import Elasticsearch
+
+from elastic_fetching.metrics import CountingSerializer
+
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:
+    # Needs elasticsearch>=7.8 installed with its "async" extra (aiohttp)
+    AsyncElasticsearch = None
+
+DEFAULT_COMPRESS = True
+DEFAULT_MAXSIZE = 4
+# Seconds; a page of wide documents over the WAN can take longer than the client's own default of 10
+DEFAULT_TIMEOUT = 60
+
+OPTIONS = {
+    "http_compress": DEFAULT_COMPRESS,
+    "maxsize": DEFAULT_MAXSIZE,
+    "timeout": DEFAULT_TIMEOUT,
+}
+_CLIENTS = {}
+
+
+def configure(
+    compress=DEFAULT_COMPRESS, maxsize=DEFAULT_MAXSIZE, timeout=DEFAULT_TIMEOUT
+):
+    """
+    Sets the options of every client built from now on
+    Args:
+        compress (bool) [optional]: Whether to gzip request bodies and ask for gzipped responses
+        maxsize (int) [optional]: The most connections each synchronous client keeps open to a host
+        timeout (float) [optional]: Seconds to wait for a response before giving up on a request
+    """
+    OPTIONS.update(http_compress=compress, maxsize=maxsize, timeout=timeout)
+    _CLIENTS.clear()
+
+
+def get_client(host):
+    """
+    Args:
+        host (dict): The ElasticSearch host to connect to
+    Returns:
+        es (elasticsearch.Elasticsearch): This process's client for the host, with a `CountingSerializer`
+            (`es.transport.serializer`)
+    """
+    # Forked workers inherit the parent's clients, whose sockets must not be shared
+    key = (os.getpid(), tuple(sorted(host.items())))
+    es = _CLIENTS.get(key)
+    if es is None:
+        es = _CLIENTS[key] = Elasticsearch(
+            hosts=[host], serializer=CountingSerializer(), **OPTIONS
+        )
+    return es
+
+
+def new_async_client(host, maxsize):
+    """
+    Args:
+        host (dict): The ElasticSearch host to connect to
+        maxsize (int): The most connections to keep open to the host, e.g. one per task in flight
+    Returns:
+        es (elasticsearch.AsyncElasticsearch): A new client for the host, with a `CountingSerializer`
+            (`es.transport.serializer`); close it once done
+    Raises:
+        RuntimeError: If the async client isn't installed
+    """
+    if AsyncElasticsearch is None:
+        raise RuntimeError(
+            "The async engine needs elasticsearch>=7.8 with aiohttp: pip install elasticsearch[async]"
+        )
+    options = dict(OPTIONS, maxsize=maxsize)
+    return AsyncElasticsearch(hosts=[host], serializer=CountingSerializer(), **options)
@@ -0,0 +1,117 @@
+"""
+Column-oriented accumulation of ElasticSearch hits.
+
+Building a one-row DataFrame per document and appending it to a growing frame copies the whole frame for every hit.
+`ColumnarBatch` instead gathers each `_source` into plain per-column lists and builds a single DataFrame at the end.
+"""
+
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def coerce(series, dtype):
+    """
+    Args:
+        series (pandas.Series): A column as it came out of ElasticSearch
+        dtype (str): The dtype the column should have
+    Returns:
+        series (pandas.Series): The column cast to `dtype`; integer columns with gaps are left as floats
+    """
+    if dtype == "object" or str(series.dtype) == dtype:
+        return series
+    if dtype.startswith(("int", "float")):
+        series = pd.to_numeric(series, errors="coerce")
+        if dtype.startswith("int") and series.isnull().any():
+            return series
+    return series.astype(dtype)
+
+
+class ColumnarBatch:
+    """
+    Gathers `_source` dicts into per-column lists and turns them into one DataFrame on demand.
+
+    Args:
+        columns (list) [optional]: Columns that should always be present (and come first) in the built DataFrame
+        dtypes (dict) [optional]: Column name to dtype; matching columns are cast when the DataFrame is built
+        timestamp_field (str) [optional]: The epoch-millis field converted into the `timestamp-iso` column
+        frame_transforms (list) [optional]: Callables fixing up the built DataFrame in place, applied in order before
+            columns are cast
+    """
+
+    def __init__(
+        self,
+        columns=None,
+        dtypes=None,
+        timestamp_field="timestamp",
+        frame_transforms=(),
+    ):
+        self.columns = OrderedDict((column, []) for column in columns or [])
+        self.dtypes = dict(dtypes or {})
+        self.timestamp_field = timestamp_field
+        self.frame_transforms = list(frame_transforms)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, source):
+        """
+        Args:
+            source (dict): The `_source` of a single document
+        """
+        for key in source:
+            if key not in self.columns:
+                # Backfill columns that show up part way through the batch
+                self.columns[key] = [None] * self.length
+        for key, values in self.columns.items():
+            values.append(source.get(key))
+        self.length += 1
+
+    def extend(self, hits):
+        """
+        Gathers a whole page column by column, rather than document by document
+        Args:
+            hits (list): The `hits.hits` list of a search or scroll response
+        """
+        sources = [hit["_source"] for hit in hits]
+        keys = set()
+        for source in sources:
+            keys.update(source)
+        if not keys.issubset(self.columns):
+            # Backfill new columns in the order they first show up, as `append` does
+            for source in sources:
+                for key in source:
+                    if key not in self.columns:
+                        self.columns[key] = [None] * self.length
+        for key, values in self.columns.items():
+            if key in keys:
+                values.extend([source.get(key) for source in sources])
+            else:
+                values.extend([None] * len(sources))
+        self.length += len(sources)
+
+    def to_frame(self):
+        """
+        Returns:
+            frame (pandas.DataFrame): Every document gathered so far, with a `timestamp-iso` column appended
+        """
+        frame = pd.DataFrame(self.columns, columns=list(self.columns))
+        for transform in self.frame_transforms:
+            transform(frame)
+        for column, dtype in self.dtypes.items():
+            if column in frame:
+                frame[column] = coerce(frame[column], dtype)
+        if self.timestamp_field in frame:
+            frame["timestamp-iso"] = pd.to_datetime(
+                frame[self.timestamp_field], unit="ms"
+            )
+        return frame
+
+    def clear(self):
+        """
+        Drops every gathered document while keeping the known columns.
+        """
+        for values in self.columns.values():
+            del values[:]
+        self.length = 0
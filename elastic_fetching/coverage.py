@@ -0,0 +1,428 @@
+"""
+A compact on-disk index of what a fetch covered: documents per sensor (or camera) per hour, and which minutes of every
+hour have been fetched at all.
+
+Fetches keep it up to date as tasks complete, in `<out>/_coverage_<dataset>.npz`: a `counts` matrix of one row per
+key and one column per hour, and a `minutes` bitmap holding one bit per fetched minute of every hour. Gap reports,
+completeness checks and "what still needs fetching" queries then only read those arrays, never the fetched data:
+
+    python -m elastic_fetching.gaps air_quality gaps --out ./csv --start 2019-06-01 --end 2019-07-01
+
+An index can be built for an earlier fetch from its `all.csv` or Parquet dataset with `build`.
+"""
+
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+
+from elastic_fetching.output import pq
+from elastic_fetching.windows import from_epoch_millis, to_epoch_millis
+
+BUCKET_MILLIS = 60 * 60 * 1000
+MINUTE_MILLIS = 60 * 1000
+# One bit per minute of an hour
+FULL_HOUR = np.uint64((1 << 60) - 1)
+
+
+def coverage_path(out_dir, spec):
+    """
+    Args:
+        out_dir (str): The directory a fetch writes its output to
+        spec (DatasetSpec): The dataset being fetched
+    Returns:
+        path (str): Where the fetch keeps its coverage index
+    """
+    return os.path.join(out_dir, "_coverage_{}.npz".format(spec.name))
+
+
+def tally(spec, frame):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the documents belong to
+        frame (pandas.DataFrame): Fetched documents, e.g. a single page
+    Returns:
+        counts (pandas.Series): How many documents each key has per hour, indexed by `(key, bucket)` where `bucket`
+            counts hours since the epoch
+    """
+    keys = frame[spec.partition_key].astype(object).values
+    buckets = frame[spec.timestamp_field].values.astype(np.int64) // BUCKET_MILLIS
+    return (
+        pd.DataFrame({"key": keys, "bucket": buckets}).groupby(["key", "bucket"]).size()
+    )
+
+
+def combine(tallies):
+    """
+    Args:
+        tallies (list): Results of `tally`, e.g. one per page of a task
+    Returns:
+        counts (pandas.Series): Their sum, in the same form
+    """
+    tallies = [counts for counts in tallies if len(counts)]
+    if not tallies:
+        return _empty_tally()
+    return pd.concat(tallies).groupby(level=[0, 1]).sum()
+
+
+def to_rows(counts):
+    """
+    Args:
+        counts (pandas.Series): A result of `tally` or `combine`
+    Returns:
+        rows (list): `[key, bucket, docs]` for every count, to store as JSON
+    """
+    return [
+        [str(key), int(bucket), int(docs)] for (key, bucket), docs in counts.items()
+    ]
+
+
+def from_rows(rows):
+    """
+    Args:
+        rows (list): As returned by `to_rows`
+    Returns:
+        counts (pandas.Series): The counts, as `tally` returns them
+    """
+    if not rows:
+        return _empty_tally()
+    keys, buckets, docs = zip(*rows)
+    return pd.Series(
+        np.array(docs, dtype=np.int64),
+        index=pd.MultiIndex.from_arrays(
+            [list(keys), np.array(buckets, dtype=np.int64)], names=["key", "bucket"]
+        ),
+    )
+
+
+def _empty_tally():
+    return pd.Series(
+        [],
+        dtype=np.int64,
+        index=pd.MultiIndex.from_arrays([[], []], names=["key", "bucket"]),
+    )
+
+
+def _minute_bits(start_millis, end_millis, bucket):
+    # The bits of the bucket's minutes that lie within [start, end)
+    first = max(start_millis - bucket * BUCKET_MILLIS, 0) // MINUTE_MILLIS
+    last = min(end_millis - bucket * BUCKET_MILLIS, BUCKET_MILLIS) // MINUTE_MILLIS
+    if last <= first:
+        return np.uint64(0)
+    return np.uint64(((1 << (last - first)) - 1) << first)
+
+
+class Coverage:
+    """
+    Args:
+        path (str): The `.npz` file to load the index from, if it exists, and to `save` it to
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = []
+        self.origin = 0
+        self.counts = np.zeros((0, 0), dtype=np.int32)
+        self.minutes = np.zeros(0, dtype=np.uint64)
+        self._pending = collections.Counter()
+        if os.path.exists(path):
+            with np.load(path) as arrays:
+                self.keys = [str(key) for key in arrays["keys"]]
+                self.origin = int(arrays["origin"])
+                self.counts = arrays["counts"]
+                self.minutes = arrays["minutes"]
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def save(self):
+        """
+        Writes the index under a temporary name and renames it into place, so readers never see half of it
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as npz_file:
+            np.savez(
+                npz_file,
+                keys=np.array(self.keys, dtype=str),
+                origin=np.int64(self.origin),
+                counts=self.counts,
+                minutes=self.minutes,
+            )
+        os.replace(temporary, self.path)
+
+    def _extend(self, first, last):
+        # Makes room for buckets `first` to `last` (inclusive)
+        if not len(self):
+            self.origin = first
+        start = min(first, self.origin)
+        end = max(last + 1, self.origin + len(self))
+        if start == self.origin and end == self.origin + len(self):
+            return
+        before = self.origin - start
+        counts = np.zeros((len(self.keys), end - start), dtype=np.int32)
+        counts[:, before : before + len(self)] = self.counts
+        minutes = np.zeros(end - start, dtype=np.uint64)
+        minutes[before : before + len(self)] = self.minutes
+        self.origin, self.counts, self.minutes = start, counts, minutes
+
+    def _key_rows(self, keys):
+        known = {key: row for row, key in enumerate(self.keys)}
+        added = [key for key in pd.unique(np.asarray(keys)) if key not in known]
+        if added:
+            for key in added:
+                known[key] = len(self.keys)
+                self.keys.append(key)
+            self.counts = np.vstack(
+                [self.counts, np.zeros((len(added), len(self)), dtype=np.int32)]
+            )
+        return np.array([known[key] for key in keys], dtype=np.int64)
+
+    def _buckets(self, start, end):
+        # The buckets overlapping [start, end), as epoch millis and a bucket range
+        start_millis, end_millis = to_epoch_millis(start), to_epoch_millis(end)
+        first = start_millis // BUCKET_MILLIS
+        last = (end_millis - 1) // BUCKET_MILLIS
+        return start_millis, end_millis, first, last
+
+    def add(self, counts):
+        """
+        Args:
+            counts (pandas.Series): Documents per `(key, bucket)`, see `tally`
+        """
+        if not len(counts):
+            return
+        keys = [str(key) for key in counts.index.get_level_values(0)]
+        buckets = counts.index.get_level_values(1).values.astype(np.int64)
+        self._extend(buckets.min(), buckets.max())
+        rows = self._key_rows(keys)
+        np.add.at(self.counts, (rows, buckets - self.origin), counts.values)
+
+    def mark(self, start, end):
+        """
+        Records that every minute of `[start, end)` has been fetched
+        Args:
+            start (datetime.datetime): The start of the fetched window (inclusive)
+            end (datetime.datetime): The end of the fetched window (exclusive)
+        """
+        start_millis, end_millis, first, last = self._buckets(start, end)
+        if last < first:
+            return
+        self._extend(first, last)
+        for bucket in (first, last):
+            self.minutes[bucket - self.origin] |= _minute_bits(
+                start_millis, end_millis, bucket
+            )
+        self.minutes[first + 1 - self.origin : last - self.origin] = FULL_HOUR
+
+    def reset(self, start, end, whole=False):
+        """
+        Forgets `[start, end)`, before it is fetched again. Hours it only partly covers are forgotten altogether if
+        the overlap was already fetched, since their counts can't be split by minute
+        Args:
+            start (datetime.datetime): The start of the window (inclusive)
+            end (datetime.datetime): The end of the window (exclusive)
+            whole (bool) [optional]: Forget every hour the window touches, fetched or not
+        """
+        start_millis, end_millis, first, last = self._buckets(start, end)
+        first, last = max(first, self.origin), min(last, self.origin + len(self) - 1)
+        if last < first:
+            return
+        lo, hi = first - self.origin, last - self.origin + 1
+        overlap = np.array(
+            [
+                _minute_bits(start_millis, end_millis, bucket)
+                for bucket in range(first, last + 1)
+            ],
+            dtype=np.uint64,
+        )
+        touched = (self.minutes[lo:hi] & overlap) != 0
+        full = overlap == FULL_HOUR
+        forget = full | touched | whole
+        self.counts[:, lo:hi][:, forget] = 0
+        self.minutes[lo:hi][forget] = 0
+
+    def expect(self, tasks, done=()):
+        """
+        Resets the window of every task about to be fetched; `record` marks a window fetched once all its tasks are
+        recorded. Tasks already fetched are rebuilt from `done` rather than trusted to the index, which a killed
+        fetch never saved and which resetting the hours they share with refetched tasks would lose
+        Args:
+            tasks (list): Tasks from `elastic_fetching.strategies`
+            done (list) [optional]: `(start, end, counts)` of every task of the fetch that isn't fetched again, with
+                `counts` its `tally`
+        """
+        windows = collections.Counter((task.start, task.end) for task in tasks)
+        for start, end in windows:
+            self.reset(start, end)
+        for start, end, _ in done:
+            self.reset(start, end, whole=True)
+        self._pending.update(windows)
+        for start, end, counts in done:
+            self.add(counts)
+            if (start, end) not in windows:
+                self.mark(start, end)
+
+    def record(self, summary):
+        """
+        Args:
+            summary (dict): A completed task's summary, with its `start`, `end` and `coverage` (see `tally`)
+        """
+        self.add(summary["coverage"])
+        window = (summary["start"], summary["end"])
+        self._pending[window] -= 1
+        if self._pending[window] <= 0:
+            del self._pending[window]
+            self.mark(*window)
+
+    def _window(self, start, end):
+        # Bucket range of [start, end) within the index, and the fetched minutes of each of its buckets
+        start_millis, end_millis, first, last = self._buckets(start, end)
+        buckets = np.arange(first, last + 1)
+        inside = (buckets >= self.origin) & (buckets < self.origin + len(self))
+        minutes = np.zeros(len(buckets), dtype=np.uint64)
+        minutes[inside] = self.minutes[buckets[inside] - self.origin]
+        wanted = np.array(
+            [_minute_bits(start_millis, end_millis, bucket) for bucket in buckets],
+            dtype=np.uint64,
+        )
+        counts = np.zeros((len(self.keys), len(buckets)), dtype=np.int64)
+        counts[:, inside] = self.counts[:, buckets[inside] - self.origin]
+        return buckets, minutes & wanted, wanted, counts
+
+    def hours(self, start, end, keys=None):
+        """
+        Args:
+            start (datetime.datetime): The start of the range (inclusive)
+            end (datetime.datetime): The end of the range (exclusive)
+            keys (list) [optional]: Only these sensors or cameras, including ones never seen; defaults to every one
+                seen so far
+        Returns:
+            counts (pandas.DataFrame): Documents per hour (rows) per key (columns); hours not completely fetched
+                are NaN
+        """
+        buckets, fetched, wanted, counts = self._window(start, end)
+        frame = pd.DataFrame(
+            counts.T.astype(np.float64),
+            index=pd.Index(
+                [from_epoch_millis(bucket * BUCKET_MILLIS) for bucket in buckets],
+                name="hour",
+            ),
+            columns=self.keys,
+        )
+        # A key never tallied had no documents in any fetched hour
+        frame = frame.reindex(columns=sorted(keys or self.keys), fill_value=0.0)
+        frame.loc[fetched != wanted] = np.nan
+        return frame
+
+    def gaps(self, start, end, keys=None, min_docs=1):
+        """
+        Args:
+            start (datetime.datetime): The start of the range (inclusive)
+            end (datetime.datetime): The end of the range (exclusive)
+            keys (list) [optional]: Only these sensors or cameras; defaults to every one seen so far
+            min_docs (int) [optional]: Fewer documents than this in a fetched hour count as a gap
+        Returns:
+            gaps (pandas.DataFrame): The `key`, `hour` and `docs` of every fetched hour holding fewer than
+                `min_docs` documents
+        """
+        hours = self.hours(start, end, keys)
+        hours = hours[hours.notnull().all(axis=1)]
+        docs = hours.values
+        rows, columns = np.nonzero(docs < min_docs)
+        return (
+            pd.DataFrame(
+                {
+                    "key": np.asarray(hours.columns)[columns],
+                    "hour": hours.index[rows],
+                    "docs": docs[rows, columns].astype(np.int64),
+                },
+                columns=["key", "hour", "docs"],
+            )
+            .sort_values(["key", "hour"])
+            .reset_index(drop=True)
+        )
+
+    def missing(self, start, end):
+        """
+        Args:
+            start (datetime.datetime): The start of the range (inclusive)
+            end (datetime.datetime): The end of the range (exclusive)
+        Returns:
+            windows (list): `(start, end)` tuples of every stretch of the range not fetched yet, to the minute
+        """
+        buckets, fetched, wanted, _ = self._window(start, end)
+        todo = wanted & ~fetched
+        if not todo.any():
+            return []
+        bits = ((todo[:, None] >> np.arange(60, dtype=np.uint64)) & 1).ravel()
+        edges = np.diff(np.concatenate([[0], bits, [0]]).astype(np.int8))
+        first_minute = buckets[0] * 60
+        return [
+            (
+                from_epoch_millis((first_minute + run_start) * MINUTE_MILLIS),
+                from_epoch_millis((first_minute + run_end) * MINUTE_MILLIS),
+            )
+            for run_start, run_end in zip(
+                np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+            )
+        ]
+
+    def summary(self, start, end, keys=None, min_docs=1):
+        """
+        Args:
+            start (datetime.datetime): The start of the range (inclusive)
+            end (datetime.datetime): The end of the range (exclusive)
+            keys (list) [optional]: Only these sensors or cameras; defaults to every one seen so far
+            min_docs (int) [optional]: How many documents an hour needs to count as complete
+        Returns:
+            summary (pandas.DataFrame): Per key, the `docs` fetched, the `hours` fully fetched, how many of those
+                hold at least `min_docs` documents (`complete`) and the share they make up (`completeness`)
+        """
+        hours = self.hours(start, end, keys)
+        fetched = hours.notnull()
+        summary = pd.DataFrame(
+            {
+                "docs": hours.sum().astype(np.int64),
+                "hours": fetched.sum(),
+                "complete": (hours >= min_docs).sum(),
+            },
+            columns=["docs", "hours", "complete"],
+        )
+        summary["completeness"] = summary["complete"] / summary["hours"].where(
+            summary["hours"] > 0
+        )
+        summary.index.name = "key"
+        return summary
+
+
+def build(spec, source, start, end, path):
+    """
+    Builds an index for an earlier fetch from its output
+    Args:
+        spec (DatasetSpec): The dataset that was fetched
+        source (str): The fetch's `all.csv`, or the root directory of its Parquet dataset
+        start (datetime.datetime): The start of the range that was fetched (inclusive)
+        end (datetime.datetime): The end of the range that was fetched (exclusive)
+        path (str): Where to save the index
+    Returns:
+        coverage (Coverage): The new index
+    """
+    columns = [spec.partition_key, spec.timestamp_field]
+    if os.path.isdir(source):
+        if pq is None:
+            raise RuntimeError("Reading Parquet needs pyarrow: pip install pyarrow")
+        frame = pq.read_table(source, columns=columns).to_pandas()
+    else:
+        frame = pd.read_csv(source, usecols=columns)
+    coverage = Coverage(path)
+    coverage.reset(start, end)
+    start_millis, end_millis = to_epoch_millis(start), to_epoch_millis(end)
+    stamps = frame[spec.timestamp_field]
+    coverage.add(tally(spec, frame[(stamps >= start_millis) & (stamps < end_millis)]))
+    coverage.mark(start, end)
+    coverage.save()
+    return coverage
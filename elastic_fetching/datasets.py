@@ -0,0 +1,132 @@
+"""
+The CUIP indices we know how to fetch.
+
+Adding a new index means registering its schema in `elastic_fetching.schema`, then adding a `DatasetSpec` here and
+registering it in `SPECS`.
+"""
+
+import pandas as pd
+
+from elastic_fetching.nested import NestedColumn
+from elastic_fetching.spec import DatasetSpec
+
+# Every bounding box of a vision event, as ElasticSearch lists them
+DETECTIONS = NestedColumn("detections", ["x", "y", "width", "height"])
+
+
+def fill_hit_counts(frame):
+    """
+    Fix hit counts sometimes not being there, by counting the event's bounding boxes
+    """
+    if "hit_counts" in frame and "locations" in frame:
+        missing = frame["hit_counts"].isnull().values
+        if missing.any():
+            locations = frame["locations"][missing]
+            counts = pd.Series(DETECTIONS.lengths(locations), index=locations.index)
+            frame["hit_counts"] = frame["hit_counts"].fillna(counts)
+
+
+# Diagnostic fields of the PurpleAir feed nobody downstream uses; they never need to leave the cluster
+AIR_QUALITY_EXCLUDES = [
+    "SensorId",
+    "Adc",
+    "response_date",
+    "key2_response_b",
+    "wlstate",
+    "pm2.5_aqi",
+    "ts_s_latency_b",
+    "DateTime",
+    "httpsuccess",
+    "key2_count_b",
+    "key2_response_date_b",
+    "period",
+    "hardwareversion",
+    "httpsends",
+    "memcs",
+    "pressure",
+    "key2_response",
+    "version",
+    "Geo",
+    "status_6",
+    "status_5",
+    "status_8",
+    "key1_response",
+    "status_7",
+    "Mem",
+    "pm2.5_aqi_color",
+    "status_9",
+    "key1_count",
+    "ts_latency_b",
+    "key1_response_date",
+    "status_0",
+    "Id",
+    "status_2",
+    "status_1",
+    "status_4",
+    "status_3",
+    "pm2.5_aqi_b",
+    "loggingrate",
+    "latency",
+    "key1_count_b",
+    "memfrag",
+    "key1_response_b",
+    "key2_count",
+    "hardwarediscovered",
+    "latency_b",
+    "status_10",
+    "response_b",
+    "response_date_b",
+    "memfb",
+    "location",
+    "response",
+    "ts_s_latency",
+    "ts_latency",
+    "uptime",
+    "pa_latency",
+    "pm2.5_aqi_color_b",
+    "key2_response_date",
+    "rssi",
+    "place",
+    "key1_response_date_b",
+]
+
+AIR_QUALITY = DatasetSpec(
+    name="air_quality",
+    index="mlk_*_air_quality-*",
+    partition_key="nicename",
+    partition_filename="aq-{key}-{day}.csv",
+    # A sensor reports at most once per timestamp
+    unique_key=["nicename", "timestamp"],
+    excludes=AIR_QUALITY_EXCLUDES,
+)
+
+VISION_EVENTS = DatasetSpec(
+    name="vision_events",
+    index="cuip_vision_events",
+    partition_key="camera_id",
+    partition_filename="{key}_{day}.csv",
+    frame_transforms=[fill_hit_counts],
+    nested={"locations": DETECTIONS},
+    unique_key=["id"],
+)
+
+SPECS = {spec.name: spec for spec in (AIR_QUALITY, VISION_EVENTS)}
+
+
+def get_spec(name):
+    """
+    Args:
+        name (str): The name of a registered dataset, e.g. "air_quality"
+    Returns:
+        spec (DatasetSpec): The matching dataset spec
+    Raises:
+        KeyError: If no dataset by that name has been registered
+    """
+    try:
+        return SPECS[name]
+    except KeyError:
+        raise KeyError(
+            "Unknown dataset {!r}; expected one of {}".format(
+                name, ", ".join(sorted(SPECS))
+            )
+        )
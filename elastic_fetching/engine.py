@@ -0,0 +1,346 @@
+"""
+Runs a `DatasetSpec` against ElasticSearch.
+
+A large fetch is broken up into many smaller tasks (see `elastic_fetching.strategies`) which are each run by a
+separate process.
+"""
+
+import functools
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from operator import itemgetter
+
+import tqdm
+from elastic_fetching import client, coverage, handoff, output, retry
+from elastic_fetching.manifest import checksum
+from elastic_fetching.metrics import MeteredClient, TaskMetrics, counted_pages
+from elastic_fetching.windows import to_epoch_millis
+
+DEFAULT_HOST = {"host": "scmgmt2.research.utc.edu", "port": 9200}
+PAGE_SIZE = 1000
+SCROLL = "60m"
+
+
+def range_query(spec, start, end):
+    """
+    Args:
+        spec (DatasetSpec): The dataset being queried
+        start (datetime.datetime): The start of the window (inclusive)
+        end (datetime.datetime): The end of the window (exclusive)
+    Returns:
+        query (dict): A query matching every document of the window
+    """
+    return {
+        "range": {
+            spec.timestamp_field: {
+                "gte": to_epoch_millis(start),
+                "lt": to_epoch_millis(end),
+                "format": "epoch_millis",
+            }
+        }
+    }
+
+
+def task_pages(spec, task, metrics, host=DEFAULT_HOST):
+    """
+    Runs a single task, one page at a time
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        task (object): A task from `elastic_fetching.strategies`
+        metrics (TaskMetrics): Where to record each request
+        host (dict) [optional]: The ElasticSearch host to connect to
+    Returns:
+        pages (generator): The `hits.hits` of each non-empty page
+    """
+    es = MeteredClient(client.get_client(host), metrics)
+    return counted_pages(task.pages(es, spec), metrics)
+
+
+def page_frame(spec, docs):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the page belongs to
+        docs (list): The `hits.hits` of a single page
+    Returns:
+        frame (pandas.DataFrame): The page as a DataFrame
+    """
+    batch = spec.new_batch()
+    spec.add_hits(batch, docs)
+    return batch.to_frame()
+
+
+def part_path(parts_dir, task, page, writer):
+    """
+    Args:
+        parts_dir (str): The directory part files are written to
+        task (object): The task the page belongs to
+        page (int): The page's position within the task
+        writer (object): The writer from `elastic_fetching.output` the part is written with
+    Returns:
+        path (str): Where the page's part file goes; paths sort in task and page order
+    """
+    return os.path.join(
+        parts_dir, "{}-{:05d}{}".format(task.key, page, writer.extension)
+    )
+
+
+def write_frame(spec, frame, path, writer):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the page belongs to
+        frame (pandas.DataFrame): A single page of documents
+        path (str): Where to write the page's part file
+        writer (object): The writer from `elastic_fetching.output` to write the part with
+    Returns:
+        docs (int): How many documents were written
+        sha256 (str): The checksum of the written part
+    """
+    writer.write_part(frame, path, spec)
+    return len(frame), checksum(path)
+
+
+def concat_pages(spec, frames):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the pages belong to
+        frames (list): The DataFrame of every page of a task
+    Returns:
+        frame (pandas.DataFrame): Every page in one DataFrame
+    """
+    if not frames:
+        return spec.new_batch().to_frame()
+    return spec.concat(frames)
+
+
+def task_frames(spec, task, metrics, host=DEFAULT_HOST, cache=None):
+    """
+    Runs a single task one page at a time, through a `elastic_fetching.cache.QueryCache` if one is given
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        task (object): A task from `elastic_fetching.strategies`
+        metrics (TaskMetrics): Where to record each request and how long pages take to build
+        host (dict) [optional]: The ElasticSearch host to connect to
+        cache (QueryCache) [optional]: A cache to serve the task from, or to store it in once fetched
+    Yields:
+        frame (pandas.DataFrame): Each page of the task as a DataFrame
+    """
+    entry = None
+    if cache is not None:
+        with metrics.timing("cache"):
+            pages = cache.lookup(spec, task, host)
+        if pages is not None:
+            metrics.cached(pages)
+            yield from pages
+            return
+        entry = cache.entry(spec, task, host)
+    try:
+        for page, docs in enumerate(task_pages(spec, task, metrics, host=host)):
+            with metrics.timing("build"):
+                frame = page_frame(spec, docs)
+            if entry:
+                with metrics.timing("cache"):
+                    cache.write(spec, entry, page, frame)
+            yield frame
+    except BaseException:
+        if entry:
+            cache.discard(entry)
+        raise
+    if entry:
+        with metrics.timing("cache"):
+            cache.commit(spec, task, host, entry)
+
+
+def new_summary(task):
+    return {
+        "task": task.key,
+        "start": task.start,
+        "end": task.end,
+        "docs": 0,
+        "parts": [],
+        "checksums": [],
+    }
+
+
+def add_part(summary, path, docs, sha256):
+    summary["docs"] += docs
+    summary["parts"].append(path)
+    summary["checksums"].append(sha256)
+
+
+def measured_fetch_task(spec, task, host=DEFAULT_HOST, cache=None):
+    """
+    `fetch_task`, also returning the task's metrics
+    Returns:
+        frame (pandas.DataFrame): Every document of the task
+        metrics (dict): The task's metrics, see `elastic_fetching.metrics.TaskMetrics`
+    """
+    metrics = TaskMetrics(task)
+    if cache is not None:
+        frame = concat_pages(
+            spec, list(task_frames(spec, task, metrics, host=host, cache=cache))
+        )
+        return frame, metrics.finish()
+    batch = spec.new_batch()
+    for docs in task_pages(spec, task, metrics, host=host):
+        with metrics.timing("build"):
+            spec.add_hits(batch, docs)
+    with metrics.timing("build"):
+        frame = batch.to_frame()
+    return frame, metrics.finish()
+
+
+def fetch_task(spec, task, host=DEFAULT_HOST, cache=None):
+    """
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        task (object): A task from `elastic_fetching.strategies`
+        host (dict) [optional]: The ElasticSearch host to connect to
+        cache (QueryCache) [optional]: A cache to serve the task from, or to store it in once fetched
+    Returns:
+        frame (pandas.DataFrame): Every document of the task
+    """
+    return measured_fetch_task(spec, task, host=host, cache=cache)[0]
+
+
+def published_fetch_task(spec, task, directory, host=DEFAULT_HOST, cache=None):
+    """
+    `measured_fetch_task`, handing the task's documents back through `elastic_fetching.handoff` rather than pickling
+    them
+    Args:
+        directory (str): Where to publish the task's documents, see `handoff.new_directory`
+    Returns:
+        handle (object): The task's documents, to `handoff.collect`
+        metrics (dict): The task's metrics, see `elastic_fetching.metrics.TaskMetrics`
+    """
+    frame, metrics = measured_fetch_task(spec, task, host=host, cache=cache)
+    path = os.path.join(directory, "{}.arrow".format(task.key))
+    return handoff.publish(spec, frame, path), metrics
+
+
+def stream_task(spec, task, parts_dir, writer=None, host=DEFAULT_HOST, cache=None):
+    """
+    Writes every page of a single task straight to its own part file, so only one page is ever held in memory
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        task (object): A task from `elastic_fetching.strategies`
+        parts_dir (str): The directory to write part files to
+        writer (object) [optional]: The writer from `elastic_fetching.output` to write parts with; defaults to CSV
+        host (dict) [optional]: The ElasticSearch host to connect to
+        cache (QueryCache) [optional]: A cache to serve the task from, or to store it in once fetched
+    Returns:
+        summary (dict): The `task` key, its `start` and `end`, the number of `docs` fetched, the `parts` written,
+            their `checksums`, the documents per key per hour (`coverage`, see `elastic_fetching.coverage.tally`)
+            and the task's `metrics`
+    """
+    if writer is None:
+        writer = output.get_writer("csv")
+    summary = new_summary(task)
+    metrics = TaskMetrics(task)
+    tallies = []
+    for page, frame in enumerate(
+        task_frames(spec, task, metrics, host=host, cache=cache)
+    ):
+        path = part_path(parts_dir, task, page, writer)
+        with metrics.timing("write"):
+            add_part(summary, path, *write_frame(spec, frame, path, writer))
+        tallies.append(coverage.tally(spec, frame))
+    summary["coverage"] = coverage.combine(tallies)
+    summary["metrics"] = metrics.finish()
+    return summary
+
+
+def _map(function, tasks, workers, on_result=None, report=None, metrics=None):
+    workers = workers or max(multiprocessing.cpu_count() // 2, 1)
+    results = [None] * len(tasks)
+    # Forked workers inherit the governor, see `elastic_fetching.retry`
+    with retry.governed(retry.Governor(workers)), ProcessPoolExecutor(
+        min(workers, max(len(tasks), 1))
+    ) as pool_executor:
+        futures = {
+            pool_executor.submit(function, task): i for i, task in enumerate(tasks)
+        }
+        progress = tqdm.tqdm(as_completed(futures), total=len(tasks), file=sys.stdout)
+        for future in progress:
+            result = future.result()
+            results[futures[future]] = result
+            if report is not None:
+                report.add(metrics(result))
+                if report.live:
+                    progress.set_postfix_str(report.summary())
+            if on_result:
+                on_result(result)
+    return results
+
+
+def fetch(spec, tasks, workers=None, host=DEFAULT_HOST, cache=None, report=None):
+    """
+    Runs every task in parallel and stitches the results back together in memory. With pyarrow installed, workers
+    hand their documents back through `elastic_fetching.handoff` instead of pickling them
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        tasks (list): Tasks from `elastic_fetching.strategies`
+        workers (int) [optional]: The number of processes to use; defaults to half of the system's processors
+        host (dict) [optional]: The ElasticSearch host to connect to
+        cache (QueryCache) [optional]: A cache to serve tasks from, or to store them in once fetched
+        report (RunReport) [optional]: Where to add up each task's metrics
+    Returns:
+        frame (pandas.DataFrame): Every document of every task, in task order
+    """
+    if handoff.pa is None:
+        function = functools.partial(measured_fetch_task, spec, host=host, cache=cache)
+        results = _map(function, tasks, workers, report=report, metrics=itemgetter(1))
+        return spec.concat([frame for frame, _ in results])
+    directory = handoff.new_directory()
+    try:
+        function = functools.partial(
+            published_fetch_task, spec, directory=directory, host=host, cache=cache
+        )
+        results = _map(function, tasks, workers, report=report, metrics=itemgetter(1))
+        return handoff.collect(spec, [handle for handle, _ in results])
+    finally:
+        handoff.discard(directory)
+
+
+def stream(
+    spec,
+    tasks,
+    parts_dir,
+    writer=None,
+    workers=None,
+    host=DEFAULT_HOST,
+    on_result=None,
+    cache=None,
+    report=None,
+):
+    """
+    Runs every task in parallel, with each worker writing its pages to disk as it receives them.
+    Peak memory is bounded by the page size times the number of workers rather than by the size of the dataset.
+    Args:
+        spec (DatasetSpec): The dataset to fetch
+        tasks (list): Tasks from `elastic_fetching.strategies`
+        parts_dir (str): The directory to write part files to; merge them with `writer.finalize`
+        writer (object) [optional]: The writer from `elastic_fetching.output` to write parts with; defaults to CSV
+        workers (int) [optional]: The number of processes to use; defaults to half of the system's processors
+        host (dict) [optional]: The ElasticSearch host to connect to
+        on_result (callable) [optional]: Called with each summary as soon as its task completes
+        cache (QueryCache) [optional]: A cache to serve tasks from, or to store them in once fetched
+        report (RunReport) [optional]: Where to add up each task's metrics
+    Returns:
+        summaries (list): One summary (see `stream_task`) per task, in task order
+    """
+    if writer is None:
+        writer = output.get_writer("csv")
+    os.makedirs(parts_dir, exist_ok=True)
+    function = functools.partial(
+        stream_task, spec, parts_dir=parts_dir, writer=writer, host=host, cache=cache
+    )
+    return _map(
+        function,
+        tasks,
+        workers,
+        on_result,
+        report=report,
+        metrics=itemgetter("metrics"),
+    )
@@ -0,0 +1,326 @@
+"""
+Follows datasets as documents arrive, appending them to the output within a poll interval of being indexed.
+
+Every poll searches from a little before where the last one stopped up to now, paging through a fresh point-in-time
+with `search_after` on the timestamp (see `strategies.PitSearchAfter`). The overlap catches documents indexed late,
+and the unique keys of the documents it spans are remembered (`DatasetSpec.unique_key`), so those already written
+are dropped rather than written twice. New documents are appended to the output through the writer's `finalize`:
+CSV rows go on the end of `all.csv` and the day's partition files, and Parquet gets a new file in each partition
+touched. Nothing already written is rewritten, except that once the overlap no longer reaches back into a day, its
+Parquet files are compacted into one. Everything runs in one process, so CPU stays low and steady.
+
+Each dataset is written to `<out>/<dataset>`, which also holds `_follow.json`, where a restarted follow picks up from
+(a crash between appending and saving it can repeat the last poll's documents), and the coverage index (see
+`elastic_fetching.coverage`).
+
+Usage:
+    python -m elastic_fetching.follow <dataset> [<dataset> ...] [--out ./live] [--format csv|parquet] [--interval 30] [--overlap 120] [--start 2019-06-01T07:00] [--once]
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from elastic_fetching import engine, strategies
+from elastic_fetching.cli import parse_datetime, parse_host
+from elastic_fetching.coverage import Coverage, coverage_path, tally
+from elastic_fetching.datasets import SPECS, get_spec
+from elastic_fetching.manifest import DATETIME_FORMAT
+from elastic_fetching.metrics import TaskMetrics
+from elastic_fetching.output import WRITERS, _conform, _unified_schema, get_writer, pq
+from elastic_fetching.partition import DAY_FORMAT
+from elastic_fetching.windows import to_epoch_millis
+
+DEFAULT_INTERVAL = 30
+DEFAULT_OVERLAP = 120
+STATE_FILE = "_follow.json"
+
+
+def _keys(spec, frame):
+    # One string per document, from its unique key columns
+    columns = [frame[column].astype(str) for column in spec.unique_key]
+    keys = columns[0]
+    for column in columns[1:]:
+        keys = keys + "\x1f" + column
+    return keys.values
+
+
+def _utc_day(moment):
+    return pd.Timestamp(to_epoch_millis(moment), unit="ms").date()
+
+
+def _finish_compacting(directory):
+    # Carries out a compaction interrupted after its `.compacting.json` was written: the compacted file replaces
+    # the first part, if it hasn't already, and then the parts it holds besides that one are removed
+    journal = os.path.join(directory, ".compacting.json")
+    if not os.path.exists(journal):
+        return
+    with open(journal) as journal_file:
+        parts = json.load(journal_file)
+    temporary = os.path.join(directory, ".compacting.parquet")
+    if os.path.exists(temporary):
+        os.replace(temporary, os.path.join(directory, parts[0]))
+    for part in parts[1:]:
+        path = os.path.join(directory, part)
+        if os.path.exists(path):
+            os.remove(path)
+    os.remove(journal)
+
+
+def compact(directory):
+    """
+    Rewrites the Parquet files of one partition as a single file. The file is written under a temporary name and
+    replaces the first part before any other part is removed, so an interruption never loses documents; the next
+    `compact` of the partition finishes the job
+    Args:
+        directory (str): A `sensor=.../date=...` partition directory
+    Returns:
+        path (str): The compacted file, or None if the partition already was a single file
+    """
+    _finish_compacting(directory)
+    parts = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+    if len(parts) < 2:
+        return None
+    tables = [pq.read_table(part) for part in parts]
+    schema = _unified_schema(table.schema for table in tables)
+    temporary = os.path.join(directory, ".compacting.parquet")
+    with pq.ParquetWriter(temporary, schema) as writer:
+        for table in tables:
+            writer.write_table(_conform(table, schema))
+    journal = os.path.join(directory, ".compacting.json")
+    with open(journal + ".tmp", "w") as journal_file:
+        json.dump([os.path.basename(part) for part in parts], journal_file)
+    os.replace(journal + ".tmp", journal)
+    _finish_compacting(directory)
+    return parts[0]
+
+
+class Follower:
+    """
+    Args:
+        spec (DatasetSpec): The dataset to follow
+        out_dir (str): The directory to append its documents to
+        writer (object): The writer from `elastic_fetching.output` to append with
+        start (datetime.datetime): Where to start following from, unless `out_dir` holds an earlier follow's state
+        overlap (datetime.timedelta) [optional]: How far back each poll reaches before where the last one stopped
+        host (dict) [optional]: The ElasticSearch host to poll
+    Raises:
+        ValueError: If the dataset has no `unique_key` to tell refetched documents from new ones by
+    """
+
+    def __init__(
+        self,
+        spec,
+        out_dir,
+        writer,
+        start,
+        overlap=datetime.timedelta(seconds=DEFAULT_OVERLAP),
+        host=engine.DEFAULT_HOST,
+    ):
+        if not spec.unique_key:
+            raise ValueError("{} has no unique_key to deduplicate on".format(spec))
+        self.spec = spec
+        self.out_dir = out_dir
+        self.writer = writer
+        self.overlap = overlap
+        self.host = host
+        self.parts_dir = os.path.join(out_dir, "_parts")
+        self.state_path = os.path.join(out_dir, STATE_FILE)
+        self.coverage = Coverage(coverage_path(out_dir, spec))
+        self.watermark = start
+        # Unique key of every document written, to its timestamp, as far back as the overlap reaches
+        self.seen = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            self.watermark = datetime.datetime.strptime(
+                state["watermark"], DATETIME_FORMAT
+            )
+            self.seen = state["seen"]
+
+    def save(self):
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w") as state_file:
+            json.dump(
+                {
+                    "watermark": self.watermark.strftime(DATETIME_FORMAT),
+                    "seen": self.seen,
+                },
+                state_file,
+            )
+        os.replace(temporary, self.state_path)
+
+    def fetch(self, start, end):
+        """
+        Args:
+            start (datetime.datetime): The start of the range (inclusive)
+            end (datetime.datetime): The end of the range (exclusive)
+        Returns:
+            frame (pandas.DataFrame): Every document of the range, in timestamp order
+        """
+        with strategies.planned_tasks(
+            "search-after", self.spec, start, end, slices=1, host=self.host
+        ) as tasks:
+            frames = [
+                frame
+                for task in tasks
+                for frame in engine.task_frames(
+                    self.spec, task, TaskMetrics(task), host=self.host
+                )
+            ]
+        return engine.concat_pages(self.spec, frames)
+
+    def poll(self, now=None):
+        """
+        Fetches and appends every document indexed since the last poll
+        Args:
+            now (datetime.datetime) [optional]: Where this poll stops; defaults to the current time
+        Returns:
+            docs (int): How many new documents were appended
+        """
+        end = now or datetime.datetime.now()
+        start = self.watermark - self.overlap
+        frame = self.fetch(start, end)
+        keys = _keys(self.spec, frame)
+        keys = pd.Series(keys)
+        # Documents indexed twice within the poll are only written once, too
+        new = (~keys.isin(list(self.seen)) & ~keys.duplicated()).values
+        frame = frame[new]
+        if len(frame):
+            os.makedirs(self.parts_dir, exist_ok=True)
+            part = os.path.join(
+                self.parts_dir,
+                "follow-{}{}".format(
+                    end.strftime("%Y%m%dT%H%M%S"), self.writer.extension
+                ),
+            )
+            self.writer.write_part(frame, part, self.spec)
+            self.writer.finalize(self.spec, [part], self.out_dir, append=True)
+            os.rmdir(self.parts_dir)
+        self.coverage.add(tally(self.spec, frame))
+        self.coverage.mark(start, end)
+        self.coverage.save()
+
+        # Where the next poll starts; nothing before it is written to again
+        horizon = end - self.overlap
+        stamps = frame[self.spec.timestamp_field].values.tolist()
+        self.seen.update(zip(keys[new].tolist(), stamps))
+        cutoff = to_epoch_millis(horizon)
+        self.seen = {key: stamp for key, stamp in self.seen.items() if stamp >= cutoff}
+        # This poll started where the last one's horizon was, so every day is compacted exactly once. Partitions are
+        # UTC days, like `timestamp-iso`
+        day = _utc_day(start)
+        while day < _utc_day(horizon):
+            self.compact_day(day)
+            day += datetime.timedelta(days=1)
+        self.watermark = end
+        self.save()
+        return len(frame)
+
+    def compact_day(self, day):
+        """
+        Compacts the Parquet files each poll added to the partitions of a day no poll will reach back into again
+        Args:
+            day (datetime.date): The day
+        """
+        if self.writer.name != "parquet":
+            return
+        pattern = os.path.join(
+            self.out_dir, "sensor=*", "date={}".format(day.strftime(DAY_FORMAT))
+        )
+        for directory in glob.glob(pattern):
+            compact(directory)
+
+
+def follow(followers, interval=DEFAULT_INTERVAL, once=False):
+    """
+    Polls every follower every `interval` seconds until interrupted
+    Args:
+        followers (list): The `Follower` of every dataset to follow
+        interval (float) [optional]: Seconds from the start of one round of polls to the start of the next
+        once (bool) [optional]: Poll every follower once, then return
+    """
+    while True:
+        started = time.time()
+        for follower in followers:
+            docs = follower.poll()
+            print(
+                "{} {}: {} new documents".format(
+                    follower.watermark.strftime("%Y-%m-%d %H:%M:%S"),
+                    follower.spec.name,
+                    docs,
+                )
+            )
+        sys.stdout.flush()
+        if once:
+            return
+        time.sleep(max(interval - (time.time() - started), 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Follow CUIP datasets as documents arrive, appending them to the day's partition files"
+    )
+    parser.add_argument("datasets", nargs="+", choices=sorted(SPECS))
+    parser.add_argument(
+        "--out",
+        default="./live",
+        help="directory to write to, one subdirectory per dataset (default: ./live)",
+    )
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="seconds between polls (default: {})".format(DEFAULT_INTERVAL),
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=DEFAULT_OVERLAP,
+        help="seconds each poll reaches back before the last, to catch documents indexed "
+        "late (default: {})".format(DEFAULT_OVERLAP),
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_datetime,
+        help="where to start the first time (default: now); later runs carry on from "
+        "OUT/<dataset>/{}".format(STATE_FILE),
+    )
+    parser.add_argument(
+        "--host",
+        type=parse_host,
+        default=engine.DEFAULT_HOST,
+        help="ElasticSearch host as host[:port]",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="poll once and exit, e.g. from cron"
+    )
+    args = parser.parse_args(argv)
+
+    start = args.start or datetime.datetime.now()
+    followers = [
+        Follower(
+            get_spec(name),
+            os.path.join(args.out, name),
+            get_writer(args.format),
+            start,
+            overlap=datetime.timedelta(seconds=args.overlap),
+            host=args.host,
+        )
+        for name in args.datasets
+    ]
+    try:
+        follow(followers, interval=args.interval, once=args.once)
+    except KeyboardInterrupt:
+        print("Stopped following")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Reports on the coverage index a fetch keeps of its output (see `elastic_fetching.coverage`), without reading the output
+itself.
+
+Usage:
+    python -m elastic_fetching.gaps <dataset> summary|gaps|missing|build [--out ./csv] [--start 2019-06-01] [--end 2019-07-01] [--keys a,b] [--min-docs N]
+"""
+
+import argparse
+import datetime
+import os
+
+import pandas as pd
+
+from elastic_fetching.cli import parse_datetime
+from elastic_fetching.coverage import Coverage, build, coverage_path
+from elastic_fetching.datasets import SPECS, get_spec
+
+REPORTS = ("summary", "gaps", "missing", "build")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report on the coverage index a fetch keeps of its output, without reading the output itself"
+    )
+    parser.add_argument("dataset", choices=sorted(SPECS))
+    parser.add_argument(
+        "report",
+        choices=REPORTS,
+        help="summary: documents and complete hours per sensor; gaps: fetched hours "
+        "without documents; missing: stretches not fetched yet; build: index an "
+        "earlier fetch's all.csv or Parquet dataset",
+    )
+    parser.add_argument(
+        "--out", default="./csv", help="the directory the fetch wrote to"
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_datetime,
+        default=parse_datetime("2019-06-01"),
+        help="start of the range to report on (inclusive)",
+    )
+    parser.add_argument(
+        "--end",
+        type=parse_datetime,
+        default=parse_datetime("2019-07-01"),
+        help="end of the range to report on (exclusive)",
+    )
+    parser.add_argument(
+        "--keys",
+        type=lambda value: value.split(","),
+        help="comma-separated sensors or cameras to report on (default: all)",
+    )
+    parser.add_argument(
+        "--min-docs",
+        type=int,
+        default=1,
+        help="fewer documents than this make an hour a gap (default: 1)",
+    )
+    parser.add_argument(
+        "--source",
+        help="with build, the all.csv or Parquet dataset to index (default: OUT/all.csv, "
+        "or OUT itself if it has no all.csv)",
+    )
+    args = parser.parse_args(argv)
+    spec = get_spec(args.dataset)
+    path = coverage_path(args.out, spec)
+
+    if args.report == "build":
+        source = args.source or os.path.join(args.out, "all.csv")
+        if not args.source and not os.path.exists(source):
+            source = args.out
+        coverage = build(spec, source, args.start, args.end, path)
+        print(
+            "Indexed {} keys over {} hours into {}".format(
+                len(coverage.keys), len(coverage), path
+            )
+        )
+        return
+    if not os.path.exists(path):
+        parser.error(
+            "{} has no coverage index; fetch into it or run the build report".format(
+                args.out
+            )
+        )
+    coverage = Coverage(path)
+    with pd.option_context("display.max_rows", None, "display.width", 120):
+        if args.report == "summary":
+            print(coverage.summary(args.start, args.end, args.keys, args.min_docs))
+        elif args.report == "gaps":
+            gaps = coverage.gaps(args.start, args.end, args.keys, args.min_docs)
+            print("{} gaps".format(len(gaps)))
+            if len(gaps):
+                print(gaps.to_string(index=False))
+        else:
+            windows = coverage.missing(args.start, args.end)
+            print(
+                "{} still to fetch".format(
+                    sum((end - start for start, end in windows), datetime.timedelta())
+                )
+            )
+            for start, end in windows:
+                print("  {} to {}".format(start, end))
+
+
+if __name__ == "__main__":
+    main()
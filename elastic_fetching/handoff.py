@@ -0,0 +1,89 @@
+"""
+Hands a worker's documents to the parent as an Arrow IPC file rather than as a pickled DataFrame.
+
+Returning a DataFrame from a worker process pickles it, object columns and all, and the parent then unpickles it and
+copies it once more to concatenate it with every other task's. Instead each worker writes its task to an Arrow IPC file
+and returns only the file's path. The parent memory-maps every file, concatenates the tables without copying them and
+converts the result to pandas once.
+
+The files go to a fresh directory under the system's temporary directory, removed once the parent has read them; set
+`TMPDIR=/dev/shm` to keep them in memory altogether.
+"""
+
+import shutil
+import tempfile
+
+from elastic_fetching.output import _conform, _to_table, _unified_schema
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def new_directory():
+    """
+    Returns:
+        directory (str): A fresh directory for workers to `publish` to; remove it with `discard` once `collect`ed
+    """
+    return tempfile.mkdtemp(prefix="elastic_fetching-")
+
+
+def discard(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def publish(spec, frame, path):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the documents belong to
+        frame (pandas.DataFrame): A task's documents
+        path (str): Where to write them
+    Returns:
+        handle (object): `path` if the documents were written, or else `frame` itself, e.g. when a column mixes types
+            Arrow can't hold together; either way, pass it on to `collect`
+    """
+    try:
+        table = _to_table(frame, spec.nested)
+    except pa.ArrowException:
+        return frame
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def read(path):
+    """
+    Args:
+        path (str): A file written by `publish`
+    Returns:
+        table (pyarrow.Table): Its documents, backed by the memory-mapped file rather than copied into memory
+    """
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def collect(spec, handles):
+    """
+    Args:
+        spec (DatasetSpec): The dataset the documents belong to
+        handles (list): What `publish` returned for each task, in task order
+    Returns:
+        frame (pandas.DataFrame): Every task's documents, one after the other, cast like `DatasetSpec.concat`
+    """
+    if any(not isinstance(handle, str) for handle in handles):
+        return spec.concat(
+            [
+                handle if not isinstance(handle, str) else read(handle).to_pandas()
+                for handle in handles
+            ]
+        )
+    tables = [read(path) for path in handles]
+    if not tables:
+        return spec.empty_frame()
+    # The empty frame puts the schema's columns first, as `DatasetSpec.concat` does
+    empty = _to_table(spec.empty_frame(), spec.nested)
+    schema = _unified_schema([empty.schema] + [table.schema for table in tables])
+    table = pa.concat_tables([_conform(table, schema) for table in tables])
+    return spec.cast(table.to_pandas())
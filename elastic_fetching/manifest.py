@@ -0,0 +1,235 @@
+"""
+A checkpoint manifest for streamed fetches.
+
+Every task that finishes is recorded as one JSON line in `<out>/_manifest.jsonl`: the index, the task key and its time
+range, how many documents it held and the part files it wrote along with their SHA-256 checksums. Reruns only fetch
+the time the recorded tasks don't cover yet (as long as their parts are intact), whatever strategy recorded them, and
+once parts have been merged into the output CSVs a "merged" line is added so later runs append to those CSVs instead
+of overwriting them.
+"""
+
+import collections
+import datetime
+import hashlib
+import json
+import os
+import re
+
+from elastic_fetching.coverage import to_rows
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+# Sliced tasks' keys end in their slice, e.g. `...-slice002of008`
+SLICE_KEY = re.compile(r"-slice(\d+)of(\d+)$")
+
+
+def checksum(path):
+    """
+    Args:
+        path (str): The file to checksum
+    Returns:
+        digest (str): The hex SHA-256 digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as part:
+        for chunk in iter(lambda: part.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _intact(entry):
+    if entry.get("merged"):
+        return True
+    return all(
+        os.path.exists(part["path"]) and checksum(part["path"]) == part["sha256"]
+        for part in entry["parts"]
+    )
+
+
+def _slices(entry):
+    match = SLICE_KEY.search(entry["task"])
+    return int(match.group(2)) if match else 1
+
+
+class Manifest:
+    """
+    Args:
+        path (str): The JSON-lines file to read and record checkpoints in; created on the first checkpoint
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                for line in manifest_file:
+                    if line.strip():
+                        self._apply(json.loads(line))
+
+    def _apply(self, line):
+        key = (line["index"], line["task"])
+        if line.get("discarded"):
+            self.entries.pop(key, None)
+        elif line.get("merged"):
+            if key in self.entries:
+                self.entries[key]["merged"] = True
+        else:
+            line["start"] = datetime.datetime.strptime(line["start"], DATETIME_FORMAT)
+            line["end"] = datetime.datetime.strptime(line["end"], DATETIME_FORMAT)
+            self.entries[key] = line
+
+    def _write(self, line):
+        with open(self.path, "a") as manifest_file:
+            manifest_file.write(json.dumps(line) + "\n")
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+
+    def record(self, spec, summary):
+        """
+        Checkpoints a completed task
+        Args:
+            spec (DatasetSpec): The dataset the task fetched
+            summary (dict): The task's summary, as returned by `engine.stream_task`
+        """
+        line = {
+            "index": spec.index,
+            "task": summary["task"],
+            "start": summary["start"].strftime(DATETIME_FORMAT),
+            "end": summary["end"].strftime(DATETIME_FORMAT),
+            "docs": summary["docs"],
+            "parts": [
+                {"path": path, "sha256": digest}
+                for path, digest in zip(summary["parts"], summary["checksums"])
+            ],
+            # So the coverage index can be rebuilt for it when a rerun skips it
+            "coverage": to_rows(summary["coverage"]),
+        }
+        self._write(line)
+        self._apply(line)
+
+    def is_complete(self, spec, task):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            task (object): A task from `elastic_fetching.strategies`
+        Returns:
+            True if the task was recorded and is either merged or has every part intact; False otherwise
+        """
+        entry = self.entries.get((spec.index, task.key))
+        return entry is not None and _intact(entry)
+
+    def _entries(self, spec):
+        return sorted(
+            (
+                entry
+                for (index, _), entry in self.entries.items()
+                if index == spec.index
+            ),
+            key=lambda entry: (entry["start"], entry["task"]),
+        )
+
+    def unmerged(self, spec):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+        Returns:
+            entries (list): Every recorded task whose parts have not been merged yet, in time order
+        """
+        return [entry for entry in self._entries(spec) if not entry.get("merged")]
+
+    def has_merged(self, spec):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+        Returns:
+            True if parts of this dataset have already been merged into the output CSVs
+        """
+        return any(entry.get("merged") for entry in self._entries(spec))
+
+    def discard(self, spec, entries):
+        """
+        Forgets recorded tasks and removes their parts, e.g. because their range is being fetched again
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            entries (list): Entries (from `unmerged`) not to merge
+        """
+        for entry in entries:
+            for part in entry["parts"]:
+                if os.path.exists(part["path"]):
+                    os.remove(part["path"])
+            line = {"index": spec.index, "task": entry["task"], "discarded": True}
+            self._write(line)
+            self._apply(line)
+
+    def mark_merged(self, spec, entries):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            entries (list): Entries (from `unmerged`) whose parts have been merged into the output CSVs
+        """
+        for entry in entries:
+            line = {"index": spec.index, "task": entry["task"], "merged": True}
+            self._write(line)
+            self._apply(line)
+
+    def _complete_windows(self, spec):
+        # The windows every slice of which is recorded intact, or that were merged, which happens once they are
+        recorded = collections.defaultdict(int)
+        complete = set()
+        for entry in self._entries(spec):
+            window = (entry["start"], entry["end"])
+            if entry.get("merged"):
+                complete.add(window)
+            elif _intact(entry):
+                recorded[window + (_slices(entry),)] += 1
+        complete.update(
+            (start, end)
+            for (start, end, slices), count in recorded.items()
+            if count >= slices
+        )
+        return complete
+
+    def covered(self, spec):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+        Returns:
+            windows (list): `(start, end)` of every stretch of time the checkpoints cover, in order and joined where
+                they meet, whichever tasks recorded them. A window split into slices only counts once every slice is
+                recorded intact
+        """
+        windows = []
+        for start, end in sorted(self._complete_windows(spec)):
+            if windows and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+            else:
+                windows.append((start, end))
+        return windows
+
+    def unfinished(self, spec):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+        Returns:
+            entries (list): Every unmerged entry of a window that isn't covered (see `covered`), in time order
+        """
+        complete = self._complete_windows(spec)
+        return [
+            entry
+            for entry in self.unmerged(spec)
+            if (entry["start"], entry["end"]) not in complete
+        ]
+
+    def high_watermark(self, spec, start):
+        """
+        Args:
+            spec (DatasetSpec): The dataset being fetched
+            start (datetime.datetime): Where the recorded fetches started
+        Returns:
+            end (datetime.datetime): How far the recorded tasks cover the range from `start` without a gap, or
+                `start` itself if they don't cover it at all, so the tasks an interrupted run never finished are
+                fetched again
+        """
+        for window_start, window_end in self.covered(spec):
+            if window_start <= start <= window_end:
+                return window_end
+        return start
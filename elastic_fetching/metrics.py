@@ -0,0 +1,284 @@
+"""
+Per-task throughput and latency metrics, aggregated into a run report.
+
+Every task records how long each of its requests took (the first one separately, since opening a scroll or a slice is
+usually the slowest), how many characters of JSON came back, and how long was spent building DataFrames, writing part files
+and filling the query cache. Workers hand their `TaskMetrics` back with their results, and the parent adds them up in a
+`RunReport`, which can be written as JSON lines (one line per task, then one for the whole run) and shown live on the
+progress bar. Comparing time waiting on requests against build and write time tells whether the cluster and network,
+pandas or the disk is holding a run back.
+
+Requests are counted as the client sends them, through a `MeteredClient`, so retries, the last empty page of a scroll
+and clearing the scroll all count. The JSON is measured after the client has decompressed it: with gzip on (see
+`elastic_fetching.client`) far fewer bytes cross the network than characters are reported.
+"""
+
+import contextlib
+import inspect
+import json
+import time
+from collections import OrderedDict
+
+from elastic_fetching.serializer import FastJSONSerializer
+
+STAGES = ("request", "build", "write", "cache")
+
+
+class CountingSerializer(FastJSONSerializer):
+    """
+    A (fast, see `elastic_fetching.serializer`) JSON serializer that remembers how large the responses it decodes are.
+    `last` is the size of the most recent response, `received` the size of all of them, both in decoded characters
+    """
+
+    def __init__(self):
+        self.last = 0
+        self.received = 0
+
+    def loads(self, s):
+        self.last = len(s)
+        self.received += len(s)
+        return super().loads(s)
+
+
+class TaskMetrics:
+    """
+    Args:
+        task (object): The task from `elastic_fetching.strategies` being measured
+    """
+
+    def __init__(self, task):
+        self.started = time.time()
+        self.stats = OrderedDict(
+            [
+                ("task", task.key),
+                ("start", task.start.isoformat()),
+                ("end", task.end.isoformat()),
+                ("cached", False),
+                ("docs", 0),
+                ("pages", 0),
+                ("requests", 0),
+                ("chars", 0),
+                ("first_request_s", None),
+                ("max_request_s", 0.0),
+            ]
+        )
+        for stage in STAGES:
+            self.stats[stage + "_s"] = 0.0
+
+    def page(self, docs):
+        """
+        Args:
+            docs (int): How many documents the page held
+        """
+        self.stats["docs"] += docs
+        self.stats["pages"] += 1
+
+    def request(self, latency, received):
+        """
+        Args:
+            latency (float): How long the request took, in seconds
+            received (int): How large the decoded response was, in characters; 0 if it failed
+        """
+        self.stats["requests"] += 1
+        self.stats["chars"] += received
+        self.stats["request_s"] += latency
+        self.stats["max_request_s"] = max(self.stats["max_request_s"], latency)
+        if self.stats["first_request_s"] is None:
+            self.stats["first_request_s"] = latency
+
+    def cached(self, pages):
+        """
+        Args:
+            pages (list): The page DataFrames the task was served from the query cache
+        """
+        self.stats["cached"] = True
+        self.stats["pages"] = len(pages)
+        self.stats["docs"] = sum(len(page) for page in pages)
+
+    @contextlib.contextmanager
+    def timing(self, stage):
+        """
+        Adds the time spent inside the block to one of the `STAGES`
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.stats[stage + "_s"] += time.time() - started
+
+    def finish(self):
+        """
+        Returns:
+            stats (dict): Everything recorded for the task, plus its `wall_s`
+        """
+        self.stats["wall_s"] = time.time() - self.started
+        return dict(self.stats)
+
+
+class MeteredClient:
+    """
+    Stands in for a task's ElasticSearch client, recording every request sent through it, failed or not
+    Args:
+        es (object): An `Elasticsearch` or `AsyncElasticsearch` client with a `CountingSerializer`
+        metrics (TaskMetrics): Where to record each request
+    """
+
+    def __init__(self, es, metrics):
+        self.es = es
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        method = getattr(self.es, name)
+        if not callable(method):
+            return method
+
+        def metered(*args, **kwargs):
+            serializer = self.es.transport.serializer
+            serializer.last = 0
+            started = time.time()
+            try:
+                response = method(*args, **kwargs)
+            except Exception:
+                self.metrics.request(time.time() - started, 0)
+                raise
+            if inspect.isawaitable(response):
+                return self._awaited(response, serializer, started)
+            self.metrics.request(time.time() - started, serializer.last)
+            return response
+
+        return metered
+
+    async def _awaited(self, response, serializer, started):
+        # `serializer.last` is read as soon as the response arrives, before any other task on the loop can get a
+        # turn, so a client shared between tasks still attributes each response to the right one
+        try:
+            response = await response
+        except Exception:
+            self.metrics.request(time.time() - started, 0)
+            raise
+        self.metrics.request(time.time() - started, serializer.last)
+        return response
+
+
+def counted_pages(pages, metrics):
+    """
+    Args:
+        pages (generator): A task's `pages(es, spec)`, with `es` a `MeteredClient`
+        metrics (TaskMetrics): Where to record each page
+    Yields:
+        hits (list): The pages of `pages`, unchanged
+    """
+    try:
+        for docs in pages:
+            metrics.page(len(docs))
+            yield docs
+    finally:
+        pages.close()
+
+
+async def acounted_pages(pages, metrics):
+    """
+    The async version of `counted_pages`, for a task's `apages(es, spec)`
+    """
+    try:
+        async for docs in pages:
+            metrics.page(len(docs))
+            yield docs
+    finally:
+        await pages.aclose()
+
+
+class RunReport:
+    """
+    Args:
+        path (str) [optional]: A JSON-lines file to append every task's metrics and the run's totals to
+        live (bool) [optional]: Whether to show a running summary on the progress bar
+    """
+
+    def __init__(self, path=None, live=False):
+        self.path = path
+        self.live = live
+        self.started = time.time()
+        self.totals = OrderedDict(
+            [
+                ("tasks", 0),
+                ("cached", 0),
+                ("docs", 0),
+                ("pages", 0),
+                ("requests", 0),
+                ("chars", 0),
+                ("max_request_s", 0.0),
+            ]
+        )
+        for stage in STAGES:
+            self.totals[stage + "_s"] = 0.0
+
+    def _write(self, line):
+        if self.path:
+            with open(self.path, "a") as report_file:
+                report_file.write(json.dumps(line) + "\n")
+
+    def add(self, stats):
+        """
+        Args:
+            stats (dict): A finished task's metrics, from `TaskMetrics.finish`
+        """
+        self.totals["tasks"] += 1
+        self.totals["cached"] += int(stats["cached"])
+        for field in ("docs", "pages", "requests", "chars"):
+            self.totals[field] += stats[field]
+        for stage in STAGES:
+            self.totals[stage + "_s"] += stats[stage + "_s"]
+        self.totals["max_request_s"] = max(
+            self.totals["max_request_s"], stats["max_request_s"]
+        )
+        self._write(dict(stats, type="task"))
+
+    def rates(self):
+        """
+        Returns:
+            rates (dict): The run's wall time, docs/s, JSON chars/s, mean request latency and the share of task time
+                spent in each stage
+        """
+        wall = max(time.time() - self.started, 1e-9)
+        busy = sum(self.totals[stage + "_s"] for stage in STAGES) or 1e-9
+        rates = OrderedDict(
+            [
+                ("wall_s", wall),
+                ("docs_per_s", self.totals["docs"] / wall),
+                ("chars_per_s", self.totals["chars"] / wall),
+                (
+                    "mean_request_s",
+                    self.totals["request_s"] / max(self.totals["requests"], 1),
+                ),
+            ]
+        )
+        for stage in STAGES:
+            rates[stage + "_share"] = self.totals[stage + "_s"] / busy
+        return rates
+
+    def summary(self):
+        """
+        Returns:
+            summary (str): A one-line summary of the run so far
+        """
+        rates = self.rates()
+        return "{:,.0f} docs/s | {:.1f}M chars/s | request {:.0%} build {:.0%} write {:.0%} | {:.3f}s/request".format(
+            rates["docs_per_s"],
+            rates["chars_per_s"] / 1e6,
+            rates["request_share"],
+            rates["build_share"],
+            rates["write_share"] + rates["cache_share"],
+            rates["mean_request_s"],
+        )
+
+    def close(self):
+        """
+        Writes the run's totals to the report
+        Returns:
+            totals (dict): The run's totals and rates
+        """
+        totals = OrderedDict(self.totals)
+        totals.update(self.rates())
+        self._write(dict(totals, type="run"))
+        return totals
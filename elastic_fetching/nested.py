@@ -0,0 +1,142 @@
+"""
+List-valued fields, such as the bounding boxes of a vision event, kept as numbers rather than as a string per row.
+
+In memory such a column holds one list per document, as ElasticSearch sent it. Parquet output stores it as a
+list-of-struct column, so readers can filter on the coordinates straight away. CSV can't nest, so CSV output leaves the
+column out and writes its items to a child table instead, one row per item keyed by the document's id.
+"""
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class NestedColumn:
+    """
+    Args:
+        child (str): Name of the child table the items are written to, e.g. "detections"
+        fields (list): Names of the numbers making up each item, in the order ElasticSearch lists them
+        key (str) [optional]: The document field the child table is keyed by
+        dtype (str) [optional]: The dtype of every field
+    """
+
+    def __init__(self, child, fields, key="id", dtype="float32"):
+        self.child = child
+        self.fields = list(fields)
+        self.key = key
+        self.dtype = dtype
+
+    def __repr__(self):
+        return "NestedColumn({!r}, {!r})".format(self.child, self.fields)
+
+    def _items(self, value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return []
+        if isinstance(value, str):
+            # CSVs written before this column was nested hold the list's repr, which for numbers is valid JSON
+            value = json.loads(value)
+        # Parquet hands lists of structs back as arrays of dicts
+        return [
+            [item[field] for field in self.fields] if isinstance(item, dict) else item
+            for item in value
+        ]
+
+    def lengths(self, values):
+        """
+        Args:
+            values (pandas.Series): The column, one list per document
+        Returns:
+            lengths (numpy.ndarray): How many items each document has
+        """
+        if pd.api.types.is_numeric_dtype(values):
+            # Nothing but missing values
+            return np.zeros(len(values), dtype=np.int64)
+        lengths = values.str.len().fillna(0).values.astype(np.int64)
+        # Only the lists' reprs (see `_items`) have to be parsed to be counted
+        text = values.map(type).values == str
+        if text.any():
+            lengths[text] = [len(self._items(value)) for value in values.values[text]]
+        return lengths
+
+    def flatten(self, values):
+        """
+        Args:
+            values (pandas.Series): The column, one list per document
+        Returns:
+            lengths (numpy.ndarray): How many items each document has
+            items (numpy.ndarray): Every item of every document, one row per item and one column per field
+        Raises:
+            ValueError: If an item doesn't have exactly one number per field
+        """
+        documents = [self._items(value) for value in values]
+        lengths = np.fromiter(
+            (len(items) for items in documents), np.int64, len(documents)
+        )
+        rows = [item for items in documents for item in items]
+        if not rows:
+            return lengths, np.empty((0, len(self.fields)), dtype=self.dtype)
+        matrix = np.array(rows, dtype=self.dtype)
+        if matrix.ndim != 2 or matrix.shape[1] != len(self.fields):
+            raise ValueError(
+                "Expected every item to have {} numbers ({})".format(
+                    len(self.fields), ", ".join(self.fields)
+                )
+            )
+        return lengths, matrix
+
+    def explode(self, frame, column, carry=()):
+        """
+        Args:
+            frame (pandas.DataFrame): Documents holding the column
+            column (str): The nested column
+            carry (list) [optional]: Further document columns to repeat on every item, e.g. to partition on
+        Returns:
+            child (pandas.DataFrame): One row per item, with the document's key and carried columns, the item's
+                position within the document and one column per field
+        """
+        lengths, matrix = self.flatten(frame[column])
+        starts = np.cumsum(lengths) - lengths
+        columns = OrderedDict(
+            (name, frame[name].repeat(lengths).values)
+            for name in [self.key] + list(carry)
+            if name in frame
+        )
+        columns["position"] = np.arange(len(matrix)) - np.repeat(starts, lengths)
+        for i, field in enumerate(self.fields):
+            columns[field] = matrix[:, i]
+        return pd.DataFrame(columns)
+
+    def to_arrow(self, values):
+        """
+        Args:
+            values (pandas.Series): The column, one list per document
+        Returns:
+            array (pyarrow.ListArray): The column as a list of structs per document; missing lists become empty
+        """
+        lengths, matrix = self.flatten(values)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+        structs = pa.StructArray.from_arrays(
+            [pa.array(matrix[:, i]) for i in range(len(self.fields))], self.fields
+        )
+        return pa.ListArray.from_arrays(pa.array(offsets), structs)
+
+    def to_json(self, values):
+        """
+        Args:
+            values (pandas.Series): The column, one list per document
+        Returns:
+            values (pandas.Series): Each document's items as a JSON list of lists, for CSV part files
+        """
+        return values.map(
+            lambda value: json.dumps(
+                [[float(number) for number in item] for item in self._items(value)],
+                separators=(",", ":"),
+            )
+        )
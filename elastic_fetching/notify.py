@@ -0,0 +1,33 @@
+"""
+Email notifications for long-running fetches.
+"""
+
+import smtplib
+import sys
+
+
+def notify(auth, receiver, task_name=""):
+    """
+    Sends an email to `receiver` letting them know their task is complete
+    Args:
+        auth (dict): A dict containing keys "email" and "password" for authentication for sending the email
+        receiver (str): The email address receiving this notification
+        task_name (str) [optional]: The name of the task that has been completed
+    Returns:
+        True if email could be sent; False otherwise
+    """
+    try:
+        subject = "Your task {}has completed".format(
+            (task_name + " ") if task_name else ""
+        )
+        body = "Your task {}in file {} has completed".format(
+            (task_name + " ") if task_name else "", sys.argv[0]
+        )
+        message = "Subject: {}\n\n{}".format(subject, body)
+        server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+        server.ehlo()
+        server.login(auth["email"], auth["password"])
+        server.sendmail(auth["email"], receiver, message)
+        return True
+    except:
+        return False
@@ -0,0 +1,389 @@
+"""
+Writing fetched frames to disk.
+
+Every writer has the same interface, so the engines never need to know which one they were handed:
+    extension: The file extension of the writer's part files
+    write_part(frame, path, spec): Writes a single page of documents as a part file
+    finalize(spec, parts, out_dir, keep_parts, append): Merges streamed part files into the final output
+    write(frame, spec, out_dir, start, end, include_all): Writes an in-memory frame as the final output
+
+`CsvWriter` produces `all.csv` plus one CSV per `spec.partition_key` value per day; the items of nested columns (see
+`elastic_fetching.nested`) go to the same files under a directory named after the child table. `ParquetWriter` produces
+a Parquet dataset partitioned on disk as `sensor=<key>/date=<YYYY-MM-DD>/part-*.parquet`, keeping the frame's dtypes
+and storing nested columns as lists of structs.
+"""
+
+import glob
+import json
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from elastic_fetching.partition import (
+    DEFAULT_WORKERS,
+    in_range,
+    partition_indices,
+    write_partitions,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def _part_columns(parts):
+    columns = []
+    for part in parts:
+        for column in pd.read_csv(part, nrows=0).columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def _csv_tables(frame, spec, out_dir):
+    """
+    Returns `(frame, directory)` pairs to write: the frame without its nested columns to `out_dir`, and the child
+    table of each nested column to `out_dir/<child>`
+    """
+    columns = [column for column in spec.nested if column in frame]
+    tables = [(frame.drop(columns=columns), out_dir)]
+    for column in columns:
+        nested = spec.nested[column]
+        if nested.key in frame:
+            child = nested.explode(
+                frame, column, carry=[spec.partition_key, "timestamp-iso"]
+            )
+            tables.append((child, os.path.join(out_dir, nested.child)))
+    return tables
+
+
+class CsvWriter:
+    """
+    Args:
+        workers (int) [optional]: The most partition files to write at once
+    """
+
+    name = "csv"
+    extension = ".csv"
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+
+    def write_part(self, frame, path, spec):
+        """
+        Args:
+            frame (pandas.DataFrame): A single page of fetched documents
+            path (str): Where to write it
+            spec (DatasetSpec): The dataset the documents belong to
+        """
+        nested = {
+            column: spec.nested[column].to_json(frame[column])
+            for column in spec.nested
+            if column in frame
+        }
+        frame.assign(**nested).to_csv(path, index=False)
+
+    def finalize(self, spec, parts, out_dir, keep_parts=False, append=False):
+        """
+        Merges streamed part files into `all.csv` plus one CSV per `spec.partition_key` value per day.
+        Parts are read one at a time, so memory stays bounded by the size of a single part.
+        Args:
+            spec (DatasetSpec): The dataset the parts belong to
+            parts (list): Paths of the part files, in the order their rows should appear
+            out_dir (str): The directory to write the CSVs to
+            keep_parts (bool) [optional]: Whether to leave the part files on disk once they have been merged
+            append (bool) [optional]: Whether to add to CSVs left by an earlier run (keeping their header) rather
+                than overwriting them
+        Returns:
+            paths (list): Every CSV that was written
+        """
+        # Parts only carry the fields their documents had; line every file up on the same header
+        columns = _part_columns(parts) or list(spec.empty_frame().columns)
+        written = set()
+        headers = {}
+
+        def append_to(frame, path):
+            if path not in written:
+                written.add(path)
+                if append and os.path.exists(path):
+                    headers[path] = list(pd.read_csv(path, nrows=0).columns)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    frame.to_csv(path, index=False)
+                    return
+            if path in headers:
+                frame = frame.reindex(columns=headers[path])
+            frame.to_csv(path, mode="a", header=False, index=False)
+
+        empty = spec.empty_frame().reindex(columns=columns)
+        for table, directory in _csv_tables(empty, spec, out_dir):
+            append_to(table, os.path.join(directory, "all.csv"))
+        # Nested columns were written to the parts as JSON
+        converters = {column: json.loads for column in spec.nested if column in columns}
+        for part in parts:
+            frame = pd.read_csv(
+                part, parse_dates=["timestamp-iso"], converters=converters
+            ).reindex(columns=columns)
+            for table, directory in _csv_tables(frame, spec, out_dir):
+                append_to(table, os.path.join(directory, "all.csv"))
+                for key, day, indices in partition_indices(
+                    table[spec.partition_key], table["timestamp-iso"]
+                ):
+                    path = os.path.join(
+                        directory, spec.partition_filename.format(key=key, day=day)
+                    )
+                    append_to(table.iloc[indices], path)
+            if not keep_parts:
+                os.remove(part)
+        return sorted(written)
+
+    def write(self, frame, spec, out_dir, start=None, end=None, include_all=True):
+        """
+        Writes one CSV per `spec.partition_key` value per day, plus `all.csv`
+        Args:
+            frame (pandas.DataFrame): The fetched documents
+            spec (DatasetSpec): The dataset the documents belong to
+            out_dir (str): The directory to write the CSVs to
+            start (datetime.datetime) [optional]: Leave out rows before this (inclusive)
+            end (datetime.datetime) [optional]: Leave out rows from this on (exclusive)
+            include_all (bool) [optional]: Whether to write `all.csv` as well
+        Returns:
+            paths (list): Every CSV that was written
+        """
+        paths = []
+        for table, directory in _csv_tables(
+            in_range(frame, spec, start, end), spec, out_dir
+        ):
+            paths.extend(self._write_table(table, spec, directory, include_all))
+        return paths
+
+    def _write_table(self, frame, spec, directory, include_all):
+        os.makedirs(directory, exist_ok=True)
+
+        def write_group(key, day, indices):
+            path = os.path.join(
+                directory, spec.partition_filename.format(key=key, day=day)
+            )
+            frame.iloc[indices].to_csv(path, index=False)
+            return path
+
+        paths = write_partitions(
+            partition_indices(frame[spec.partition_key], frame["timestamp-iso"]),
+            write_group,
+            self.workers,
+        )
+        if include_all:
+            paths.append(os.path.join(directory, "all.csv"))
+            frame.to_csv(paths[-1], index=False)
+        return paths
+
+
+def _to_table(frame, nested=None):
+    nested = {column: nested[column] for column in nested or {} if column in frame}
+    table = pa.Table.from_pandas(frame.drop(columns=list(nested)), preserve_index=False)
+    for column, values in nested.items():
+        table = table.add_column(
+            list(frame.columns).index(column),
+            column,
+            values.to_arrow(frame[column]),
+        )
+    # Categoricals pick the smallest index type that fits, which differs from page to page
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(
+                i,
+                field.name,
+                table.column(i).cast(pa.dictionary(pa.int32(), field.type.value_type)),
+            )
+    return table
+
+
+def _unified_schema(schemas):
+    fields = OrderedDict()
+    for schema in schemas:
+        for field in schema:
+            known = fields.get(field.name)
+            if known is None or pa.types.is_null(known):
+                fields[field.name] = field.type
+            elif not pa.types.is_null(field.type) and field.type != known:
+                fields[field.name] = _promote(known, field.type)
+    return pa.schema(list(fields.items()))
+
+
+def _promote(left, right):
+    numbers = (pa.types.is_integer, pa.types.is_floating)
+    if any(kind(left) for kind in numbers) and any(kind(right) for kind in numbers):
+        # Integer columns with gaps come out as floats, and downcast columns may be narrower on some pages
+        if pa.types.is_integer(left) and pa.types.is_integer(right):
+            return pa.int64()
+        return pa.float64()
+    # A field that is sometimes a number and sometimes a string is kept as a string
+    return pa.string()
+
+
+def _cast(column, to):
+    # Casting a column to the type it already has still copies it
+    return column if column.type == to else column.cast(to)
+
+
+def _conform(table, schema):
+    return pa.Table.from_arrays(
+        [
+            (
+                _cast(table.column(field.name), field.type)
+                if field.name in table.column_names
+                else pa.nulls(len(table), field.type)
+            )
+            for field in schema
+        ],
+        schema=schema,
+    )
+
+
+class _PartitionSink:
+    """
+    Keeps a bounded number of `pyarrow.parquet.ParquetWriter`s open, one per partition directory
+    """
+
+    def __init__(self, schema, max_open, fresh):
+        self.schema = schema
+        self.max_open = max_open
+        self.fresh = fresh
+        self.writers = OrderedDict()
+        self.touched = set()
+        self.paths = []
+
+    def write(self, directory, table):
+        writer = self.writers.pop(directory, None)
+        if writer is None:
+            if len(self.writers) >= self.max_open:
+                _, oldest = self.writers.popitem(last=False)
+                oldest.close()
+            os.makedirs(directory, exist_ok=True)
+            existing = glob.glob(os.path.join(directory, "part-*.parquet"))
+            if self.fresh and directory not in self.touched:
+                # Files left by an earlier run would duplicate the rows being written now
+                for path in existing:
+                    os.remove(path)
+                existing = []
+            self.touched.add(directory)
+            path = os.path.join(directory, "part-{:05d}.parquet".format(len(existing)))
+            writer = pq.ParquetWriter(path, self.schema)
+            self.paths.append(path)
+        writer.write_table(_conform(table, self.schema))
+        self.writers[directory] = writer
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+class ParquetWriter:
+    """
+    Args:
+        max_open (int) [optional]: The most partition files to keep open at once while merging
+        workers (int) [optional]: The most partition files to write at once when writing an in-memory frame
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+
+    name = "parquet"
+    extension = ".parquet"
+
+    def __init__(self, max_open=64, workers=DEFAULT_WORKERS):
+        if pa is None:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow")
+        self.max_open = max_open
+        self.workers = workers
+
+    def write_part(self, frame, path, spec):
+        """
+        Args:
+            frame (pandas.DataFrame): A single page of fetched documents
+            path (str): Where to write it
+            spec (DatasetSpec): The dataset the documents belong to
+        """
+        pq.write_table(_to_table(frame, spec.nested), path)
+
+    def _partitions(self, table, spec, out_dir):
+        for key, day, indices in partition_indices(
+            table.column(spec.partition_key).to_pandas(),
+            table.column("timestamp-iso").to_pandas(),
+        ):
+            directory = os.path.join(
+                out_dir, "sensor={}".format(key), "date={}".format(day)
+            )
+            yield directory, table.take(pa.array(indices))
+
+    def finalize(self, spec, parts, out_dir, keep_parts=False, append=False):
+        """
+        Merges streamed part files into a Parquet dataset partitioned by `spec.partition_key` and day.
+        Parts are read one at a time, so memory stays bounded by the size of a single part.
+        Args:
+            spec (DatasetSpec): The dataset the parts belong to
+            parts (list): Paths of the part files, in the order their rows should appear
+            out_dir (str): The directory to write the dataset to
+            keep_parts (bool) [optional]: Whether to leave the part files on disk once they have been merged
+            append (bool) [optional]: Whether to add files next to those left by an earlier run rather than
+                replacing them
+        Returns:
+            paths (list): Every Parquet file that was written
+        """
+        schema = _unified_schema(pq.read_schema(part) for part in parts)
+        sink = _PartitionSink(schema, self.max_open, fresh=not append)
+        try:
+            for part in parts:
+                for directory, group in self._partitions(
+                    pq.read_table(part), spec, out_dir
+                ):
+                    sink.write(directory, group)
+                if not keep_parts:
+                    os.remove(part)
+        finally:
+            sink.close()
+        return sink.paths
+
+    def write(self, frame, spec, out_dir, start=None, end=None, include_all=True):
+        """
+        Writes a Parquet dataset partitioned by `spec.partition_key` and day, one file per partition
+        Args:
+            frame (pandas.DataFrame): The fetched documents
+            spec (DatasetSpec): The dataset the documents belong to
+            out_dir (str): The directory to write the dataset to
+            start (datetime.datetime) [optional]: Leave out rows before this (inclusive)
+            end (datetime.datetime) [optional]: Leave out rows from this on (exclusive)
+            include_all (bool) [optional]: Unused; the dataset as a whole already is the combined output
+        Returns:
+            paths (list): Every Parquet file that was written
+        """
+        # Converting once gives every partition file the same schema
+        table = _to_table(in_range(frame, spec, start, end), spec.nested)
+
+        def write_group(directory, group):
+            os.makedirs(directory, exist_ok=True)
+            for stale in glob.glob(os.path.join(directory, "part-*.parquet")):
+                os.remove(stale)
+            path = os.path.join(directory, "part-00000.parquet")
+            pq.write_table(group, path)
+            return path
+
+        return write_partitions(
+            self._partitions(table, spec, out_dir), write_group, self.workers
+        )
+
+
+WRITERS = {writer.name: writer for writer in (CsvWriter, ParquetWriter)}
+
+
+def get_writer(name):
+    """
+    Args:
+        name (str): The name of an output backend, e.g. "csv" or "parquet"
+    Returns:
+        writer (object): A new writer for that backend
+    """
+    return WRITERS[name]()
@@ -0,0 +1,67 @@
+"""
+Splitting fetched documents into one partition per sensor (or camera) per day.
+
+Every row gets its day key computed once and the frame is grouped on `(key, day)` in a single pass, rather than
+scanning the whole frame once per sensor and again once per day. Groups are then written by a bounded pool of threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from elastic_fetching.windows import to_epoch_millis
+
+DAY_FORMAT = "%Y-%m-%d"
+DEFAULT_WORKERS = 4
+
+
+def partition_indices(keys, timestamps):
+    """
+    Args:
+        keys (pandas.Series): The partition key of every row, e.g. the `nicename` column
+        timestamps (pandas.Series): The datetime of every row, e.g. the `timestamp-iso` column
+    Returns:
+        partitions (list): `(key, day, indices)` tuples, with `day` formatted as YYYY-MM-DD and `indices` the
+            positions of that partition's rows, sorted by key and day
+    """
+    groups = pd.DataFrame(
+        {"key": keys.values, "day": timestamps.dt.normalize().values}
+    ).groupby(["key", "day"], observed=True)
+    return [
+        (key, day.strftime(DAY_FORMAT), indices)
+        for (key, day), indices in groups.indices.items()
+    ]
+
+
+def write_partitions(partitions, write_group, workers=DEFAULT_WORKERS):
+    """
+    Args:
+        partitions (list): `(key, day, indices)` tuples, as returned by `partition_indices`
+        write_group (callable): Called with each `(key, day, indices)`; returns the path it wrote
+        workers (int) [optional]: The most partitions to write at once
+    Returns:
+        paths (list): Whatever `write_group` returned for each partition, in order
+    """
+    with ThreadPoolExecutor(workers) as pool_executor:
+        return list(pool_executor.map(lambda group: write_group(*group), partitions))
+
+
+def in_range(frame, spec, start=None, end=None):
+    """
+    Args:
+        frame (pandas.DataFrame): Fetched documents
+        spec (DatasetSpec): The dataset they belong to
+        start (datetime.datetime) [optional]: Drop rows before this (inclusive)
+        end (datetime.datetime) [optional]: Drop rows from this on (exclusive)
+    Returns:
+        frame (pandas.DataFrame): The rows the range query for `start` and `end` matches
+    """
+    # Compared in epoch milliseconds, like `engine.range_query`: `start` and `end` are local time, while
+    # `timestamp-iso` is UTC
+    stamps = frame[spec.timestamp_field]
+    if start is not None:
+        frame = frame[stamps >= to_epoch_millis(start)]
+        stamps = frame[spec.timestamp_field]
+    if end is not None:
+        frame = frame[stamps < to_epoch_millis(end)]
+    return frame
@@ -0,0 +1,146 @@
+"""
+Plans time windows holding roughly the same number of documents each.
+
+Fixed hourly windows are badly unbalanced: some hours of `cuip_vision_events` hold 100x the documents of others, so
+a few workers are left straggling at the end of a run while quiet hours each cost a full round trip. Instead, a
+single `date_histogram` request counts the documents of the whole range at a fine resolution; neighbouring buckets
+are packed together until a window holds about `target` documents, and buckets too busy to fit in one window are
+bisected with `_count` requests.
+"""
+
+import datetime
+
+from elastic_fetching import retry
+from elastic_fetching.engine import range_query
+from elastic_fetching.windows import from_epoch_millis
+
+DEFAULT_TARGET_DOCS = 50000
+DEFAULT_RESOLUTION = datetime.timedelta(minutes=5)
+# Stay well below ElasticSearch's `search.max_buckets`
+MAX_BUCKETS = 5000
+MIN_WIDTH = datetime.timedelta(seconds=1)
+
+
+def count(es, spec, start, end):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to count with
+        spec (DatasetSpec): The dataset being fetched
+        start (datetime.datetime): The start of the window (inclusive)
+        end (datetime.datetime): The end of the window (exclusive)
+    Returns:
+        docs (int): How many documents the window holds
+    """
+    return retry.call(
+        es.count, index=spec.index, body={"query": range_query(spec, start, end)}
+    )["count"]
+
+
+def histogram(es, spec, start, end, resolution=DEFAULT_RESOLUTION):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The dataset being fetched
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        resolution (datetime.timedelta) [optional]: The bucket width; widened if the range would need too many buckets
+    Returns:
+        buckets (list): `(start, end, docs)` tuples for every non-empty bucket, clamped to the range, in order
+    """
+    resolution = max(resolution, (end - start) / MAX_BUCKETS)
+    seconds = max(int(resolution.total_seconds()), 1)
+    results = retry.call(
+        es.search,
+        index=spec.index,
+        body={
+            "size": 0,
+            "query": range_query(spec, start, end),
+            "aggs": {
+                "docs": {
+                    "date_histogram": {
+                        "field": spec.timestamp_field,
+                        "fixed_interval": "{}s".format(seconds),
+                        "min_doc_count": 1,
+                    }
+                }
+            },
+        },
+        filter_path=[
+            "aggregations.docs.buckets.key",
+            "aggregations.docs.buckets.doc_count",
+        ],
+    )
+    buckets = []
+    width = datetime.timedelta(seconds=seconds)
+    for bucket in results.get("aggregations", {}).get("docs", {}).get("buckets", []):
+        bucket_start = from_epoch_millis(bucket["key"])
+        buckets.append(
+            (
+                max(bucket_start, start),
+                min(bucket_start + width, end),
+                bucket["doc_count"],
+            )
+        )
+    return buckets
+
+
+def split(es, spec, start, end, docs, target, min_width=MIN_WIDTH):
+    """
+    Recursively bisects a window until every piece holds at most `target` documents
+    Args:
+        es (elasticsearch.Elasticsearch): The client to count with
+        spec (DatasetSpec): The dataset being fetched
+        start (datetime.datetime): The start of the window (inclusive)
+        end (datetime.datetime): The end of the window (exclusive)
+        docs (int): How many documents the window holds
+        target (int): The most documents a window should hold
+        min_width (datetime.timedelta) [optional]: Windows this narrow are never split, however busy they are
+    Returns:
+        windows (list): `(start, end, docs)` tuples, in order
+    """
+    if docs <= target or end - start <= min_width:
+        return [(start, end, docs)]
+    middle = start + (end - start) / 2
+    left = count(es, spec, start, middle)
+    return split(es, spec, start, middle, left, target, min_width) + split(
+        es, spec, middle, end, docs - left, target, min_width
+    )
+
+
+def balanced_windows(
+    es, spec, start, end, target=DEFAULT_TARGET_DOCS, resolution=DEFAULT_RESOLUTION
+):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to query with
+        spec (DatasetSpec): The dataset being fetched
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        target (int) [optional]: About how many documents each window should hold
+        resolution (datetime.timedelta) [optional]: The finest width windows are packed from before bisecting
+    Returns:
+        windows (list): Contiguous `(start, end, docs)` tuples covering the whole range, in order; quiet stretches
+            are folded into their neighbours. Empty if the range holds no documents at all.
+    """
+    pieces = []
+    for bucket_start, bucket_end, docs in histogram(es, spec, start, end, resolution):
+        if docs > target:
+            pieces.extend(split(es, spec, bucket_start, bucket_end, docs, target))
+        else:
+            pieces.append((bucket_start, bucket_end, docs))
+
+    windows = []
+    for piece_start, piece_end, docs in pieces:
+        if not docs:
+            continue
+        if windows and windows[-1][2] + docs <= target:
+            # Empty buckets are never returned, so this also swallows any quiet gap in between
+            windows[-1] = (windows[-1][0], piece_end, windows[-1][2] + docs)
+        else:
+            if windows:
+                windows[-1] = (windows[-1][0], piece_start, windows[-1][2])
+            windows.append((piece_start, piece_end, docs))
+    if windows:
+        windows[0] = (start,) + windows[0][1:]
+        windows[-1] = windows[-1][:1] + (end, windows[-1][2])
+    return windows
@@ -0,0 +1,79 @@
+"""
+Splits an existing fetch (an `all.csv` or a Parquet dataset) into per-sensor, per-day partitions.
+
+Usage:
+    python -m elastic_fetching.repartition <all.csv or parquet dir> <dataset> [--out DIR] [--format csv|parquet]
+"""
+
+import argparse
+import os
+
+import pandas as pd
+
+from elastic_fetching.datasets import SPECS, get_spec
+from elastic_fetching.output import WRITERS, get_writer, pq
+from elastic_fetching.partition import DEFAULT_WORKERS
+
+# Columns a hive-partitioned dataset adds from its directory names
+PARTITION_COLUMNS = ["sensor", "date"]
+
+
+def read_source(path, spec):
+    """
+    Args:
+        path (str): An `all.csv` file or the root directory of a Parquet dataset
+        spec (DatasetSpec): The dataset the documents belong to
+    Returns:
+        frame (pandas.DataFrame): Every document, cast to the dataset's schema
+    """
+    if os.path.isdir(path):
+        if pq is None:
+            raise RuntimeError("Reading Parquet needs pyarrow: pip install pyarrow")
+        frame = pq.read_table(path).to_pandas()
+        frame = frame.drop(
+            columns=[column for column in PARTITION_COLUMNS if column in frame]
+        )
+    else:
+        frame = pd.read_csv(path, parse_dates=["timestamp-iso"])
+        # all.csv files written before the index was dropped carry it as an unnamed column
+        frame = frame.drop(
+            columns=[column for column in frame if column.startswith("Unnamed: ")]
+        )
+    return spec.cast(frame)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split an existing all.csv or Parquet dataset into one partition per sensor per day"
+    )
+    parser.add_argument("source", help="an all.csv file or a Parquet dataset directory")
+    parser.add_argument("dataset", choices=sorted(SPECS))
+    parser.add_argument(
+        "--out",
+        help="directory to write partitions to (default: next to the source)",
+    )
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="partitions to write at once (default: {})".format(DEFAULT_WORKERS),
+    )
+    args = parser.parse_args(argv)
+
+    spec = get_spec(args.dataset)
+    out_dir = args.out or (
+        args.source if os.path.isdir(args.source) else os.path.dirname(args.source)
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    writer = get_writer(args.format)
+    writer.workers = args.workers
+
+    paths = writer.write(
+        read_source(args.source, spec), spec, out_dir, include_all=False
+    )
+    print("Wrote {} partitions to {}".format(len(paths), out_dir))
+
+
+if __name__ == "__main__":
+    main()
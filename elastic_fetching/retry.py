@@ -0,0 +1,304 @@
+"""
+Riding out a busy or flaky cluster.
+
+Timeouts, dropped connections, rejections (429) and gateway errors (502-504) are retried with jittered exponential
+backoff rather than failing the whole run. Scrolls that fail part way through (including ones whose context expired)
+restart from the last timestamp they saw instead of from the start of their window; see `Resume`.
+
+A `Governor` caps how many requests a run has in flight, across every worker. Each rejection halves the cap and
+every streak of successes as long as the cap raises it by one again, so a run backs off when the cluster pushes back
+and recovers once it stops. The process engine hands it to its workers by forking (ProcessPoolExecutor only takes an
+initializer from Python 3.7 on), so on platforms that spawn workers instead, requests are simply not governed.
+"""
+
+import asyncio
+import contextlib
+import copy
+import multiprocessing
+import random
+import time
+
+from elasticsearch.exceptions import ConnectionError, NotFoundError, TransportError
+
+TRANSIENT_STATUSES = (429, 502, 503, 504)
+DEFAULT_ATTEMPTS = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+POLL_INTERVAL = 0.01
+
+# The run's governor, if any; see `governed`
+GOVERNOR = None
+
+
+def is_transient(error):
+    """
+    Args:
+        error (Exception): An error raised by the ElasticSearch client
+    Returns:
+        transient (bool): Whether repeating the request later may well succeed
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error, TransportError) and error.status_code in TRANSIENT_STATUSES
+
+
+def is_rejection(error):
+    return isinstance(error, TransportError) and error.status_code == 429
+
+
+def is_expired(error):
+    """
+    Args:
+        error (Exception): An error raised by the ElasticSearch client
+    Returns:
+        expired (bool): Whether the error says a scroll context no longer exists
+    """
+    # The exception type is buried in the response body, under the error or its root causes
+    return isinstance(error, NotFoundError) and "search_context_missing" in str(
+        error.info
+    )
+
+
+def is_resumable(error):
+    return is_transient(error) or is_expired(error)
+
+
+def backoff(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    """
+    Args:
+        attempt (int): How many times in a row the request has failed before, starting at 0
+        base (float) [optional]: The largest delay after the first failure, in seconds
+        cap (float) [optional]: The largest delay ever, in seconds
+    Returns:
+        delay (float): How long to wait before trying again; uniformly random below the exponential bound, so
+            workers that failed together don't all retry together
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class Retry:
+    """
+    Counts a request's consecutive failures
+    Args:
+        retryable (callable) [optional]: Decides whether an error is worth retrying
+        attempts (int) [optional]: How many consecutive failures to put up with
+    """
+
+    def __init__(self, retryable=is_transient, attempts=DEFAULT_ATTEMPTS):
+        self.retryable = retryable
+        self.attempts = attempts
+        self.failures = 0
+
+    def failed(self, error):
+        """
+        Args:
+            error (Exception): The error the request failed with
+        Returns:
+            delay (float): How long to wait before trying again
+        Raises:
+            error: If it isn't retryable, or the request has failed too many times in a row
+        """
+        if not self.retryable(error) or self.failures >= self.attempts:
+            raise error
+        self.failures += 1
+        return backoff(self.failures - 1)
+
+    def succeeded(self):
+        self.failures = 0
+
+
+class Governor:
+    """
+    An additive-increase, multiplicative-decrease cap on the requests in flight, shared between processes
+    Args:
+        limit (int): The most requests in flight at once, and where the cap starts
+    """
+
+    def __init__(self, limit):
+        self.max_limit = max(limit, 1)
+        self._lock = multiprocessing.Lock()
+        self._limit = multiprocessing.Value("i", self.max_limit, lock=False)
+        self._in_flight = multiprocessing.Value("i", 0, lock=False)
+        self._successes = multiprocessing.Value("i", 0, lock=False)
+
+    @property
+    def limit(self):
+        return self._limit.value
+
+    def try_acquire(self):
+        with self._lock:
+            if self._in_flight.value < self._limit.value:
+                self._in_flight.value += 1
+                return True
+            return False
+
+    def acquire(self):
+        while not self.try_acquire():
+            time.sleep(POLL_INTERVAL)
+
+    async def aacquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self, rejected=False):
+        """
+        Args:
+            rejected (bool) [optional]: Whether the cluster rejected the request
+        """
+        with self._lock:
+            self._in_flight.value -= 1
+            if rejected:
+                self._limit.value = max(self._limit.value // 2, 1)
+                self._successes.value = 0
+            else:
+                self._successes.value += 1
+                if self._successes.value >= self._limit.value:
+                    self._limit.value = min(self._limit.value + 1, self.max_limit)
+                    self._successes.value = 0
+
+
+@contextlib.contextmanager
+def governed(governor):
+    """
+    Installs `governor` as the run's governor for the duration of a `with` block
+    """
+    global GOVERNOR
+    previous, GOVERNOR = GOVERNOR, governor
+    try:
+        yield governor
+    finally:
+        GOVERNOR = previous
+
+
+def request(function, **kwargs):
+    """
+    Makes a single request through the run's governor, if any
+    Args:
+        function (callable): A method of an `Elasticsearch` client
+        kwargs: Its arguments
+    Returns:
+        response (dict): The response
+    """
+    governor = GOVERNOR
+    if governor is None:
+        return function(**kwargs)
+    governor.acquire()
+    rejected = False
+    try:
+        return function(**kwargs)
+    except TransportError as error:
+        rejected = is_rejection(error)
+        raise
+    finally:
+        governor.release(rejected)
+
+
+async def arequest(function, **kwargs):
+    """
+    The async version of `request`, for a method of an `AsyncElasticsearch` client
+    """
+    governor = GOVERNOR
+    if governor is None:
+        return await function(**kwargs)
+    await governor.aacquire()
+    rejected = False
+    try:
+        return await function(**kwargs)
+    except TransportError as error:
+        rejected = is_rejection(error)
+        raise
+    finally:
+        governor.release(rejected)
+
+
+def call(function, **kwargs):
+    """
+    Makes a single request through the run's governor, retrying transient failures
+    Args:
+        function (callable): A method of an `Elasticsearch` client
+        kwargs: Its arguments
+    Returns:
+        response (dict): The response
+    """
+    retry = Retry()
+    while True:
+        try:
+            return request(function, **kwargs)
+        except TransportError as error:
+            time.sleep(retry.failed(error))
+
+
+async def acall(function, **kwargs):
+    """
+    The async version of `call`, for a method of an `AsyncElasticsearch` client
+    """
+    retry = Retry()
+    while True:
+        try:
+            return await arequest(function, **kwargs)
+        except TransportError as error:
+            await asyncio.sleep(retry.failed(error))
+
+
+class Resume:
+    """
+    Lets a scroll that failed part way through start again where it left off.
+    Scrolls are sorted on the timestamp, so a restart only needs documents at or after the last timestamp seen;
+    documents at exactly that timestamp that were already returned are recognised by their `_id` and dropped
+    Args:
+        spec (DatasetSpec): The dataset being fetched
+        body (dict): The search body of the whole scroll
+    """
+
+    def __init__(self, spec, body):
+        self.field = spec.timestamp_field
+        self.base = body
+        self.last = None
+        self.seen = set()
+
+    def body(self):
+        """
+        Returns:
+            body (dict): The search body for the rest of the scroll
+        """
+        body = copy.deepcopy(self.base)
+        body["sort"] = [{self.field: "asc"}]
+        if self.last is not None:
+            body["query"] = {
+                "bool": {
+                    "filter": [
+                        body["query"],
+                        {
+                            "range": {
+                                self.field: {
+                                    "gte": self.last,
+                                    "format": "epoch_millis",
+                                }
+                            }
+                        },
+                    ]
+                }
+            }
+        return body
+
+    def advance(self, docs):
+        """
+        Args:
+            docs (list): The `hits.hits` of the next page
+        Returns:
+            docs (list): The ones that weren't already returned before a restart
+        """
+        if self.seen:
+            docs = [
+                doc
+                for doc in docs
+                if doc["_source"][self.field] != self.last
+                or doc["_id"] not in self.seen
+            ]
+        for doc in docs:
+            timestamp = doc["_source"][self.field]
+            if timestamp != self.last:
+                self.last = timestamp
+                self.seen = set()
+            self.seen.add(doc["_id"])
+        return docs
@@ -0,0 +1,150 @@
+"""
+The column dtypes of every index we fetch, and the helpers that keep frames compact.
+
+Readings are stored as float32, which holds every value the sensors report, and identifiers that repeat on every row
+(sensor, camera, intersection, label) as categoricals, so a month of documents takes a fraction of the memory plain
+float64 and Python string columns would, and grouping on those identifiers works on integer codes. Columns that are
+not in a schema but turn out to be numeric are downcast as far as they go without losing anything.
+
+Timestamps stay as epoch milliseconds (int64) next to the `timestamp-iso` datetime column, which is datetime64[ns]:
+the pandas we pin can't hold other resolutions.
+"""
+
+import numpy as np
+import pandas as pd
+
+from elastic_fetching.columnar import coerce
+
+AIR_QUALITY_SCHEMA = [
+    ("current_dewpoint_f", "float32"),
+    ("current_humidity", "float32"),
+    ("current_temp_f", "float32"),
+    # Sensor positions need more digits than float32 has
+    ("lat", "float64"),
+    ("lon", "float64"),
+    ("p_0_3_um", "float32"),
+    ("p_0_3_um_b", "float32"),
+    ("p_0_5_um", "float32"),
+    ("p_0_5_um_b", "float32"),
+    ("p_10_0_um", "float32"),
+    ("p_10_0_um_b", "float32"),
+    ("p_1_0_um", "float32"),
+    ("p_1_0_um_b", "float32"),
+    ("p_2_5_um", "float32"),
+    ("p_2_5_um_b", "float32"),
+    ("p_5_0_um", "float32"),
+    ("p_5_0_um_b", "float32"),
+    ("pm10_0_atm", "float32"),
+    ("pm10_0_atm_b", "float32"),
+    ("pm10_0_cf_1", "float32"),
+    ("pm10_0_cf_1_b", "float32"),
+    ("pm1_0_atm", "float32"),
+    ("pm1_0_atm_b", "float32"),
+    ("pm1_0_cf_1", "float32"),
+    ("pm1_0_cf_1_b", "float32"),
+    ("pm2_5_atm", "float32"),
+    ("pm2_5_atm_b", "float32"),
+    ("pm2_5_cf_1", "float32"),
+    ("pm2_5_cf_1_b", "float32"),
+    ("timestamp", "int64"),
+    ("nicename", "category"),
+]
+
+VISION_EVENTS_SCHEMA = [
+    ("camera_id", "category"),
+    ("hit_counts", "int32"),
+    ("id", "object"),
+    ("intersection", "category"),
+    ("label", "category"),
+    ("locations", "object"),
+    ("pole_id", "category"),
+    ("timestamp", "int64"),
+]
+
+SCHEMAS = {
+    "mlk_*_air_quality-*": AIR_QUALITY_SCHEMA,
+    "cuip_vision_events": VISION_EVENTS_SCHEMA,
+}
+
+
+def get_schema(index):
+    """
+    Args:
+        index (str): An index pattern, e.g. "cuip_vision_events"
+    Returns:
+        schema (list): The index's `(column, dtype)` pairs
+    Raises:
+        KeyError: If no schema is registered for the index
+    """
+    try:
+        return SCHEMAS[index]
+    except KeyError:
+        raise KeyError(
+            "No schema registered for index {!r}; known indices are {}".format(
+                index, ", ".join(sorted(SCHEMAS))
+            )
+        )
+
+
+def downcast(series):
+    """
+    Args:
+        series (pandas.Series): A column no schema mentions
+    Returns:
+        series (pandas.Series): Integers in the smallest integer dtype that holds them, and floats as float32 if that
+            keeps every value exactly; anything else as it was
+    """
+    if series.dtype.kind in "iu":
+        return pd.to_numeric(series, downcast="integer")
+    if series.dtype == np.float64:
+        narrow = series.astype(np.float32)
+        if ((narrow.astype(np.float64) == series) | series.isnull()).all():
+            return narrow
+    return series
+
+
+def cast_frame(frame, schema, exclude=()):
+    """
+    Args:
+        frame (pandas.DataFrame): Fetched documents
+        schema (dict): Column name to dtype
+        exclude (tuple) [optional]: Columns to leave alone even if they aren't in the schema
+    Returns:
+        frame (pandas.DataFrame): The frame with schema columns cast to their dtype and other numeric columns
+            downcast
+    """
+    for column in frame.columns:
+        if column in schema:
+            frame[column] = coerce(frame[column], schema[column])
+        elif column not in exclude:
+            frame[column] = downcast(frame[column])
+    return frame
+
+
+def concat_frames(frames, schema):
+    """
+    Args:
+        frames (list): DataFrames of the same dataset, e.g. one per task
+        schema (dict): Column name to dtype
+    Returns:
+        frame (pandas.DataFrame): Every frame, one after the other. Categorical columns are given the same categories
+            first, so they stay categorical rather than falling back to Python strings along the way
+    """
+    frames = list(frames)
+    for column, dtype in schema.items():
+        if dtype != "category":
+            continue
+        columns = [
+            frame[column].astype("category") for frame in frames if column in frame
+        ]
+        if not columns:
+            continue
+        categories = pd.Index(
+            np.concatenate([values.cat.categories.values for values in columns])
+        ).unique()
+        for frame in frames:
+            if column in frame:
+                frame[column] = (
+                    frame[column].astype("category").cat.set_categories(categories)
+                )
+    return pd.concat(frames, ignore_index=True, sort=False)
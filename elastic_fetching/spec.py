@@ -0,0 +1,173 @@
+"""
+Declarative descriptions of the indices we pull from ElasticSearch.
+
+A `DatasetSpec` says *what* to fetch (index pattern, columns and their dtypes, per-document fixups and how to split
+the output); `elastic_fetching.engine` knows *how* to fetch any of them.
+"""
+
+import copy
+from collections import OrderedDict
+
+from elastic_fetching.columnar import ColumnarBatch
+from elastic_fetching.schema import cast_frame, concat_frames, get_schema
+
+
+class DatasetSpec:
+    """
+    Args:
+        name (str): Short name used on the command line, e.g. "air_quality"
+        index (str): The ElasticSearch index (or index pattern) to query
+        partition_key (str): The column the per-day CSVs are split on (a sensor or camera id)
+        partition_filename (str): Format string for the per-day CSVs, filled with `key` and `day` (YYYY-MM-DD)
+        schema (list) [optional]: `(column, dtype)` pairs; columns always come first in the output and are cast to
+            their dtype. Defaults to the schema registered for `index` (see `elastic_fetching.schema.get_schema`)
+        transforms (list) [optional]: Callables taking and returning a document's `_source`, applied in order
+        frame_transforms (list) [optional]: Callables fixing up a page's DataFrame in place, applied in order; prefer
+            these to `transforms`, which run once per document
+        nested (dict) [optional]: List-valued column to the `elastic_fetching.nested.NestedColumn` describing its items
+        unique_key (list) [optional]: Columns that together identify a document, to tell a refetched document from a
+            new one
+        timestamp_field (str) [optional]: The epoch-millis field every query ranges over
+        includes (list) [optional]: The only `_source` fields ElasticSearch should send back
+        excludes (list) [optional]: `_source` fields ElasticSearch should leave out; both accept wildcards
+    """
+
+    def __init__(
+        self,
+        name,
+        index,
+        partition_key,
+        partition_filename,
+        schema=None,
+        transforms=(),
+        frame_transforms=(),
+        nested=None,
+        unique_key=None,
+        timestamp_field="timestamp",
+        includes=None,
+        excludes=None,
+    ):
+        self.name = name
+        self.index = index
+        self.schema = OrderedDict(get_schema(index) if schema is None else schema)
+        self.partition_key = partition_key
+        self.partition_filename = partition_filename
+        self.transforms = list(transforms)
+        self.frame_transforms = list(frame_transforms)
+        self.nested = dict(nested or {})
+        self.unique_key = list(unique_key) if unique_key else None
+        self.timestamp_field = timestamp_field
+        self.includes = list(includes) if includes else None
+        self.excludes = list(excludes) if excludes else None
+
+    def __repr__(self):
+        return "DatasetSpec({!r}, index={!r})".format(self.name, self.index)
+
+    @property
+    def columns(self):
+        return list(self.schema)
+
+    def project(self, includes=None, excludes=None):
+        """
+        Args:
+            includes (list) [optional]: The only `_source` fields to fetch; the timestamp and partition key always are
+            excludes (list) [optional]: Further `_source` fields to leave out
+        Returns:
+            spec (DatasetSpec): A copy of this spec fetching (and laying out columns for) only the projected fields
+        """
+        spec = copy.copy(self)
+        schema = OrderedDict(self.schema)
+        if includes:
+            includes = list(includes)
+            for required in (self.partition_key, self.timestamp_field):
+                if required not in includes:
+                    includes.append(required)
+            spec.includes = includes
+            schema = OrderedDict(
+                (column, dtype)
+                for column, dtype in schema.items()
+                if column in includes
+            )
+        if excludes:
+            spec.excludes = (self.excludes or []) + list(excludes)
+            schema = OrderedDict(
+                (column, dtype)
+                for column, dtype in schema.items()
+                if column not in excludes
+            )
+        spec.schema = schema
+        return spec
+
+    def search_body(self, query):
+        """
+        Args:
+            query (dict): The query to run
+        Returns:
+            body (dict): A search body for the query, asking ElasticSearch to only send back the projected fields
+        """
+        body = {"query": query}
+        source = {}
+        if self.includes:
+            source["includes"] = self.includes
+        if self.excludes:
+            source["excludes"] = self.excludes
+        if source:
+            body["_source"] = source
+        return body
+
+    def new_batch(self):
+        """
+        Returns:
+            batch (ColumnarBatch): An empty batch laid out for this dataset
+        """
+        return ColumnarBatch(
+            columns=self.columns,
+            dtypes=self.schema,
+            timestamp_field=self.timestamp_field,
+            frame_transforms=self.frame_transforms,
+        )
+
+    def add_hits(self, batch, hits):
+        """
+        Runs every hit through this dataset's transforms and adds it to `batch`
+        Args:
+            batch (ColumnarBatch): The batch to add to
+            hits (list): The `hits.hits` list of a search or scroll response
+        """
+        if not self.transforms:
+            batch.extend(hits)
+            return
+        for hit in hits:
+            source = hit["_source"]
+            for transform in self.transforms:
+                source = transform(source)
+            batch.append(source)
+
+    def cast(self, frame):
+        """
+        Args:
+            frame (pandas.DataFrame): Documents of this dataset, e.g. several pages concatenated together
+        Returns:
+            frame (pandas.DataFrame): The same frame with every schema column cast to its dtype, and other numeric
+                columns downcast (see `elastic_fetching.schema`)
+        """
+        return cast_frame(frame, self.schema, exclude=("timestamp-iso",))
+
+    def concat(self, frames):
+        """
+        Args:
+            frames (list): DataFrames of this dataset, e.g. one per task
+        Returns:
+            frame (pandas.DataFrame): Every frame, one after the other, cast (see `cast`) and with categorical columns
+                kept categorical
+        """
+        return self.cast(
+            concat_frames([self.empty_frame()] + list(frames), self.schema)
+        )
+
+    def empty_frame(self):
+        """
+        Returns:
+            frame (pandas.DataFrame): A frame with this dataset's columns and no rows
+        """
+        return self.new_batch().to_frame()
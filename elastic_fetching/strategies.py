@@ -0,0 +1,458 @@
+"""
+Ways of dividing a fetch into independent tasks.
+
+Every task has a filesystem-safe `key`, a `start` and `end`, and a `pages(es, spec)` generator yielding the
+`hits.hits` of each page it fetches (`apages(es, spec)` does the same with an `AsyncElasticsearch` client). Tasks clean up their own scroll context; point-in-time (PIT) contexts are
+shared between tasks, so `planned_tasks` opens and closes them.
+
+Strategies:
+    hourly: One range query per hour, each scrolled through as its own task; with `batch_windows` set, that many
+        consecutive hours are sent as a single `_msearch` instead and only hours holding more than a page of documents
+        are scrolled through, which suits sparse indices
+    adaptive: One range query per window, with windows sized by `elastic_fetching.planner` to hold about
+        `target_docs` documents each; runs of windows that fit in a page are batched like hourly ones
+    sliced-scroll: One range query over the whole range, split into `slices` parallel scroll slices
+    search-after: One point-in-time over the whole range, split into `slices` parallel slices paged with
+        `search_after` on the timestamp
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import time
+
+from elasticsearch.exceptions import TransportError
+
+from elastic_fetching import client, planner, retry
+from elastic_fetching.engine import DEFAULT_HOST, PAGE_SIZE, SCROLL, range_query
+from elastic_fetching.windows import hourly_windows
+
+STRATEGIES = ("hourly", "adaptive", "sliced-scroll", "search-after")
+PIT_KEEP_ALIVE = "10m"
+# Only ask for what is actually read, so hit metadata (_index, _score, ...) never leaves the cluster; scrolls need
+# `_id` to resume after a failure (see `retry.Resume`)
+SCROLL_FILTER_PATH = ["hits.hits._id", "hits.hits._source", "_scroll_id"]
+SEARCH_AFTER_FILTER_PATH = ["hits.hits._source", "hits.hits.sort", "pit_id"]
+MSEARCH_FILTER_PATH = [
+    "responses.hits.hits._id",
+    "responses.hits.hits._source",
+    "responses.hits.total",
+    "responses.error",
+]
+# Adaptive windows only; an hour's documents aren't known up front, so hourly windows are batched only when asked to
+DEFAULT_BATCH_WINDOWS = 24
+
+
+def _hits(results):
+    return results.get("hits", {}).get("hits", [])
+
+
+def _complete(response):
+    """
+    Whether the first page of an `_msearch` response already holds every document of its search
+    """
+    if "error" in response:
+        return False
+    total = response.get("hits", {}).get("total")
+    if isinstance(total, dict):
+        # ElasticSearch 7 stops counting exactly once a search matches more than 10000 documents
+        total = total["value"] if total.get("relation") == "eq" else None
+    return total is not None and total <= len(_hits(response))
+
+
+def _clear_scroll(es, scroll_id):
+    try:
+        es.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+    except TransportError:
+        # The context times out on its own anyway
+        pass
+
+
+def scroll_pages(es, spec, body, resume=None):
+    """
+    Args:
+        es (elasticsearch.Elasticsearch): The client to scroll with
+        spec (DatasetSpec): The dataset being fetched
+        body (dict): The search body
+        resume (retry.Resume) [optional]: Where an earlier search of the same body got to, to carry on from there
+    Yields:
+        hits (list): The `hits.hits` of each non-empty page; the scroll context is cleared once done. Transient
+            failures and expired contexts restart the scroll from the last timestamp seen (see `retry.Resume`)
+    """
+    resume = resume or retry.Resume(spec, body)
+    attempts = retry.Retry(retryable=retry.is_resumable)
+    while True:
+        scroll_id = None
+        try:
+            results = retry.request(
+                es.search,
+                index=spec.index,
+                body=resume.body(),
+                filter_path=SCROLL_FILTER_PATH,
+                scroll=SCROLL,
+                size=PAGE_SIZE,
+            )
+            scroll_id = results.get("_scroll_id")
+            docs = _hits(results)
+            while docs:
+                attempts.succeeded()
+                docs = resume.advance(docs)
+                if docs:
+                    yield docs
+                results = retry.request(es.scroll, scroll_id=scroll_id, scroll=SCROLL)
+                scroll_id = results.get("_scroll_id", scroll_id)
+                docs = _hits(results)
+            return
+        except TransportError as error:
+            delay = attempts.failed(error)
+        finally:
+            if scroll_id:
+                _clear_scroll(es, scroll_id)
+        time.sleep(delay)
+
+
+def _close_point_in_time(es, pit_id):
+    try:
+        es.close_point_in_time(body={"id": pit_id}, ignore=(404,))
+    except TransportError:
+        # Like a scroll, the point-in-time expires on its own after `PIT_KEEP_ALIVE`
+        pass
+
+
+async def _aclear_scroll(es, scroll_id):
+    try:
+        await es.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+    except TransportError:
+        pass
+
+
+async def ascroll_pages(es, spec, body, resume=None):
+    """
+    The `AsyncElasticsearch` version of `scroll_pages`
+    """
+    resume = resume or retry.Resume(spec, body)
+    attempts = retry.Retry(retryable=retry.is_resumable)
+    while True:
+        scroll_id = None
+        try:
+            results = await retry.arequest(
+                es.search,
+                index=spec.index,
+                body=resume.body(),
+                filter_path=SCROLL_FILTER_PATH,
+                scroll=SCROLL,
+                size=PAGE_SIZE,
+            )
+            scroll_id = results.get("_scroll_id")
+            docs = _hits(results)
+            while docs:
+                attempts.succeeded()
+                docs = resume.advance(docs)
+                if docs:
+                    yield docs
+                results = await retry.arequest(
+                    es.scroll, scroll_id=scroll_id, scroll=SCROLL
+                )
+                scroll_id = results.get("_scroll_id", scroll_id)
+                docs = _hits(results)
+            return
+        except TransportError as error:
+            delay = attempts.failed(error)
+        finally:
+            if scroll_id:
+                await _aclear_scroll(es, scroll_id)
+        await asyncio.sleep(delay)
+
+
+def _stamp(moment):
+    # Adaptive windows can be split below a second
+    return moment.strftime(
+        "%Y%m%dT%H%M%S.%f" if moment.microsecond else "%Y%m%dT%H%M%S"
+    )
+
+
+def _slice(slice_id, slices):
+    # ElasticSearch rejects a slice max of 1
+    return {"id": slice_id, "max": slices} if slices > 1 else None
+
+
+class WindowScroll:
+    """
+    Args:
+        start (datetime.datetime): The start of the window (inclusive)
+        end (datetime.datetime): The end of the window (exclusive)
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "WindowScroll({!r}, {!r})".format(self.start, self.end)
+
+    @property
+    def key(self):
+        return "{}-{}".format(_stamp(self.start), _stamp(self.end))
+
+    def body(self, spec):
+        return spec.search_body(range_query(spec, self.start, self.end))
+
+    def pages(self, es, spec):
+        return scroll_pages(es, spec, self.body(spec))
+
+    def apages(self, es, spec):
+        return ascroll_pages(es, spec, self.body(spec))
+
+
+class WindowBatch:
+    """
+    Consecutive windows sent as a single `_msearch`, so windows that fit in a page cost a share of one request and
+    no scroll context at all. Windows holding more than a page are scrolled through afterwards, carrying on from the
+    page the `_msearch` already returned.
+    Args:
+        windows (list): `(start, end)` tuples, each starting where the one before it ends
+    """
+
+    def __init__(self, windows):
+        self.windows = list(windows)
+        self.start = self.windows[0][0]
+        self.end = self.windows[-1][1]
+
+    def __repr__(self):
+        return "WindowBatch({!r}, {!r}, windows={})".format(
+            self.start, self.end, len(self.windows)
+        )
+
+    @property
+    def key(self):
+        return "{}-{}".format(_stamp(self.start), _stamp(self.end))
+
+    def body(self, spec):
+        return spec.search_body(range_query(spec, self.start, self.end))
+
+    def _searches(self, spec):
+        resumes = [
+            retry.Resume(spec, spec.search_body(range_query(spec, start, end)))
+            for start, end in self.windows
+        ]
+        searches = []
+        for resume in resumes:
+            # Sorted the way a scroll is, so an overflowing window can be resumed after its first page
+            body = resume.body()
+            body["size"] = PAGE_SIZE
+            searches.extend([{"index": spec.index}, body])
+        return resumes, searches
+
+    def pages(self, es, spec):
+        resumes, searches = self._searches(spec)
+        results = retry.call(es.msearch, body=searches, filter_path=MSEARCH_FILTER_PATH)
+        for resume, response in zip(resumes, results["responses"]):
+            docs = resume.advance(_hits(response))
+            if docs:
+                yield docs
+            if not _complete(response):
+                # Failed searches have nothing to carry on from and are scrolled through from the start
+                yield from scroll_pages(es, spec, resume.base, resume=resume)
+
+    async def apages(self, es, spec):
+        resumes, searches = self._searches(spec)
+        results = await retry.acall(
+            es.msearch, body=searches, filter_path=MSEARCH_FILTER_PATH
+        )
+        for resume, response in zip(resumes, results["responses"]):
+            docs = resume.advance(_hits(response))
+            if docs:
+                yield docs
+            if not _complete(response):
+                async for docs in ascroll_pages(es, spec, resume.base, resume=resume):
+                    yield docs
+
+
+def batched_tasks(windows, batch_windows=DEFAULT_BATCH_WINDOWS):
+    """
+    Args:
+        windows (list): `(start, end, docs)` tuples in order, with `docs` None when not known
+        batch_windows (int) [optional]: The most windows to send in one `_msearch`; 1 scrolls every window
+    Returns:
+        tasks (list): A `WindowBatch` for every run of up to `batch_windows` adjacent windows that may fit in a page,
+            and a `WindowScroll` for every other window
+    """
+    tasks = []
+    run = []
+
+    def flush():
+        if len(run) > 1:
+            tasks.append(WindowBatch(run))
+        elif run:
+            tasks.append(WindowScroll(*run[0]))
+        del run[:]
+
+    for start, end, docs in windows:
+        if batch_windows <= 1 or (docs is not None and docs > PAGE_SIZE):
+            flush()
+            tasks.append(WindowScroll(start, end))
+            continue
+        if len(run) == batch_windows or (run and run[-1][1] != start):
+            flush()
+        run.append((start, end))
+    flush()
+    return tasks
+
+
+class SlicedScroll(WindowScroll):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        slice_id (int): Which slice of the scroll this task fetches
+        slices (int): How many slices the scroll is split into
+    """
+
+    def __init__(self, start, end, slice_id, slices):
+        super().__init__(start, end)
+        self.slice_id = slice_id
+        self.slices = slices
+
+    def __repr__(self):
+        return "SlicedScroll({!r}, {!r}, {}, {})".format(
+            self.start, self.end, self.slice_id, self.slices
+        )
+
+    @property
+    def key(self):
+        return "{}-slice{:03d}of{:03d}".format(super().key, self.slice_id, self.slices)
+
+    def body(self, spec):
+        body = super().body(spec)
+        if _slice(self.slice_id, self.slices):
+            body["slice"] = _slice(self.slice_id, self.slices)
+        return body
+
+
+class PitSearchAfter(SlicedScroll):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        pit_id (str): The point-in-time every slice searches
+        slice_id (int): Which slice of the point-in-time this task fetches
+        slices (int): How many slices the point-in-time is split into
+    """
+
+    def __init__(self, start, end, pit_id, slice_id, slices):
+        super().__init__(start, end, slice_id, slices)
+        self.pit_id = pit_id
+
+    def __repr__(self):
+        return "PitSearchAfter({!r}, {!r}, {}, {})".format(
+            self.start, self.end, self.slice_id, self.slices
+        )
+
+    def _search_body(self, spec):
+        body = self.body(spec)
+        # PIT searches add an implicit `_shard_doc` tiebreaker, so the timestamp alone is a stable sort
+        body["sort"] = [{spec.timestamp_field: "asc"}]
+        body["size"] = PAGE_SIZE
+        return body
+
+    def pages(self, es, spec):
+        body = self._search_body(spec)
+        pit_id = self.pit_id
+        while True:
+            body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+            # A failed page is simply asked for again: `search_after` already says where to pick up
+            results = retry.call(
+                es.search, body=body, filter_path=SEARCH_AFTER_FILTER_PATH
+            )
+            pit_id = results.get("pit_id", pit_id)
+            docs = _hits(results)
+            if not docs:
+                return
+            yield docs
+            body["search_after"] = docs[-1]["sort"]
+
+    async def apages(self, es, spec):
+        body = self._search_body(spec)
+        pit_id = self.pit_id
+        while True:
+            body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+            results = await retry.acall(
+                es.search, body=body, filter_path=SEARCH_AFTER_FILTER_PATH
+            )
+            pit_id = results.get("pit_id", pit_id)
+            docs = _hits(results)
+            if not docs:
+                return
+            yield docs
+            body["search_after"] = docs[-1]["sort"]
+
+
+def default_workers(strategy, slices):
+    """
+    Args:
+        strategy (str): One of `STRATEGIES`
+        slices (int): How many slices sliced strategies split the range into
+    Returns:
+        workers (int): One worker per slice for sliced strategies; half of the system's processors otherwise
+    """
+    if strategy in ("hourly", "adaptive"):
+        return max(multiprocessing.cpu_count() // 2, 1)
+    return slices
+
+
+@contextlib.contextmanager
+def planned_tasks(
+    strategy,
+    spec,
+    start,
+    end,
+    slices=1,
+    target_docs=planner.DEFAULT_TARGET_DOCS,
+    host=DEFAULT_HOST,
+    batch_windows=None,
+):
+    """
+    Plans the tasks of a fetch, opening (and afterwards closing) any point-in-time they share
+    Args:
+        strategy (str): One of `STRATEGIES`
+        spec (DatasetSpec): The dataset to fetch
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        slices (int) [optional]: How many slices sliced strategies split the range into
+        target_docs (int) [optional]: About how many documents each adaptive window should hold
+        host (dict) [optional]: The ElasticSearch host to connect to
+        batch_windows (int) [optional]: The most hourly or adaptive windows to send in one `_msearch`, see
+            `batched_tasks`; defaults to 1 for hourly windows, which may hold any number of documents, and to
+            `DEFAULT_BATCH_WINDOWS` for adaptive ones, of which only those known to fit in a page are batched
+    Yields:
+        tasks (list): The tasks to hand to `engine.fetch` or `engine.stream`
+    """
+    if strategy == "hourly":
+        windows = [
+            (window_start, window_end, None)
+            for window_start, window_end in hourly_windows(start, end)
+        ]
+        yield batched_tasks(windows, 1 if batch_windows is None else batch_windows)
+    elif strategy == "adaptive":
+        es = client.get_client(host)
+        windows = planner.balanced_windows(es, spec, start, end, target=target_docs)
+        if batch_windows is None:
+            batch_windows = DEFAULT_BATCH_WINDOWS
+        yield batched_tasks(windows, batch_windows)
+    elif strategy == "sliced-scroll":
+        yield [SlicedScroll(start, end, i, slices) for i in range(slices)]
+    elif strategy == "search-after":
+        es = client.get_client(host)
+        pit_id = retry.call(
+            es.open_point_in_time, index=spec.index, keep_alive=PIT_KEEP_ALIVE
+        )["id"]
+        try:
+            yield [PitSearchAfter(start, end, pit_id, i, slices) for i in range(slices)]
+        finally:
+            _close_point_in_time(es, pit_id)
+    else:
+        raise ValueError(
+            "Unknown strategy {!r}; expected one of {}".format(
+                strategy, ", ".join(STRATEGIES)
+            )
+        )
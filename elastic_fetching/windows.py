@@ -0,0 +1,86 @@
+"""
+Helpers for cutting a large time range into smaller query windows.
+
+Every window is a half-open `(start, end)` tuple of naive datetimes: documents with `start <= timestamp < end`.
+"""
+
+import datetime
+
+
+def to_epoch_millis(moment):
+    """
+    Args:
+        moment (datetime.datetime): A (naive, local) datetime
+    Returns:
+        millis (int): Milliseconds since the epoch, which is what the CUIP indices store in `timestamp`
+    """
+    return int(moment.timestamp() * 1000)
+
+
+def split_range(start, end, step):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        step (datetime.timedelta): The width of each window
+    Returns:
+        windows (list): Consecutive `(start, end)` tuples covering the range; the last one may be shorter than `step`
+    """
+    windows = []
+    while start < end:
+        windows.append((start, min(start + step, end)))
+        start += step
+    return windows
+
+
+def hourly_windows(start, end):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+    Returns:
+        windows (list): One `(start, end)` tuple per hour
+    """
+    return split_range(start, end, datetime.timedelta(hours=1))
+
+
+def daily_windows(start, end):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+    Returns:
+        windows (list): One `(start, end)` tuple per day
+    """
+    return split_range(start, end, datetime.timedelta(days=1))
+
+
+def uncovered(start, end, covered):
+    """
+    Args:
+        start (datetime.datetime): The start of the range (inclusive)
+        end (datetime.datetime): The end of the range (exclusive)
+        covered (list): `(start, end)` tuples in order, not overlapping each other
+    Returns:
+        windows (list): The `(start, end)` stretches of the range none of `covered` overlaps
+    """
+    windows = []
+    for covered_start, covered_end in covered:
+        if start >= end:
+            break
+        if covered_start > start:
+            windows.append((start, min(covered_start, end)))
+        start = max(start, covered_end)
+    if start < end:
+        windows.append((start, end))
+    return windows
+
+
+def from_epoch_millis(millis):
+    """
+    Args:
+        millis (int): Milliseconds since the epoch
+    Returns:
+        moment (datetime.datetime): The matching naive, local datetime (the inverse of `to_epoch_millis`)
+    """
+    return datetime.datetime.fromtimestamp(millis / 1000.0)